@@ -0,0 +1,226 @@
+"""
+    Headless benchmark of standard workloads
+
+    Runs every .tsp instance in test_data and the continuous test functions
+    and LABS at several dimensions with a fixed seed, reports evaluations
+    and generations per second, peak traced memory and best fitness against
+    evaluations. Results are written to JSON, a stored result can be given
+    as baseline to flag throughput regressions.
+
+    python benchmark.py --output results.json
+    python benchmark.py --output new.json --baseline results.json
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from search.experiment import convergence_curve
+from search.search import SearchEngine
+from utils import fitness, initialization, perturbation, replacement, selection, tsplib
+from utils.condition import LoopCondition
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data")
+
+CONTINUOUS = {
+    "sphere": (fitness.sphere, -5.12, 5.12),
+    "rastrigin": (fitness.rastrigin, -5.12, 5.12),
+    "rosenbrock": (fitness.rosenbrock, -2.048, 2.048),
+    "griewank": (fitness.griewank, -600.0, 600.0),
+    "schwefel": (fitness.schwefel, -500.0, 500.0),
+}
+DIMENSIONS = (2, 10, 30)
+LABS_DIMENSIONS = (32, 64, 128)
+
+class Workload:
+    """
+    Benchmark workload, creates a fresh engine and initial population for a seed
+    """
+    def __init__(self, name : str, kind : str, dimension : int, build) -> "Workload":
+        self.name = name
+        self.kind = kind
+        self.dimension = dimension
+        self.build = build
+
+    def __repr__(self) -> str:
+        return self.name
+
+def _engine(function, mutation, crossover_operator, population_size, generations, seed):
+    return SearchEngine(function, mutation=mutation, condition=LoopCondition(generations),
+        selection=selection.Selector(selection.tournament, population_size, tourn_size=3),
+        replacer=replacement.Replacer(replacement.elite, crossover_operator=crossover_operator,
+                                      elite_count=max(1, population_size // 10)),
+        hooks=[], rng=seed)
+
+def tsp_workload(path : str) -> Workload:
+    def build(population_size, generations, seed):
+        problem = tsplib.load(path, cache=False)
+        engine = _engine(problem.fitness_function(), perturbation.Mutator(perturbation.tsp_swap, 0.01),
+                         "ox", population_size, generations, seed)
+        return engine, initialization.populate_array(population_size, problem.random_route, rng=engine.rng)
+    name = os.path.splitext(os.path.basename(path))[0]
+    return Workload("tsp/" + name, "tsp", None, build)
+
+def continuous_workload(name : str, dimension : int) -> Workload:
+    function, lower_bound, upper_bound = CONTINUOUS[name]
+    def build(population_size, generations, seed):
+        fitness_function = fitness.FitnessFunction(function, coefficients=[0.0] * dimension)
+        engine = _engine(fitness_function, perturbation.Mutator(perturbation.gaussian, 0.0, deviation=1.0),
+                         "uniform", population_size, generations, seed)
+        return engine, initialization.populate_array(population_size,
+            lambda rng: initialization.real_vector(dimension, lower_bound, upper_bound, rng), rng=engine.rng)
+    return Workload("{}/{}".format(name, dimension), "continuous", dimension, build)
+
+def labs_workload(dimension : int) -> Workload:
+    def build(population_size, generations, seed):
+        engine = _engine(fitness.FitnessFunction(fitness.labs),
+                         perturbation.Mutator(perturbation.bitflip_multiple, 1 / dimension),
+                         "uniform", population_size, generations, seed)
+        return engine, initialization.populate_array(population_size,
+            lambda rng: initialization.chromosome(dimension, rng), rng=engine.rng)
+    return Workload("labs/{}".format(dimension), "binary", dimension, build)
+
+def workloads() -> "list[Workload]":
+    """
+    All standard workloads
+    """
+    result = [tsp_workload(path) for path in sorted(glob.glob(os.path.join(TEST_DATA, "*.tsp")))]
+    for name in CONTINUOUS:
+        result += [continuous_workload(name, dimension) for dimension in DIMENSIONS]
+    result += [labs_workload(dimension) for dimension in LABS_DIMENSIONS]
+    return result
+
+def measure(workload : Workload, population_size : int, generations : int, seed : int,
+            repeats : int = 5, memory_generations : int = 3) -> dict:
+    """
+    Runs the workload, throughput is the median of the repeats and spread
+    their range relative to it, peak memory is traced in a separate short run
+    """
+    runs = []
+    for _ in range(repeats):
+        engine, initial = workload.build(population_size, generations, seed)
+        started = time.perf_counter()
+        engine.evolve(engine.start_ea(initial))
+        seconds = time.perf_counter() - started
+        runs.append((seconds, engine))
+    runs.sort(key=lambda run: run[0])
+    seconds, engine = runs[len(runs) // 2]
+
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    traced, initial = workload.build(population_size, memory_generations, seed)
+    traced.evolve(traced.start_ea(initial))
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    if not tracing:
+        tracemalloc.stop()
+
+    evaluations = engine.fitness_function.calls_made
+    generations_made = len(engine.timer)
+    return {
+        "name": workload.name,
+        "kind": workload.kind,
+        "dimension": workload.dimension,
+        "population": population_size,
+        "generations": generations_made,
+        "evaluations": evaluations,
+        "seconds": seconds,
+        "evaluations_per_second": evaluations / seconds,
+        "generations_per_second": generations_made / seconds,
+        "spread": (runs[-1][0] - runs[0][0]) / seconds,
+        "peak_memory": peak_memory,
+        "best": float(engine.best.fitness),
+        "saved_evaluations": engine.timer.totals().get("saved", 0),
+        "phases": {key: value for key, value in engine.timer.totals().items()
+                   if key not in ("evaluations", "saved")},
+        "curve": convergence_curve(engine).tolist(),
+    }
+
+def run(selected : "list[Workload]", population_size : int, generations : int, seed : int,
+        repeats : int = 5) -> dict:
+    results = []
+    for workload in selected:
+        result = measure(workload, population_size, generations, seed, repeats)
+        print("{:<16} {:>12.0f} evals/s {:>10.1f} gens/s {:>10.1f} KiB  best {:.6g}".format(
+            result["name"], result["evaluations_per_second"], result["generations_per_second"],
+            result["peak_memory"] / 1024, result["best"]))
+        results.append(result)
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "population": population_size,
+            "generations": generations,
+            "seed": seed,
+            "repeats": repeats,
+        },
+        "results": results,
+    }
+
+def compare(current : dict, baseline : dict, tolerance : float = 0.1) -> "list[str]":
+    """
+    Compares median throughput with the baseline, returns list of regressions.
+    Throughput lower by more than the tolerance, or by more than the spread
+    of the repeats of either result when that is larger, is a regression.
+    Different best fitness for the same seed and settings is reported as
+    changed result
+    """
+    regressions = []
+    stored = {result["name"]: result for result in baseline["results"]}
+    same_setup = all(current["meta"][key] == baseline["meta"].get(key)
+                     for key in ("population", "generations", "seed"))
+    for result in current["results"]:
+        reference = stored.get(result["name"])
+        if reference is None:
+            continue
+        ratio = result["evaluations_per_second"] / reference["evaluations_per_second"]
+        threshold = max(tolerance, result.get("spread", 0.0), reference.get("spread", 0.0))
+        status = "ok"
+        if ratio < 1.0 - threshold:
+            status = "REGRESSION"
+            regressions.append("{}: {:.0f} evals/s, baseline {:.0f} evals/s ({:+.1%}, threshold {:.1%})".format(
+                result["name"], result["evaluations_per_second"],
+                reference["evaluations_per_second"], ratio - 1.0, threshold))
+        if same_setup and result["best"] != reference["best"]:
+            status += ", changed best {:.6g} -> {:.6g}".format(reference["best"], result["best"])
+        print("{:<16} {:+8.1%}  {}".format(result["name"], ratio - 1.0, status))
+    return regressions
+
+def main(arguments : "list[str]" = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", default="benchmark.json", help="result file")
+    parser.add_argument("--baseline", help="stored result to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="allowed throughput loss, raised to the spread of the repeats")
+    parser.add_argument("--population", type=int, default=50)
+    parser.add_argument("--generations", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=5, help="runs per workload, median is compared")
+    parser.add_argument("--filter", default="", help="run workloads whose name contains the text")
+    options = parser.parse_args(arguments)
+
+    selected = [workload for workload in workloads() if options.filter in workload.name]
+    current = run(selected, options.population, options.generations, options.seed, options.repeats)
+    with open(options.output, "w") as file:
+        json.dump(current, file, indent=1)
+
+    if options.baseline is None:
+        return 0
+    with open(options.baseline, "r") as file:
+        baseline = json.load(file)
+    regressions = compare(current, baseline, options.tolerance)
+    for regression in regressions:
+        print(regression)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,14 +6,16 @@ from math import floor
 import matplotlib
 import matplotlib.pyplot as plt
 
+from search.experiment import Convergence
+from search.recorder import read_log
 from search.search import SearchEngine, SearchResult
 
 class Visual:
     """
     Displays search results using matplotlib
     """
-    def __init__(self) -> "Visual":
-        self.display_backend = "TkAgg"
+    def __init__(self, backend : str = "TkAgg") -> "Visual":
+        self.display_backend = backend
         matplotlib.use(self.display_backend)
 
     def plot_fitness(self, search : SearchEngine):
@@ -55,17 +57,46 @@ class Visual:
         verticalalignment='bottom', snap=False)
         plt.show()
 
-    def comparison(self, searches : SearchResult):
+    def comparison(self, searches : "list[SearchResult | Convergence]"):
         """
-        Displays comparison between different searches
+        Displays comparison between different searches, aggregated runs
+        of an experiment as median with interquartile band
         """
-
         for pos, value in enumerate(searches):
-            points = (value.time_stamps + [value.generations],
-                value.fitnesses + [value.fitnesses[-1]])
-            plt.plot(points[0], points[1]
-            , "-", label=value.name)
+            if isinstance(value, Convergence):
+                line, = plt.plot(value.evaluations, value.median, "-", label=value.name)
+                plt.fill_between(value.evaluations, value.lower, value.upper,
+                                 color=line.get_color(), alpha=0.25)
+                plt.xlabel("Function calls")
+            else:
+                points = (value.time_stamps + [value.generations],
+                    value.fitnesses + [value.fitnesses[-1]])
+                plt.plot(points[0], points[1]
+                , "-", label=value.name)
+                plt.xlabel("Generations")
             plt.legend(loc = "best")
-            plt.xlabel("Generations")
             plt.ylabel("Fitness value")
         plt.show()
+
+    def plot_log(self, paths : "str | list[str]", output : str = None):
+        """
+        Displays best fitness against evaluations from logs written
+        by StreamRecorder, one line per run, or saves the plot to output
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+        for path in paths:
+            log = read_log(path)
+            for run in sorted(set(log["run"].tolist())):
+                rows = log["run"] == run
+                label = path if len(paths) > 1 else "run " + str(run)
+                plt.plot(log["evaluations"][rows], log["fitness"][rows], "-", label=label)
+        plt.legend(loc = "best")
+        plt.title("Best fitness")
+        plt.xlabel("Function calls")
+        plt.ylabel("Fitness value")
+        if output is None:
+            plt.show()
+        else:
+            plt.savefig(output)
+            plt.close()
@@ -1,7 +1,7 @@
 """
     Example search runs
 """
-import random
+from functools import partial
 from typing import MutableMapping
 from display.display import Visual
 from utils import crossover, fitness, initialization, replacement
@@ -9,8 +9,11 @@ from utils import perturbation
 from utils import mapping
 from utils import selection
 from utils.condition import *
+from search.experiment import Configuration, Experiment
 from search.search import SearchEngine
 from utils.population import City
+from utils.tsp import TSPProblem
+from utils import tsplib
 
 
 def sanity_check_search():
@@ -48,9 +51,9 @@ def some_real_search():
     """
     init_solution = [1]*6
     func = fitness.FitnessFunction(fitness.sphere, coefficients=[0]*6)
-    perturbation = lambda x : perturbation.gaussian(x, deviation = 0.5)
+    mutation = perturbation.BatchMutator(perturbation.gaussian_batch, deviation = 0.5)
 
-    search = SearchEngine(func, perturbation, LoopCondition(300))
+    search = SearchEngine(func, mutation, LoopCondition(300))
     print(search.local_one_fifth(init_solution, 1*(10**(-9))))
 
     display = Visual()
@@ -58,22 +61,18 @@ def some_real_search():
 
 def multiple_comp():
     """
-    Multiple run comparison
+    Multiple run comparison, six seeds of the same local search
     """
-    init_solution = [1] * 32
     func = fitness.FitnessFunction(fitness.rosenbrock,
-            mapping = lambda x : mapping.binary_to_interval(x,[0,0,0,0],[12,12,12,12]))
-    mutation = perturbation.bitflip_single
-    search = SearchEngine(func, mutation, LoopCondition(50))
-    
-    search.local(init_solution)
-    searches = [search.snapshot()]
-    for i in range(5):
-        search.local(init_solution)
-        searches += [search.snapshot()]
-        
+            mapping = mapping.interval([0,0,0,0],[12,12,12,12]))
+    search = SearchEngine(func, perturbation.Mutator(perturbation.bitflip_single, 0), LoopCondition(50),
+                          hooks = [])
+    configuration = Configuration("local", search, [1] * 32, "local")
+    experiment = Experiment([configuration], 6, "./results/multiple_comp")
+    experiment.run()
+
     display = Visual()
-    display.comparison(searches = searches)
+    display.comparison(searches = experiment.convergence())
 
 def some_simple_ea():
     member_length = 12
@@ -85,7 +84,7 @@ def some_simple_ea():
     search = SearchEngine(func, mutation=mutation, condition=LoopCondition(loop_length),
                           crossover=crossover.single_point, selection=selection.randomSelect)
     
-    search.local([random.randint(0,1) in range(member_length)])
+    search.local(initialization.chromosome(member_length))
     searches = [search.snapshot()]
     
     search.simple_ea(init_solution)
@@ -93,65 +92,42 @@ def some_simple_ea():
     display = Visual()
     display.comparison(searches = searches)
 
-def run_tsp_comparison(cities):
-    loop_length = 100
-    mutation_probability = 0.01
-    tournament_size = 40
-    elite_count = 40
+def tsp_engine(problem, tournament_size, mutation_probability, elite_count = 40,
+               population_size = 100, loop_length = 100):
+    """
+    Engine of the tsp comparison, each configuration gets its own operators
+    """
+    return SearchEngine(problem.fitness_function(),
+        mutation = perturbation.Mutator(perturbation.tsp_swap, mutation_probability),
+        condition = LoopCondition(loop_length),
+        selection = selection.Selector(selection.tournament, population_size, tourn_size = tournament_size),
+        replacer = replacement.Replacer(replacement.elite, crossover_operator = "ox", elite_count = elite_count),
+        hooks = [])
+
+def run_tsp_comparison(problem : TSPProblem, seeds = 5):
     population_size = 100
-    
-    init_solution = initialization.populate_array(population_size, lambda :initialization.tsp_route(cities))
-    func = fitness.FitnessFunction(fitness.tsp_route_distance)
-    mutation = perturbation.Mutator(perturbation.tsp_swap, mutation_probability)
-    crossover_operator = crossover.tsp_breed
-    replacement_strategy = replacement.Replacer(replacement.elite, crossover_operator=crossover_operator, elite_count = elite_count)
-    select = selection.Selector(selection.tournament, population_size, tourn_size = tournament_size)
-    
-    
-    search = SearchEngine(func, mutation=mutation, condition=LoopCondition(loop_length),
-                          selection=select, replacer=replacement_strategy)
+    initial = partial(initialization.populate_array, population_size, problem.random_route)
+
+    configurations = [
+        Configuration("Local", tsp_engine(problem, 40, 0.01), problem.random_route, "local"),
+        Configuration("EA", tsp_engine(problem, 40, 0.01), initial),
+        Configuration("tournament size 60", tsp_engine(problem, 60, 0.01), initial),
+        Configuration("mutation rate = 1", tsp_engine(problem, 40, 1), initial),
+    ]
+    experiment = Experiment(configurations, seeds, "./results/tsp_comparison")
+    for summary in experiment.run():
+        print("{name:<20} seed {seed}: best {best:.1f} after {evaluations} evaluations".format(**summary))
 
-    searches = []
-
-    search.local(initialization.tsp_route(cities))
-    result = search.snapshot()
-    result.name = "Local"
-    searches += [result]
-    
-    search.simple_ea(init_solution)
-    result = search.snapshot()
-    result.name = "EA"
-    searches += [result]
-    
-    select.tourn_size = 60
-    search.simple_ea(init_solution)
-    result = search.snapshot()
-    result.name = "tournament size 60"
-    searches += [result]
-    
-    mutation.probability = 1
-    search.simple_ea(init_solution)
-    result = search.snapshot()
-    result.name = "mutation rate = 1"
-    searches += [result]
-    
     display = Visual()
-    display.comparison(searches = searches)
+    display.comparison(searches = experiment.convergence())
 
-def read_euc_tsp(file_name):
+def read_tsp(file_name):
+    """
+    Loads TSPLIB instance from test data, distances follow its EDGE_WEIGHT_TYPE
+    """
     path = "./test_data/"
-    file = open(path + str(file_name), "r")
-    line = file.readline()
-    cities = []
-    with open(path + str(file_name), "r") as file:
-        for line in file:
-            line = line.strip()
-            if(line[:1].isdigit()):
-                line = line.split()
-                cities.append(City(line[0], line[1], line[2]))
-    file.close()
-    return cities
+    return tsplib.load(path + str(file_name))
 
 if __name__ == "__main__":
-    cities = read_euc_tsp("eil101.tsp")
-    run_tsp_comparison(cities)
+    problem = read_tsp("eil101.tsp")
+    run_tsp_comparison(problem)
@@ -0,0 +1,221 @@
+"""
+Checkpoints of SearchEngine runs
+
+A checkpoint is a npz file with the population genomes and fitness,
+the best individual, the improvement curve, the surrogate archive and
+a JSON header holding the generator state, condition counters,
+evaluation counters, generation timer records and surrogate counters.
+Recorder steps and hook state are not checkpointed.
+Genomes of objects (City routes) are stored as integer arrays through
+a codec with encode/decode methods, e.g. TSPProblem.
+"""
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from search.instrumentation import Hook
+from utils.population import Individual, Population
+
+VERSION = 1
+
+def _encode(genomes, codec):
+    genomes = np.asarray(genomes)
+    if genomes.dtype != object:
+        return genomes, False
+    if codec is None:
+        raise ValueError("Genomes of objects need a codec with encode and decode to be checkpointed")
+    return np.array([codec.encode(genome) for genome in genomes]), True
+
+def _decode(genomes, encoded : bool, codec):
+    if not encoded:
+        return genomes
+    if codec is None:
+        raise ValueError("Checkpoint holds encoded genomes, a codec is needed to decode them")
+    return [codec.decode(genome) for genome in genomes]
+
+def save(path : str, engine, population : Population, codec = None):
+    """
+    Writes checkpoint of the engine and its population, the file is
+    replaced atomically so a killed run leaves the previous checkpoint
+    """
+    genomes, encoded = _encode(population.genomes, codec)
+    best, _ = _encode([engine.best.value], codec)
+    header = {
+        "version": VERSION,
+        "encoded": encoded,
+        "best_fitness": engine.best.fitness,
+        "terminated": engine.terminated,
+        "rng": engine.rng.bit_generator.state,
+        "condition": engine.condition.state(),
+        "calls_made": engine.fitness_function.calls_made,
+        "delta_calls": engine.fitness_function.delta_calls,
+        "timer": engine.timer.state(),
+    }
+    arrays = {}
+    if engine.surrogate is not None:
+        surrogate = engine.surrogate.state()
+        for key in ("archive", "archive_fitness", "correlations"):
+            value = surrogate.pop(key)
+            if value is not None:
+                arrays["surrogate_" + key] = np.asarray(value, dtype=np.float64)
+        header["surrogate"] = surrogate
+    temporary = path + ".tmp.npz"
+    np.savez_compressed(temporary, header=np.array(json.dumps(header)),
+                        genomes=genomes, fitness=population.fitness, best=best[0],
+                        fitnesses=np.asarray(engine.fitnesses, dtype=np.float64),
+                        time_stamps=np.asarray(engine.time_stamps, dtype=np.int64), **arrays)
+    os.replace(temporary, path)
+
+def load(path : str, engine, codec = None) -> Population:
+    """
+    Restores state of the engine from checkpoint, the engine must be
+    set up as the one that wrote it. Returns the population to evolve.
+    """
+    with np.load(path) as checkpoint:
+        header = json.loads(checkpoint["header"].item())
+        if header["version"] != VERSION:
+            raise ValueError("Unsupported checkpoint version: " + str(header["version"]))
+        encoded = header["encoded"]
+        genomes = _decode(checkpoint["genomes"], encoded, codec)
+        population = Population(genomes, checkpoint["fitness"])
+        best = _decode(checkpoint["best"][np.newaxis], encoded, codec)[0]
+        fitnesses = checkpoint["fitnesses"].tolist()
+        time_stamps = checkpoint["time_stamps"].tolist()
+        surrogate = header.get("surrogate")
+        if surrogate is not None:
+            for key in ("archive", "archive_fitness", "correlations"):
+                name = "surrogate_" + key
+                surrogate[key] = checkpoint[name] if name in checkpoint.files else None
+            surrogate["correlations"] = [] if surrogate["correlations"] is None else surrogate["correlations"].tolist()
+
+    engine.clear()
+    engine.rng.bit_generator.state = header["rng"]
+    engine.condition.restore(header["condition"])
+    if hasattr(engine.condition, "current_solution"):
+        engine.condition.current_solution = best
+    engine.fitness_function.calls_made = header["calls_made"]
+    engine.fitness_function.delta_calls = header["delta_calls"]
+    engine.best = Individual(best, header["best_fitness"])
+    engine.terminated = header["terminated"]
+    engine.recorder.fitnesses.extend(fitnesses)
+    engine.recorder.time_stamps[:] = time_stamps
+    engine.recorder.solutions.append(best)
+    engine.timer.restore(header["timer"])
+    if engine.surrogate is not None and surrogate is not None:
+        engine.surrogate.restore(surrogate)
+    return population
+
+class CheckpointHook(Hook):
+    """
+    Writes checkpoint every interval generations and when the search ends
+    """
+    def __init__(self, path : str, interval : int = 100, codec = None) -> "CheckpointHook":
+        self.path = path
+        self.interval = interval
+        self.codec = codec
+        self.population = None
+
+    def __repr__(self) -> str:
+        return "checkpoint every {} generations to {}".format(self.interval, self.path)
+
+    def start(self, engine, population):
+        self.population = population
+
+    def generation(self, engine, population, record : dict):
+        self.population = population
+        if engine.condition.calls % self.interval == 0:
+            save(self.path, engine, population, self.codec)
+
+    def finish(self, engine):
+        if self.population is not None:
+            save(self.path, engine, self.population, self.codec)
+            self.population = None
+
+def test_resume(directory : str):
+    """
+    Test that resumed run continues as the uninterrupted one
+    """
+    from search.search import SearchEngine
+    from utils import perturbation, replacement, selection
+    from utils.fitness import FitnessFunction
+    from utils.condition import LoopCondition
+    from utils.population import City
+    from utils.tsp import TSPProblem
+
+    print("Testing checkpoint resume")
+    rng = np.random.default_rng(3)
+    problem = TSPProblem([City(i, x, y) for i, (x, y) in enumerate(rng.random((30, 2)).tolist())])
+    initial = [problem.decode(rng.permutation(30)) for _ in range(20)]
+    path = os.path.join(directory, "checkpoint.npz")
+
+    def engine(hooks):
+        return SearchEngine(FitnessFunction(problem.route_distance, mapping = problem.encode), perturbation.Mutator(perturbation.tsp_swap, 0.05),
+            LoopCondition(30), replacement.Replacer(replacement.elite, "ox", 2),
+            selection.Selector(selection.tournament, 20, tourn_size = 3), rng = 7, hooks = hooks)
+
+    complete = engine([])
+    complete.simple_ea(initial)
+
+    interrupted = engine([CheckpointHook(path, 10, codec = problem)])
+    interrupted.evolve(interrupted.start_ea(initial), 15)
+
+    resumed = engine([])
+    resumed.resume(path, codec = problem)
+    assert resumed.fitnesses == complete.fitnesses
+    assert resumed.time_stamps == complete.time_stamps
+    assert resumed.fitness_function.calls_made == complete.fitness_function.calls_made
+    assert problem.encode(resumed.best.value).tolist() == problem.encode(complete.best.value).tolist()
+    assert len(resumed.timer) == len(complete.timer) == 30
+    assert [record["best"] for record in resumed.timer.records] == [record["best"] for record in complete.timer.records]
+    assert resumed.timer.totals()["evaluations"] == complete.timer.totals()["evaluations"]
+
+def test_resume_surrogate(directory : str):
+    """
+    Test that the surrogate archive and counters are resumed
+    """
+    from search.search import SearchEngine
+    from utils import fitness, perturbation, replacement, selection
+    from utils.condition import LoopCondition
+    from utils.surrogate import Surrogate
+
+    print("Testing checkpoint resume with surrogate")
+    initial = list(np.random.default_rng(5).uniform(-5, 5, (20, 4)))
+    path = os.path.join(directory, "surrogate.npz")
+
+    def engine(hooks):
+        return SearchEngine(fitness.FitnessFunction(fitness.sphere, coefficients = [0.0] * 4),
+            perturbation.Mutator(perturbation.gaussian, 0.5, deviation = 0.5), LoopCondition(12),
+            replacement.Replacer(replacement.elite, "uniform", 2), selection.Selector(selection.tournament, 20),
+            rng = 11, hooks = hooks, surrogate = Surrogate(archive_size = 100, min_samples = 40))
+
+    complete = engine([])
+    complete.simple_ea(initial)
+    assert complete.surrogate.surrogate_evaluations > 0
+
+    interrupted = engine([CheckpointHook(path, 5)])
+    interrupted.evolve(interrupted.start_ea(initial), 7)
+
+    resumed = engine([])
+    resumed.resume(path)
+    assert resumed.fitnesses == complete.fitnesses
+    assert resumed.fitness_function.calls_made == complete.fitness_function.calls_made
+    assert resumed.surrogate.report() == complete.surrogate.report()
+    assert np.array_equal(resumed.surrogate.archive, complete.surrogate.archive)
+    assert resumed.timer.totals()["saved"] == complete.timer.totals()["saved"]
+
+def run_tests():
+    """
+    Run tests for checkpoints
+    """
+    print("Running tests...")
+    print("================")
+    with tempfile.TemporaryDirectory() as directory:
+        test_resume(directory)
+        test_resume_surrogate(directory)
+    print("================")
+    print("Tests were succesfull")
+
+if __name__ == "__main__":
+    run_tests()
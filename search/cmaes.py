@@ -0,0 +1,171 @@
+"""
+Covariance matrix adaptation evolution strategy
+
+CMAES holds the state of the strategy (mean, step size, evolution paths
+and covariance), ask samples a generation as a matrix and tell updates
+the state from its fitness. SearchEngine.cmaes drives it with restarts.
+"""
+import math
+
+import numpy as np
+
+from utils import randomness
+
+class CMAES:
+    """
+    (mu/mu_w, lambda)-CMA-ES, full covariance or diagonal (sep-CMA-ES)
+    with learning rates increased by (n + 2) / 3 as in Ros & Hansen
+
+    Args:
+        mean (list[float]): initial mean
+        sigma (float): initial step size
+        population_size (int): lambda, 4 + 3 ln(n) by default
+        diagonal (bool): adapt only the diagonal of the covariance
+    """
+    def __init__(self, mean, sigma : float, population_size : int = None, diagonal : bool = False,
+                 rng : np.random.Generator = None) -> "CMAES":
+        self.rng = randomness.resolve(rng)
+        self.mean = np.array(mean, dtype=np.float64)
+        self.sigma = float(sigma)
+        self.initial_sigma = float(sigma)
+        self.diagonal = diagonal
+        n = self.dimension = len(self.mean)
+        self.population_size = population_size or 4 + int(3 * math.log(n))
+        self.parent_count = self.population_size // 2
+
+        weights = math.log(self.parent_count + 0.5) - np.log(np.arange(1, self.parent_count + 1))
+        self.weights = weights / weights.sum()
+        self.mueff = 1.0 / np.sum(self.weights ** 2)
+        mueff = self.mueff
+
+        self.cc = (4 + mueff / n) / (n + 4 + 2 * mueff / n)
+        self.cs = (mueff + 2) / (n + mueff + 5)
+        self.c1 = 2 / ((n + 1.3) ** 2 + mueff)
+        self.cmu = min(1 - self.c1, 2 * (mueff - 2 + 1 / mueff) / ((n + 2) ** 2 + mueff))
+        if diagonal:
+            self.c1 = min(1.0, self.c1 * (n + 2) / 3)
+            self.cmu = min(1 - self.c1, self.cmu * (n + 2) / 3)
+        self.damps = 1 + 2 * max(0.0, math.sqrt((mueff - 1) / (n + 1)) - 1) + self.cs
+        self.chi = math.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n * n))
+
+        self.ps = np.zeros(n)
+        self.pc = np.zeros(n)
+        self.scales = np.ones(n)
+        if diagonal:
+            self.covariance = np.ones(n)
+        else:
+            self.covariance = np.eye(n)
+            self.basis = np.eye(n)
+        self.eigen_interval = max(1, int(1 / (10 * n * (self.c1 + self.cmu))))
+        self.generation = 0
+        self.history = []
+        self.range = math.inf
+        self.steps = None
+
+    def __repr__(self) -> str:
+        return "{}CMA-ES, lambda: {}, sigma: {:.3g}".format("sep-" if self.diagonal else "",
+            self.population_size, self.sigma)
+
+    def ask(self, lower_bound = None, upper_bound = None) -> np.ndarray:
+        """
+        Samples population matrix of population_size rows, samples outside
+        of the bounds are clipped and the update uses the clipped steps
+        """
+        normal = self.rng.standard_normal((self.population_size, self.dimension))
+        if self.diagonal:
+            self.steps = normal * self.scales
+        else:
+            self.steps = (normal * self.scales) @ self.basis.T
+        samples = self.mean + self.sigma * self.steps
+        if lower_bound is not None and upper_bound is not None:
+            samples = np.clip(samples, lower_bound, upper_bound)
+            self.steps = (samples - self.mean) / self.sigma
+        return samples
+
+    def tell(self, fitness : np.ndarray):
+        """
+        Updates the strategy from fitness of the last sampled population
+        """
+        n = self.dimension
+        order = np.argsort(fitness, kind="stable")
+        selected = self.steps[order[:self.parent_count]]
+        step = self.weights @ selected
+        self.mean = self.mean + self.sigma * step
+        self.generation += 1
+
+        if self.diagonal:
+            whitened = step / self.scales
+        else:
+            whitened = self.basis @ ((self.basis.T @ step) / self.scales)
+        self.ps = (1 - self.cs) * self.ps + math.sqrt(self.cs * (2 - self.cs) * self.mueff) * whitened
+        norm = np.linalg.norm(self.ps)
+        hsig = norm / math.sqrt(1 - (1 - self.cs) ** (2 * self.generation)) / self.chi < 1.4 + 2 / (n + 1)
+        self.pc = (1 - self.cc) * self.pc + hsig * math.sqrt(self.cc * (2 - self.cc) * self.mueff) * step
+
+        correction = (1 - hsig) * self.cc * (2 - self.cc)
+        decay = 1 - self.c1 - self.cmu
+        if self.diagonal:
+            self.covariance = (decay * self.covariance
+                + self.c1 * (self.pc ** 2 + correction * self.covariance)
+                + self.cmu * (self.weights @ selected ** 2))
+            self.scales = np.sqrt(np.maximum(self.covariance, 1e-300))
+        else:
+            self.covariance = (decay * self.covariance
+                + self.c1 * (np.outer(self.pc, self.pc) + correction * self.covariance)
+                + self.cmu * (selected.T * self.weights) @ selected)
+            if self.generation % self.eigen_interval == 0:
+                self.covariance = (self.covariance + self.covariance.T) / 2
+                eigenvalues, self.basis = np.linalg.eigh(self.covariance)
+                self.scales = np.sqrt(np.maximum(eigenvalues, 1e-300))
+
+        self.sigma *= math.exp(min(1.0, (self.cs / self.damps) * (norm / self.chi - 1)))
+        self.history.append(float(fitness[order[0]]))
+        self.range = float(fitness[order[-1]] - fitness[order[0]])
+
+    def stop(self, tolerance_fitness : float = 1e-12, tolerance_x : float = 1e-12) -> bool:
+        """
+        Stagnation criteria used to trigger restarts: flat fitness,
+        tiny steps or ill-conditioned covariance
+        """
+        window = 10 + int(math.ceil(30 * self.dimension / self.population_size))
+        recent = self.history[-window:]
+        if len(self.history) >= window and max(recent) - min(recent) < tolerance_fitness \
+                and self.range < tolerance_fitness:
+            return True
+        spread = self.sigma * max(np.max(np.abs(self.pc)), np.max(self.scales))
+        if spread < tolerance_x * self.initial_sigma:
+            return True
+        if np.max(self.scales) > 1e7 * np.min(self.scales):
+            return True
+        return not np.all(np.isfinite(self.mean))
+
+def test_cmaes():
+    """
+    Test convergence on ellipsoid and rotated problems
+    """
+    print("Testing CMA-ES")
+    rng = np.random.default_rng(2)
+    scales = 10 ** np.linspace(0, 3, 10)
+    rotation = np.linalg.qr(rng.standard_normal((10, 10)))[0]
+    ellipsoid = lambda x: ((x * scales) ** 2).sum(axis=1)
+    rotated = lambda x: ((x @ rotation * scales) ** 2).sum(axis=1)
+    for function, diagonal in ((ellipsoid, True), (ellipsoid, False), (rotated, False)):
+        strategy = CMAES(np.ones(10), 1.0, diagonal = diagonal, rng = rng)
+        for _ in range(1500):
+            strategy.tell(function(strategy.ask()))
+            if strategy.history[-1] < 1e-10:
+                break
+        assert strategy.history[-1] < 1e-10, (diagonal, strategy.history[-1])
+
+def run_tests():
+    """
+    Run tests for CMA-ES
+    """
+    print("Running tests...")
+    print("================")
+    test_cmaes()
+    print("================")
+    print("Tests were succesfull")
+
+if __name__ == "__main__":
+    run_tests()
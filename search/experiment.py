@@ -0,0 +1,302 @@
+"""
+Multi-run experiments
+
+An experiment runs every configuration with every seed. Each run gets
+its own copy of the configuration's engine, so runs are isolated and can
+execute in parallel in a process pool. Every finished run is written to
+the experiment directory as soon as it arrives (one npz file per run and
+a line in results.jsonl), convergence curves of the runs are aggregated
+to median and interquartile range on a common evaluation axis.
+"""
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from copy import deepcopy
+
+import numpy as np
+
+from search.search import SearchEngine, SearchResult
+
+class Configuration:
+    """
+    Named search setup
+
+    Args:
+        name (str): label of the configuration
+        engine (SearchEngine): template engine, every run works on its own copy
+        initial: initial population or solution, or function of a generator returning it
+        method (str): search method of the engine, e.g. simple_ea, local, steady_state, cmaes
+        arguments: further arguments of the method
+    """
+    def __init__(self, name : str, engine : SearchEngine, initial, method : str = "simple_ea",
+                 **arguments) -> "Configuration":
+        self.name = name
+        self.engine = engine
+        self.initial = initial
+        self.method = method
+        self.arguments = arguments
+
+    def __repr__(self) -> str:
+        return "{}: {}".format(self.name, self.method)
+
+class Convergence:
+    """
+    Median and quartiles of best fitness of runs against evaluations
+    """
+    def __init__(self, name : str, evaluations : np.ndarray, median : np.ndarray,
+                 lower : np.ndarray, upper : np.ndarray, runs : int) -> "Convergence":
+        self.name = name
+        self.evaluations = evaluations
+        self.median = median
+        self.lower = lower
+        self.upper = upper
+        self.runs = runs
+
+    def __repr__(self) -> str:
+        return "{}: {} runs, median best {:.6g}".format(self.name, self.runs, self.median[-1])
+
+def convergence_curve(engine : SearchEngine) -> np.ndarray:
+    """
+    Best fitness against evaluations of the last run of the engine, points
+    where the best fitness changed and the last evaluation. Population
+    searches use the improvements kept by the timer, local searches
+    the time stamps of improvements.
+    """
+    evaluations = engine.fitness_function.calls_made
+    if len(engine.timer):
+        spent = evaluations - engine.timer.totals()["evaluations"]
+        curve = [(spent, engine.fitnesses[0])]
+        for generation_evaluations, best in engine.timer.improvements:
+            if best < curve[-1][1]:
+                curve.append((spent + generation_evaluations, best))
+    else:
+        curve = [(stamp + 1, fitness) for stamp, fitness in zip(engine.time_stamps, engine.fitnesses)]
+    if curve[-1][0] != evaluations:
+        curve.append((evaluations, curve[-1][1]))
+    return np.array(curve, dtype=np.float64)
+
+def aggregate(name : str, curves : "list[np.ndarray]", points : int = 200) -> Convergence:
+    """
+    Aggregates convergence curves on a common evaluation axis, a run keeps
+    its last best fitness after it ended
+    """
+    start = min(curve[0, 0] for curve in curves)
+    end = max(curve[-1, 0] for curve in curves)
+    evaluations = np.linspace(start, end, points)
+    values = np.full((len(curves), points), np.nan)
+    for row, curve in enumerate(curves):
+        positions = np.searchsorted(curve[:, 0], evaluations, side="right") - 1
+        known = positions >= 0
+        values[row, known] = curve[positions[known], 1]
+    lower, median, upper = np.nanpercentile(values, [25, 50, 75], axis=0)
+    return Convergence(name, evaluations, median, lower, upper, len(curves))
+
+def save_result(path : str, result : SearchResult):
+    """
+    Writes result of a run with its convergence curve, the best solution
+    is kept when it is numeric
+    """
+    header = {"name": result.name, "seed": result.seed, "generations": result.generations,
+              "evaluations": result.evaluations}
+    arrays = {"fitnesses": np.asarray(result.fitnesses, dtype=np.float64),
+              "time_stamps": np.asarray(result.time_stamps, dtype=np.int64), "curve": result.curve}
+    if len(result.solutions):
+        best = np.asarray(result.solutions[-1])
+        if best.dtype != object:
+            arrays["best"] = best
+    temporary = path + ".tmp.npz"
+    np.savez_compressed(temporary, header=np.array(json.dumps(header)), **arrays)
+    os.replace(temporary, path)
+
+def load_result(path : str) -> SearchResult:
+    """
+    Reads result written by save_result, steps are not stored
+    """
+    with np.load(path) as stored:
+        header = json.loads(stored["header"].item())
+        solutions = [stored["best"]] if "best" in stored.files else []
+        result = SearchResult([], solutions, stored["fitnesses"].tolist(), header["generations"],
+                              stored["time_stamps"].tolist(), header["evaluations"])
+        result.curve = stored["curve"]
+    result.name = header["name"]
+    result.seed = header["seed"]
+    return result
+
+def run_configuration(configuration : Configuration, seed : int, path : str) -> dict:
+    """
+    Runs a copy of the configuration's engine with the seed and writes
+    the result to path. Engine and initial population get independent
+    generators derived from the seed.
+
+    Returns:
+        dict: summary of the run
+    """
+    engine = deepcopy(configuration.engine)
+    engine_seed, initial_seed = np.random.SeedSequence(seed).spawn(2)
+    engine.clear()
+    engine.seed(engine_seed)
+    initial = configuration.initial
+    if callable(initial):
+        initial = initial(np.random.default_rng(initial_seed))
+    getattr(engine, configuration.method)(initial, **configuration.arguments)
+    curve = convergence_curve(engine)
+    result = engine.snapshot()
+    result.name = configuration.name
+    result.seed = seed
+    result.curve = curve
+    save_result(path, result)
+    return {"name": configuration.name, "seed": seed, "path": path,
+            "evaluations": int(curve[-1, 0]), "best": float(curve[-1, 1])}
+
+_worker_configurations = None
+
+def _init_worker(configurations : "list[Configuration]"):
+    """
+    Stores the configurations in the worker process
+    """
+    global _worker_configurations
+    _worker_configurations = configurations
+
+def _run_worker(index : int, seed : int, path : str) -> dict:
+    return run_configuration(_worker_configurations[index], seed, path)
+
+class Experiment:
+    """
+    Runs configurations x seeds, in a process pool unless workers is 1.
+    Configurations are sent to each worker once when the pool starts,
+    with a spawning start method their engines have to be picklable.
+
+    Args:
+        configurations (list[Configuration]): compared setups, with distinct names
+        seeds (int | list[int]): seeds of the runs, or their number
+        directory (str): where results are written
+        workers (int): worker processes, cpu count by default
+    """
+    def __init__(self, configurations : "list[Configuration]", seeds, directory : str,
+                 workers : int = None) -> "Experiment":
+        self.configurations = list(configurations)
+        self.seeds = list(range(seeds)) if isinstance(seeds, int) else list(seeds)
+        self.directory = directory
+        self.workers = workers or os.cpu_count()
+        self.summaries = []
+
+    def __repr__(self) -> str:
+        return "{} configurations x {} seeds, workers: {}, results: {}".format(
+            len(self.configurations), len(self.seeds), self.workers, self.directory)
+
+    def path(self, index : int, seed : int) -> str:
+        return os.path.join(self.directory, "run_{:03d}_{}.npz".format(index, seed))
+
+    def run(self) -> "list[dict]":
+        """
+        Runs all configurations with all seeds, summaries of finished runs
+        are appended to results.jsonl in the directory as they arrive
+
+        Returns:
+            list[dict]: summaries ordered by configuration and seed
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        tasks = [(index, seed, self.path(index, seed))
+                 for index in range(len(self.configurations)) for seed in self.seeds]
+        order = {task[2]: position for position, task in enumerate(tasks)}
+        summaries = []
+        with open(os.path.join(self.directory, "results.jsonl"), "w") as log:
+            def finished(summary):
+                summaries.append(summary)
+                log.write(json.dumps(summary) + "\n")
+                log.flush()
+
+            if self.workers == 1:
+                for index, seed, path in tasks:
+                    finished(run_configuration(self.configurations[index], seed, path))
+            else:
+                with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                         initargs=(self.configurations,)) as executor:
+                    futures = [executor.submit(_run_worker, *task) for task in tasks]
+                    for future in as_completed(futures):
+                        finished(future.result())
+        self.summaries = sorted(summaries, key=lambda summary: order[summary["path"]])
+        return self.summaries
+
+    def results(self, name : str = None) -> "list[SearchResult]":
+        """
+        Reads results of the runs back, of one configuration if name is given
+        """
+        return [load_result(self.path(index, seed))
+                for index, configuration in enumerate(self.configurations)
+                if name is None or configuration.name == name for seed in self.seeds]
+
+    def convergence(self, points : int = 200) -> "list[Convergence]":
+        """
+        Median and interquartile range of convergence of each configuration,
+        e.g. for Visual.comparison
+        """
+        return [aggregate(configuration.name, [result.curve for result in self.results(configuration.name)], points)
+                for configuration in self.configurations]
+
+def test_experiment(directory : str):
+    """
+    Test that pooled runs are isolated, reproducible and aggregated
+    """
+    from functools import partial
+
+    from utils import fitness, initialization, perturbation, replacement, selection
+    from utils.condition import LoopCondition
+
+    print("Testing experiment runner")
+    def engine(tournament_size):
+        return SearchEngine(fitness.FitnessFunction(fitness.sphere, coefficients = [0.0] * 5),
+            perturbation.Mutator(perturbation.gaussian, 0.0, deviation = 1.0), LoopCondition(20),
+            replacement.Replacer(replacement.elite, "uniform", 1),
+            selection.Selector(selection.tournament, 10, tourn_size = tournament_size), hooks = [])
+    initial = partial(initialization.populate_array, 10, partial(initialization.real_vector, 5, -5, 5))
+    configurations = [Configuration("tournament 2", engine(2), initial),
+                      Configuration("tournament 5", engine(5), initial),
+                      Configuration("local", engine(2), partial(initialization.real_vector, 5, -5, 5), "local")]
+
+    pooled = Experiment(configurations, 3, os.path.join(directory, "pooled"), workers = 2)
+    summaries = pooled.run()
+    assert [(summary["name"], summary["seed"]) for summary in summaries] == \
+        [(configuration.name, seed) for configuration in configurations for seed in range(3)]
+    with open(os.path.join(pooled.directory, "results.jsonl")) as log:
+        assert len(log.readlines()) == 9
+    serial = Experiment(configurations, [1], os.path.join(directory, "serial"), workers = 1)
+    serial.run()
+    assert serial.summaries[1] == dict(pooled.summaries[4], path = serial.summaries[1]["path"])
+    assert configurations[0].engine.fitness_function.calls_made == 0
+
+    for convergence in pooled.convergence(50):
+        assert convergence.runs == 3 and len(convergence.median) == 50
+        assert (convergence.lower <= convergence.median).all() and (convergence.median <= convergence.upper).all()
+        assert (np.diff(convergence.median) <= 0).all()
+    results = pooled.results("local")
+    assert len(results) == 3 and results[0].curve[-1, 0] == results[0].evaluations == 21
+    assert results[0].fitnesses[-1] == results[0].curve[-1, 1]
+
+    from search.recorder import SummaryRecorder
+    curves = []
+    population = initial()
+    for recorder in (None, SummaryRecorder()):
+        summarized = SearchEngine(fitness.FitnessFunction(fitness.sphere, coefficients = [0.0] * 5),
+            perturbation.Mutator(perturbation.gaussian, 0.0, deviation = 1.0), LoopCondition(20),
+            replacement.Replacer(replacement.elite, "uniform", 1), selection.Selector(selection.tournament, 10),
+            rng = 0, hooks = [], recorder = recorder)
+        summarized.simple_ea(population)
+        curves.append(convergence_curve(summarized))
+    assert len(summarized.timer.records) == 0 and len(summarized.timer) == 20
+    assert np.array_equal(curves[0], curves[1])
+
+def run_tests():
+    """
+    Run tests for experiments
+    """
+    print("Running tests...")
+    print("================")
+    with tempfile.TemporaryDirectory() as directory:
+        test_experiment(directory)
+    print("================")
+    print("Tests were succesfull")
+
+if __name__ == "__main__":
+    run_tests()
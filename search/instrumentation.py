@@ -0,0 +1,288 @@
+"""
+Instrumentation of SearchEngine runs
+
+GenerationTimer is always on and records wall time of the generation
+phases, the number of fitness evaluations and of evaluations saved by
+inherited fitness for every generation. SearchEngine bounds its records
+like the steps of the recorder, totals and the improvement curve are
+always kept.
+Hooks are notified when simple_ea starts and ends and after every
+generation, e.g. to print progress, profile the run or export the
+timing table.
+"""
+import cProfile
+import csv
+import io
+import pstats
+import tracemalloc
+from collections import deque
+
+PHASES = ("select", "replace", "mutate", "local_search", "evaluate")
+
+class GenerationTimer:
+    """
+    Per generation records of phase times (seconds), evaluations,
+    saved evaluations and best fitness. Running totals and the improvements
+    (evaluations since the first generation, best fitness) cover all
+    generations, records only the last limit ones (all by default).
+
+    Args:
+        limit (int): number of last generation records kept, None for all
+    """
+    def __init__(self, limit : int = None) -> "GenerationTimer":
+        self.limit = limit
+        self.clear()
+
+    def __len__(self) -> int:
+        return self.generations
+
+    def __repr__(self) -> str:
+        return "GenerationTimer: {} generations, {:.4f} s".format(len(self), self.totals().get("total", 0.0))
+
+    def record(self, stamps : "list[float]", evaluations : int, best : float, saved : int = 0) -> dict:
+        """
+        Stores generation record from perf_counter stamps taken before
+        the first phase and after each phase
+        """
+        self.generations += 1
+        record = {"generation": self.generations}
+        for phase, start, end in zip(PHASES, stamps, stamps[1:]):
+            record[phase] = end - start
+        record["total"] = stamps[-1] - stamps[0]
+        record["evaluations"] = evaluations
+        record["saved"] = saved
+        record["best"] = best
+        for key in PHASES + ("total", "evaluations", "saved"):
+            self.sums[key] = self.sums.get(key, 0) + record.get(key, 0)
+        if not self.improvements or best < self.improvements[-1][1]:
+            self.improvements.append((self.sums["evaluations"], best))
+        self.records.append(record)
+        return record
+
+    def totals(self) -> dict:
+        """
+        Sum of phase times, evaluations and saved evaluations over all generations
+        """
+        return dict(self.sums)
+
+    def columns(self) -> "list[str]":
+        """
+        Column names of the table, including columns added by hooks
+        """
+        columns = []
+        for record in self.records:
+            columns += [key for key in record if key not in columns]
+        return columns
+
+    def table(self) -> str:
+        """
+        Timing table as text, times in milliseconds
+        """
+        columns = self.columns()
+        lines = ["".join("{:>14}".format(column) for column in columns)]
+        for record in self.records:
+            cells = []
+            for column in columns:
+                value = record.get(column, "")
+                if column in PHASES or column == "total":
+                    cells.append("{:>14.3f}".format(value * 1000))
+                elif isinstance(value, float):
+                    cells.append("{:>14.6g}".format(value))
+                else:
+                    cells.append("{:>14}".format(value))
+            lines.append("".join(cells))
+        return "\n".join(lines)
+
+    def to_csv(self, path : str):
+        """
+        Writes timing table to csv file, times in seconds
+        """
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=self.columns())
+            writer.writeheader()
+            writer.writerows(self.records)
+
+    def state(self) -> dict:
+        """
+        Records, totals and improvements for checkpoints
+        """
+        return {"records": list(self.records), "generations": self.generations,
+                "sums": self.sums, "improvements": self.improvements}
+
+    def restore(self, state : dict):
+        """
+        Restores state saved by state, records beyond the limit are dropped
+        """
+        self.clear()
+        self.records.extend(state["records"])
+        self.generations = state["generations"]
+        self.sums = dict(state["sums"])
+        self.improvements = [tuple(improvement) for improvement in state["improvements"]]
+
+    def clear(self):
+        self.records = [] if self.limit is None else deque(maxlen=self.limit)
+        self.generations = 0
+        self.sums = {}
+        self.improvements = []
+
+class Hook:
+    """
+    Base class of SearchEngine hooks, all methods are optional
+    """
+    def start(self, engine, population):
+        """
+        Called by simple_ea after the initial population is evaluated
+        """
+
+    def generation(self, engine, population, record : dict):
+        """
+        Called after every generation with its timing record,
+        hooks may add their own columns to the record
+        """
+
+    def finish(self, engine):
+        """
+        Called when simple_ea ends
+        """
+
+class ConsoleHook(Hook):
+    """
+    Prints search setup at the start and the best individual at the end,
+    optionally the best fitness every given number of generations
+    """
+    def __init__(self, interval : int = 0) -> "ConsoleHook":
+        self.interval = interval
+
+    def __repr__(self) -> str:
+        return "console"
+
+    def start(self, engine, population):
+        print("================Starting EA search================")
+        print("Population: " + str(len(population)))
+        print("Fitness function: " + str(engine.fitness_function))
+        print("Evaluator: " + str(engine.evaluator))
+        print("Selection: " + str(engine.selection))
+        print("Replacement: " + str(engine.replacer))
+        print("Mutation: " + str(engine.mutation))
+        print("Local search: " + str(engine.local_search))
+        if engine.surrogate is not None:
+            print("Surrogate: " + str(engine.surrogate))
+        print("Termination condition: " + str(engine.condition))
+
+    def generation(self, engine, population, record : dict):
+        if self.interval and record["generation"] % self.interval == 0:
+            print("Generation {}: best {:.6g}, {} evaluations, {} saved, {:.3f} ms".format(
+                record["generation"], record["best"], record["evaluations"], record["saved"],
+                record["total"] * 1000))
+
+    def finish(self, engine):
+        print("Cycle " + str(engine.condition.calls) + " best: " + str(engine.best))
+        if engine.surrogate is not None:
+            print("Surrogate: " + str(engine.surrogate))
+
+class TableExporter(Hook):
+    """
+    Writes the timing table of the run to csv file when the search ends
+    """
+    def __init__(self, path : str) -> "TableExporter":
+        self.path = path
+
+    def __repr__(self) -> str:
+        return "timing table: " + self.path
+
+    def finish(self, engine):
+        engine.timer.to_csv(self.path)
+
+class TracemallocHook(Hook):
+    """
+    Records traced memory after every generation and its peak during
+    the generation (bytes), columns memory and memory_peak
+    """
+    def __repr__(self) -> str:
+        return "tracemalloc"
+
+    def start(self, engine, population):
+        self.started = not tracemalloc.is_tracing()
+        if self.started:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+
+    def generation(self, engine, population, record : dict):
+        record["memory"], record["memory_peak"] = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+
+    def finish(self, engine):
+        if getattr(self, "started", False):
+            tracemalloc.stop()
+            self.started = False
+
+class ProfileHook(Hook):
+    """
+    Profiles the run with cProfile, stats are dumped to path
+    or the top functions are printed when the search ends
+    """
+    def __init__(self, path : str = None, sort : str = "cumulative", limit : int = 20) -> "ProfileHook":
+        self.path = path
+        self.sort = sort
+        self.limit = limit
+        self.profiler = None
+
+    def __repr__(self) -> str:
+        return "cProfile"
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["profiler"] = None
+        return state
+
+    def start(self, engine, population):
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def finish(self, engine):
+        if self.profiler is None:
+            return
+        self.profiler.disable()
+        if self.path is not None:
+            self.profiler.dump_stats(self.path)
+        else:
+            stream = io.StringIO()
+            pstats.Stats(self.profiler, stream=stream).sort_stats(self.sort).print_stats(self.limit)
+            print(stream.getvalue())
+        self.profiler = None
+
+def test_timer():
+    """
+    Test records, totals and exported table of the timer
+    """
+    print("Testing generation timer")
+    timer = GenerationTimer()
+    timer.record([0.0, 1.0, 1.5, 2.0, 2.0, 4.0], 10, 3.0)
+    record = timer.record([4.0, 4.5, 5.0, 5.5, 5.5, 6.0], 10, 2.0)
+    record["memory"] = 100
+    assert record["generation"] == 2 and record["evaluate"] == 0.5
+    totals = timer.totals()
+    assert totals["total"] == 6.0 and totals["select"] == 1.5 and totals["evaluations"] == 20
+    assert timer.columns()[-1] == "memory"
+    assert len(timer.table().splitlines()) == 3
+
+    bounded = GenerationTimer(2)
+    for generation, best in enumerate([5.0, 4.0, 4.0, 1.0]):
+        bounded.record([0.0, 1.0, 1.0, 1.0, 1.0, 2.0], 10, best, 2)
+    assert len(bounded) == 4 and len(bounded.records) == 2 and bounded.records[-1]["generation"] == 4
+    assert bounded.totals()["evaluations"] == 40 and bounded.totals()["saved"] == 8
+    assert bounded.improvements == [(10, 5.0), (20, 4.0), (40, 1.0)]
+    assert len(GenerationTimer(0).records) == 0
+
+def run_tests():
+    """
+    Run tests for instrumentation
+    """
+    print("Running tests...")
+    print("================")
+    test_timer()
+    print("================")
+    print("Tests were succesfull")
+
+if __name__ == "__main__":
+    run_tests()
@@ -0,0 +1,244 @@
+"""
+Island model, independent populations evolved in worker processes
+with periodic migration of elites between them
+"""
+import multiprocessing
+
+import numpy as np
+
+from search.search import SearchEngine, SearchResult
+from utils import randomness
+from utils.evaluator import ProcessPoolEvaluator
+from utils.population import Population
+
+def ring(island : int, count : int, **kwargs) -> "list[int]":
+    """
+    Each island sends migrants to the next one, a single island to none
+    """
+    return [(island + 1) % count] if count > 1 else []
+
+def fully_connected(island : int, count : int, **kwargs) -> "list[int]":
+    """
+    Each island sends migrants to all other islands
+    """
+    return [target for target in range(count) if target != island]
+
+def random_topology(island : int, count : int, rng : np.random.Generator = None, **kwargs) -> "list[int]":
+    """
+    Each island sends migrants to a random other island, drawn every migration,
+    a single island to none
+    """
+    if count < 2:
+        return []
+    target = int(randomness.resolve(rng).integers(0, count - 1))
+    return [target if target < island else target + 1]
+
+def replace_worst(population : Population, genomes, fitness, **kwargs):
+    """
+    Immigrants replace the worst individuals of the population
+    """
+    count = min(len(genomes), len(population))
+    worst = population.ranking()[len(population) - count:]
+    population.genomes[worst] = genomes[:count]
+    population.fitness[worst] = fitness[:count]
+
+def replace_random(population : Population, genomes, fitness, rng : np.random.Generator = None, **kwargs):
+    """
+    Immigrants replace random individuals of the population
+    """
+    count = min(len(genomes), len(population))
+    replaced = randomness.resolve(rng).choice(len(population), count, replace=False)
+    population.genomes[replaced] = genomes[:count]
+    population.fitness[replaced] = fitness[:count]
+
+def _island_worker(connection, engine : SearchEngine, initial_population, replacement, rng):
+    """
+    Island process, evolves its population on request from the driver
+    """
+    engine.seed(rng)
+    population = engine.start_ea(initial_population)
+    while True:
+        command, *arguments = connection.recv()
+        if command == "evolve":
+            immigrants, generations, migrant_count = arguments
+            if immigrants is not None:
+                replacement(population, *immigrants, rng = engine.rng)
+            population = engine.evolve(population, generations)
+            elite = population.elite(migrant_count)
+            connection.send(((population.select(elite), population.fitness[elite]),
+                engine.best, engine.terminated))
+        elif command == "result":
+            connection.send(engine.snapshot())
+            break
+    connection.close()
+
+class IslandModel:
+    """
+    Runs copies of the search engine on separate populations in worker
+    processes, every migration interval the best individuals of each island
+    are sent to its neighbours given by the topology. Islands are daemon
+    processes which can not start processes of their own, so the engine
+    can not evaluate through a ProcessPoolEvaluator.
+    """
+    def __init__(self, engine : SearchEngine, islands : int,
+                 migration_interval : int = 10, migrant_count : int = 1,
+                 topology = ring, replacement = replace_worst) -> "IslandModel":
+        if isinstance(engine.evaluator, ProcessPoolEvaluator):
+            raise ValueError("Islands run in daemon processes and can not start the workers "
+                             "of a ProcessPoolEvaluator, use the islands for parallelism instead")
+        self.engine = engine
+        self.islands = islands
+        self.migration_interval = migration_interval
+        self.migrant_count = migrant_count
+        self.topology = topology
+        self.replacement = replacement
+
+    def __repr__(self) -> str:
+        return "{} islands, topology: {}, interval: {}, migrants: {}, replacement: {}".format(
+            self.islands, self.topology.__name__, self.migration_interval,
+            self.migrant_count, self.replacement.__name__)
+
+    def run(self, initial_population):
+        """
+        Runs the island model until the terminal condition holds on all islands
+
+        Args:
+            initial_population (list | callable): population shared by all islands,
+                or function returning a population for each island
+
+        Returns:
+            tuple: (list of SearchResult per island, SearchResult of global best)
+        """
+        context = multiprocessing.get_context()
+        connections = []
+        processes = []
+        streams = randomness.spawn(self.engine.rng, self.islands)
+        for island in range(self.islands):
+            population = initial_population() if callable(initial_population) else initial_population
+            parent, child = context.Pipe()
+            process = context.Process(target=_island_worker, args=(child, self.engine,
+                population, self.replacement, streams[island]), daemon=True)
+            process.start()
+            connections.append(parent)
+            processes.append(process)
+
+        best = None
+        solutions, fitnesses, time_stamps = [], [], [0]
+        immigrants = [None] * self.islands
+        generation = 0
+        interval = 0
+        running = True
+        while running:
+            for island, connection in enumerate(connections):
+                connection.send(("evolve", immigrants[island], interval, self.migrant_count))
+            replies = [connection.recv() for connection in connections]
+            generation += interval
+            interval = self.migration_interval
+
+            round_best = min((reply[1] for reply in replies), key=lambda individual: individual.fitness)
+            if best is None or round_best.fitness < best.fitness:
+                if best is not None:
+                    time_stamps.append(generation)
+                best = round_best
+                solutions.append(best.value)
+                fitnesses.append(best.fitness)
+            running = not all(reply[2] for reply in replies)
+
+            immigrants = [None] * self.islands
+            for island, (emigrants, *_) in enumerate(replies):
+                for target in self.topology(island, self.islands, rng = self.engine.rng):
+                    if immigrants[target] is None:
+                        immigrants[target] = emigrants
+                    else:
+                        immigrants[target] = tuple(np.concatenate(pair) for pair in zip(immigrants[target], emigrants))
+
+        results = []
+        for island, connection in enumerate(connections):
+            connection.send(("result",))
+            result = connection.recv()
+            result.name = "Island " + str(island)
+            results.append(result)
+        for process in processes:
+            process.join()
+
+        generations = max(result.generations for result in results)
+        evaluations = sum(result.evaluations for result in results)
+        combined = SearchResult([], solutions, fitnesses, generations, time_stamps, evaluations)
+        combined.name = "Global best"
+        return results, combined
+
+def test_migration():
+    """
+    Test topologies and immigrant replacement
+    """
+    print("Testing island migration")
+    assert [ring(island, 4)[0] for island in range(4)] == [1, 2, 3, 0]
+    assert fully_connected(1, 3) == [0, 2] and fully_connected(0, 1) == []
+    rng = np.random.default_rng(0)
+    assert all(random_topology(1, 3, rng = rng)[0] in (0, 2) for _ in range(20))
+    assert ring(0, 1) == [] and random_topology(0, 1, rng = rng) == []
+
+    genomes, fitness = np.zeros((2, 3)), np.array([-1.0, -2.0])
+    population = Population(np.arange(15).reshape(5, 3), [3.0, 1.0, 5.0, 0.0, 4.0])
+    replace_worst(population, genomes, fitness)
+    assert population.fitness.tolist() == [3.0, 1.0, -2.0, 0.0, -1.0]
+    assert (population.genomes[[2, 4]] == 0).all() and (population.genomes[0] == [0, 1, 2]).all()
+    population = Population(np.arange(15).reshape(5, 3), [3.0, 1.0, 5.0, 0.0, 4.0])
+    replace_random(population, genomes, fitness, rng = np.random.default_rng(1))
+    replaced = np.flatnonzero(population.fitness < 0)
+    assert len(replaced) == 2 and (population.genomes[replaced] == 0).all()
+    assert sorted(population.fitness[replaced].tolist()) == [-2.0, -1.0]
+
+def test_island_model():
+    """
+    Test that islands are seeded reproducibly and the global best is the best island
+    """
+    from utils import fitness, initialization, perturbation, replacement, selection
+    from utils.condition import LoopCondition
+
+    print("Testing island model")
+    def model(topology, immigration):
+        engine = SearchEngine(fitness.FitnessFunction(fitness.one_max),
+            perturbation.Mutator(perturbation.bitflip_multiple, 1 / 24), LoopCondition(12),
+            replacement.Replacer(replacement.elite, "uniform", 1),
+            selection.Selector(selection.tournament, 10, tourn_size = 2), rng = 5, hooks = [])
+        return IslandModel(engine, 3, migration_interval = 4, migrant_count = 2,
+                           topology = topology, replacement = immigration)
+    initial = initialization.populate_array(10, lambda rng: initialization.chromosome(24, rng),
+                                            rng = np.random.default_rng(6))
+    for topology in (ring, fully_connected):
+        for immigration in (replace_worst, replace_random):
+            results, combined = model(topology, immigration).run(initial)
+            assert len(results) == 3 and [result.generations for result in results] == [12] * 3
+            assert combined.fitnesses[-1] == min(result.fitnesses[-1] for result in results)
+            assert combined.fitnesses == sorted(combined.fitnesses, reverse = True)
+            assert combined.evaluations == sum(result.evaluations for result in results)
+            repeated = model(topology, immigration).run(initial)[1]
+            assert repeated.fitnesses == combined.fitnesses
+
+    single = model(random_topology, replace_worst)
+    single.islands = 1
+    results, combined = single.run(initial)
+    assert len(results) == 1 and combined.fitnesses[-1] == results[0].fitnesses[-1]
+
+    engine = single.engine
+    engine.evaluator = ProcessPoolEvaluator(engine.fitness_function, 2)
+    try:
+        IslandModel(engine, 2)
+        assert False, "process pool inside islands accepted"
+    except ValueError as error:
+        assert "ProcessPoolEvaluator" in str(error)
+
+def run_tests():
+    """
+    Run tests for the island model
+    """
+    print("Running tests...")
+    print("================")
+    test_migration()
+    test_island_model()
+    print("================")
+    print("Tests were succesfull")
+
+if __name__ == "__main__":
+    run_tests()
@@ -0,0 +1,269 @@
+"""
+Recording of search progress
+
+Recorder keeps the improvements (solutions, fitnesses, time stamps) and
+steps of a run for SearchResult. The recorders differ in how much of it
+stays in memory: Recorder keeps everything, RingRecorder the last K
+steps and solutions, SummaryRecorder only the improvement curve and
+the last solution. StreamRecorder also appends compact records
+(run, generation, evaluations, fitness, optional genome) to a csv or npz
+log on disk, read_log loads it back e.g. for Visual.plot_log.
+"""
+import csv
+import os
+import tempfile
+import zipfile
+from collections import deque
+
+import numpy as np
+
+COLUMNS = ("run", "generation", "evaluations", "fitness")
+
+class Recorder:
+    """
+    Keeps all improvements and steps in memory
+
+    Args:
+        solution_limit (int): number of last solutions kept, None for all
+        step_limit (int): number of last steps kept, None for all
+    """
+    def __init__(self, solution_limit : int = None, step_limit : int = None) -> "Recorder":
+        self.solution_limit = solution_limit
+        self.step_limit = step_limit
+        self.run = 0
+        self.reset()
+
+    def __repr__(self) -> str:
+        return "memory"
+
+    def _container(self, limit : int):
+        return [] if limit is None else deque(maxlen=limit)
+
+    def reset(self):
+        """
+        Creates new containers, containers of the previous run stay
+        with the SearchResult they were given to
+        """
+        self.steps = self._container(self.step_limit)
+        self.solutions = self._container(self.solution_limit)
+        self.fitnesses = []
+        self.time_stamps = [0]
+        self.evaluations = 0
+
+    def improvement(self, solution, fitness : float, time_stamp : int = None):
+        """
+        Records new best solution, the first one has the implicit time stamp 0
+        """
+        self.solutions.append(solution)
+        self.fitnesses.append(fitness)
+        if time_stamp is not None:
+            self.time_stamps.append(time_stamp)
+
+    def step(self, solution, fitness : float, evaluations : int, best : tuple = None):
+        """
+        Records evaluated solution of a local search, best is the best
+        (solution, fitness) so far after the step, the candidate by default
+        """
+        self.steps.append((solution, fitness))
+        self.evaluations = evaluations
+
+    def generation(self, generation : int, evaluations : int, fitness : float, solution = None):
+        """
+        Records best fitness after a generation
+        """
+        self.evaluations = evaluations
+
+    def flush(self):
+        """
+        Writes pending records, nothing to write for in memory recorders
+        """
+
+    def clear(self):
+        """
+        Ends the run and starts a new one
+        """
+        self.run += 1
+        self.reset()
+
+class RingRecorder(Recorder):
+    """
+    Keeps last size steps and solutions
+    """
+    def __init__(self, size : int = 1000) -> "RingRecorder":
+        Recorder.__init__(self, size, size)
+
+    def __repr__(self) -> str:
+        return "ring buffer of {}".format(self.step_limit)
+
+class SummaryRecorder(Recorder):
+    """
+    Keeps only the improvement curve and the last solution
+    """
+    def __init__(self) -> "SummaryRecorder":
+        Recorder.__init__(self, 1, 0)
+
+    def __repr__(self) -> str:
+        return "summary"
+
+class StreamRecorder(SummaryRecorder):
+    """
+    Appends records of steps and generations to a csv or npz log (by the
+    file extension) in chunks of buffer_size records, steps are logged with
+    the best fitness so far rather than the candidate's. Npz logs are columnar,
+    every chunk is stored as separate arrays. Genomes are written only
+    with genomes = True and must have the same length in a npz log.
+    """
+    def __init__(self, path : str, genomes : bool = False, buffer_size : int = 1000) -> "StreamRecorder":
+        self.path = path
+        self.genomes = genomes
+        self.buffer_size = buffer_size
+        self.format = "npz" if path.endswith(".npz") else "csv"
+        self.buffer = []
+        self.chunks = 0
+        self.started = False
+        SummaryRecorder.__init__(self)
+
+    def __repr__(self) -> str:
+        return "stream to " + self.path
+
+    def _write(self, generation : int, evaluations : int, fitness : float, solution):
+        record = (self.run, generation, evaluations, float(fitness))
+        if self.genomes:
+            record += (np.asarray(solution),)
+        self.buffer.append(record)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def step(self, solution, fitness : float, evaluations : int, best : tuple = None):
+        SummaryRecorder.step(self, solution, fitness, evaluations, best)
+        best_solution, best_fitness = (solution, fitness) if best is None else best
+        self._write(-1, evaluations, best_fitness, best_solution)
+
+    def generation(self, generation : int, evaluations : int, fitness : float, solution = None):
+        SummaryRecorder.generation(self, generation, evaluations, fitness, solution)
+        self._write(generation, evaluations, fitness, solution)
+
+    def flush(self):
+        """
+        Appends buffered records to the log
+        """
+        if not self.buffer and self.started:
+            return
+        mode = "a" if self.started else "w"
+        if self.format == "csv":
+            with open(self.path, mode, newline="") as file:
+                writer = csv.writer(file)
+                if not self.started:
+                    writer.writerow(COLUMNS + (("genome",) if self.genomes else ()))
+                for record in self.buffer:
+                    if self.genomes:
+                        record = record[:4] + (" ".join(str(gene) for gene in record[4].tolist()),)
+                    writer.writerow(record)
+        elif self.buffer:
+            with zipfile.ZipFile(self.path, mode) as archive:
+                columns = list(zip(*self.buffer))
+                for name, column in zip(COLUMNS + ("genome",), columns):
+                    with archive.open("{}_{:06d}.npy".format(name, self.chunks), "w") as file:
+                        np.lib.format.write_array(file, np.asarray(column))
+            self.chunks += 1
+        elif not self.started:
+            zipfile.ZipFile(self.path, "w").close()
+        self.started = True
+        self.buffer = []
+
+    def clear(self):
+        self.flush()
+        SummaryRecorder.clear(self)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["buffer"] = []
+        return state
+
+def read_log(path : str) -> "dict[str, np.ndarray]":
+    """
+    Reads log written by StreamRecorder as columns, genomes of a csv log
+    are returned as lists of strings
+    """
+    if path.endswith(".npz"):
+        columns = {}
+        with np.load(path) as archive:
+            for name in sorted(archive.files):
+                columns.setdefault(name.rsplit("_", 1)[0], []).append(archive[name])
+        return {name: np.concatenate(chunks) for name, chunks in columns.items()}
+
+    with open(path, "r", newline="") as file:
+        rows = list(csv.reader(file))
+    header, rows = rows[0], rows[1:]
+    columns = {}
+    for position, name in enumerate(header):
+        values = [row[position] for row in rows]
+        if name == "genome":
+            columns[name] = [value.split() for value in values]
+        elif name == "fitness":
+            columns[name] = np.array(values, dtype=np.float64)
+        else:
+            columns[name] = np.array(values, dtype=np.int64)
+    return columns
+
+def test_recorders():
+    """
+    Test bounded containers of the recorders
+    """
+    print("Testing recorders")
+    for recorder, kept in ((Recorder(), 10), (RingRecorder(3), 3), (SummaryRecorder(), 0)):
+        for i in range(10):
+            recorder.step([i], 10 - i, i + 1)
+            recorder.improvement([i], 10 - i, i)
+        assert len(recorder.steps) == kept
+        assert len(recorder.solutions) == max(kept, 1) and recorder.solutions[-1] == [9]
+        assert len(recorder.fitnesses) == 10 and len(recorder.time_stamps) == 11
+
+def test_stream(directory : str):
+    """
+    Test records written by the stream recorder are read back,
+    steps of a local search logged with the best fitness so far
+    """
+    from search.search import SearchEngine
+    from utils import fitness, perturbation
+    from utils.condition import LoopCondition
+
+    print("Testing stream recorder")
+    for name in ("log.csv", "log.npz"):
+        path = os.path.join(directory, name)
+        recorder = StreamRecorder(path, genomes = True, buffer_size = 4)
+        for i in range(10):
+            recorder.generation(i + 1, 5 * (i + 1), 100.0 - i, np.array([i, i + 1]))
+        recorder.clear()
+        recorder.step(np.array([0, 0]), 0.5, 51)
+        recorder.step(np.array([1, 1]), 0.7, 52, (np.array([0, 0]), 0.5))
+        recorder.flush()
+        log = read_log(path)
+        assert (log["generation"] == list(range(1, 11)) + [-1, -1]).all()
+        assert (log["run"] == [0] * 10 + [1, 1]).all()
+        assert (log["fitness"][-2:] == 0.5).all() and (log["evaluations"][-2:] == [51, 52]).all()
+        assert [int(gene) for gene in log["genome"][-1]] == [0, 0]
+        assert [int(gene) for gene in log["genome"][3]] == [3, 4]
+
+    path = os.path.join(directory, "local.csv")
+    engine = SearchEngine(fitness.FitnessFunction(fitness.one_max), perturbation.Mutator(perturbation.bitflip_single, 0),
+                          LoopCondition(100), recorder = StreamRecorder(path), rng = 0, hooks = [])
+    engine.local([1] * 30)
+    log = read_log(path)
+    assert len(log["fitness"]) == 101 and (np.diff(log["fitness"]) <= 0).all()
+    assert len(engine.steps) == 0 and log["fitness"][-1] == engine.fitnesses[-1]
+
+def run_tests():
+    """
+    Run tests for recorders
+    """
+    print("Running tests...")
+    print("================")
+    test_recorders()
+    with tempfile.TemporaryDirectory() as directory:
+        test_stream(directory)
+    print("================")
+    print("Tests were succesfull")
+
+if __name__ == "__main__":
+    run_tests()
@@ -1,113 +1,411 @@
 """
 Search function implementations
 """
-
+import asyncio
 from copy import deepcopy
-from time import time
+from time import perf_counter, time
+
+import numpy as np
+
 from utils import fitness
 from utils import replacement
 from utils.condition import *
 from utils import perturbation
 from utils import crossover
-from utils.population import Individual
+from utils import randomness
+from utils.evaluator import SerialEvaluator
+from utils.population import Individual, Population
 from utils.replacement import Replacer, elite
+from search import checkpoint
+from search.cmaes import CMAES
+from search.instrumentation import PHASES, ConsoleHook, GenerationTimer
+from search.recorder import Recorder
 
 
 class SearchResult:
-    def __init__(self, steps, solutions, fitnesses, generations, time_stamps):
+    def __init__(self, steps, solutions, fitnesses, generations, time_stamps, evaluations = None):
         self.steps = steps
         self.solutions = solutions
         self.fitnesses = fitnesses
         self.time_stamps = time_stamps
         self.generations = generations
+        self.evaluations = evaluations
         self.name = ""
 
 class SearchEngine:
     """
     Search function wrapper
+
+    Population searches (simple_ea, resume, steady_state, cmaes) close the
+    evaluator when they end, a process pool starts again on the next search.
     """
 
     def __init__(self, fitness_function : fitness.FitnessFunction, mutation,
                  condition : TerminalCondition,
-                replacer: Replacer = None , selection = None, **kwargs):
+                replacer: Replacer = None , selection = None, evaluator = None,
+                local_search = None, rng = None, hooks = None, recorder = None, surrogate = None, **kwargs):
         self.fitness_function = fitness_function
+        self.local_search = local_search
+        self.surrogate = surrogate
+        self.evaluator = evaluator if evaluator is not None else SerialEvaluator(fitness_function)
         self.mutation = mutation
         self.condition = condition
         self.selection = selection
         self.replacer = replacer
+        self.hooks = list(hooks) if hooks is not None else [ConsoleHook()]
+        self.stamps = []
+        self.recorder = recorder if recorder is not None else Recorder()
+        self.timer = GenerationTimer(self.recorder.step_limit)
+        self.best = None
+        self.generation_best = 0
+        self.saved = 0
+        self.terminated = False
+        self.seed(rng)
+
+    @property
+    def steps(self):
+        return self.recorder.steps
+
+    @property
+    def solutions(self):
+        return self.recorder.solutions
+
+    @property
+    def fitnesses(self):
+        return self.recorder.fitnesses
+
+    @property
+    def time_stamps(self):
+        return self.recorder.time_stamps
+
+    def seed(self, rng = None):
+        """
+        Sets random generator, or creates one from a seed, shared by all
+        operators of the engine. Same seed gives the same run.
+        """
+        self.rng = randomness.generator(rng)
+        for operator in (self.mutation, self.selection, self.replacer,
+                         getattr(self.replacer, "crossover_operator", None)):
+            if hasattr(operator, "rng"):
+                operator.rng = self.rng
         
-        self.steps = []
-        self.solutions = []
-        self.fitnesses = []
-        self.time_stamps = [0]
-        
-    def next_generation(self, population : "list[Individual]"): 
+    def next_generation(self, population : Population) -> Population:
+        """
+        Breeds and evaluates the next generation. Elites ranked by partial sort
+        are carried over with their fitness, children that are unchanged copies
+        of a parent (reported by the replacer and the mutation) inherit its
+        fitness, only the rest is evaluated, or screened by the surrogate.
+        Index of the best new individual is kept in generation_best, number
+        of skipped evaluations (elites, inherited and rejected by the
+        surrogate) in saved.
+        """
+        stamps = [perf_counter()]
+        elites = population.elite(getattr(self.replacer, "elite_count", 0))
         selected_parents = self.selection(population)
-        next_generation = self.replacer.replace(selected_parents)
-        perturbed_generation = self.mutation.mutate_population(next_generation)
-        return [Individual(i, self.fitness_function(i)) for i in perturbed_generation]
+        stamps.append(perf_counter())
+        next_generation = self.replacer.replace(selected_parents, population.select(elites))
+        stamps.append(perf_counter())
+        kept = len(elites)
+        size = len(population) - kept
+        perturbed_generation = self.mutation.mutate_population(next_generation[kept:])
+        changed = np.array(getattr(self.mutation, "changed", np.ones(size, dtype=bool)), dtype=bool)
+        stamps.append(perf_counter())
+        if self.local_search is not None:
+            improved_generation = self.local_search.improve_population(perturbed_generation)
+            changed |= [not np.array_equal(improved, perturbed)
+                        for improved, perturbed in zip(improved_generation, perturbed_generation)]
+            perturbed_generation = improved_generation
+        stamps.append(perf_counter())
+        population.next_genomes[:kept] = population.genomes[elites]
+        population.next_fitness[:kept] = population.fitness[elites]
+        population.next_genomes[kept:] = perturbed_generation
+
+        sources = np.asarray(getattr(self.replacer, "sources", ()), dtype=np.intp)[kept:]
+        parents = getattr(self.selection, "indices", None)
+        inherited = np.zeros(size, dtype=bool)
+        if parents is not None and len(sources) == size:
+            inherited = (sources >= 0) & ~changed
+            population.next_fitness[kept:][inherited] = population.fitness[np.asarray(parents)[sources[inherited]]]
+        rows = kept + np.flatnonzero(~inherited)
+        if self.surrogate is not None:
+            rows = self.surrogate.evaluate(population, self.evaluator, rows, elites)
+        elif len(rows):
+            population.next_fitness[rows] = self.evaluator.evaluate_batch(population.next_genomes[rows])
+        self.saved = len(population) - len(rows)
+        population.swap()
+        self.generation_best = kept + int(np.argmin(population.fitness[kept:])) if size else 0
+        if kept and population.fitness[0] < population.fitness[self.generation_best]:
+            # best elite, e.g. an immigrant inserted by the island model since the last generation
+            self.generation_best = 0
+        stamps.append(perf_counter())
+        self.stamps = stamps
+        return population
 
     def simple_ea(self, initial_population : list):
         """
-        Simple evolutionary algorithm
+        Simple evolutionary algorithm, hooks report the run
 
         Args:
-            condition (TerminalCondition): _description_
-            initial_solution (_type_): _description_
-        """
-        print("================Starting EA search================")
-        print("Population: " + str(len(initial_population)))
-        print("Fitness function: " + str(self.fitness_function))
-        print("Selection: " + str(self.selection))
-        print("Replacement: " + str(self.replacer))
-        print("Mutation: " + str(self.mutation))
-        print("Termination condition: " + str(self.condition))
-        population = [Individual(i, self.fitness_function(i)) for i in initial_population]
-        sorted(population, key= lambda x: x.fitness)
-        
-        best = population[0]
-        self.solutions.append(best.value)
-        self.fitnesses.append(best.fitness)
-        curr_best = best
+            initial_population (list): genomes of the initial population
+        """
+        population = self.start_ea(initial_population)
+        for hook in self.hooks:
+            hook.start(self, population)
+        self.evolve(population)
+        self.recorder.flush()
+        self.evaluator.close()
+        for hook in self.hooks:
+            hook.finish(self)
+        return self.best
+
+    def resume(self, path : str, codec = None):
+        """
+        Continues simple_ea from checkpoint written by CheckpointHook, the engine
+        must be set up as the checkpointed one. Same seed gives the same run
+        as if it was not interrupted.
+
+        Args:
+            path (str): checkpoint file
+            codec: encode/decode of object genomes, e.g. TSPProblem for City routes
+        """
+        population = checkpoint.load(path, self, codec)
+        for hook in self.hooks:
+            hook.start(self, population)
+        self.evolve(population)
+        self.recorder.flush()
+        self.evaluator.close()
+        for hook in self.hooks:
+            hook.finish(self)
+        return self.best
+
+    def start_ea(self, initial_population : list) -> Population:
+        """
+        Evaluates initial population and records its best individual
+        """
+        population = Population(initial_population)
+        population.evaluate(self.evaluator)
+        if self.surrogate is not None:
+            self.surrogate.update(population.genomes, population.fitness)
 
-        while self.condition.test(result = best.value):
+        self.best = population.detach(population.best_index())
+        self.terminated = False
+        self.recorder.improvement(self.best.value, self.best.fitness)
+        return population
+
+    def evolve(self, population : Population, generations : int = None) -> Population:
+        """
+        Evolves population started by start_ea until the terminal condition
+        is met or for at most the given number of generations
+        """
+        count = getattr(self.selection, "selection_count", 0)
+        if count and count != len(population):
+            raise ValueError("Selection count {} differs from population size {}, generations "
+                             "are written into buffers of the population size".format(count, len(population)))
+        generation = 0
+        while generations is None or generation < generations:
+            if not self.condition.test(result = self.best.value):
+                self.terminated = True
+                break
+            calls_before = self.fitness_function.calls_made
             population = self.next_generation(population)
-            sorted(population, key= lambda x: x.fitness)
-            curr_best = population[0]
-            if(curr_best.fitness < best.fitness):
-                best = curr_best
-                self.solutions.append(best.value)
-                self.fitnesses.append(best.fitness)
-                self.time_stamps.append(self.fitness_function.calls_made // len(initial_population))
-        print("Cycle " + str(self.condition.calls) +" best: " + str(best))
-        return best
+            generation += 1
+            if population.fitness[self.generation_best] < self.best.fitness:
+                self.best = population.detach(self.generation_best)
+                self.recorder.improvement(self.best.value, self.best.fitness, self.condition.calls)
+            self.recorder.generation(self.condition.calls, self.fitness_function.calls_made,
+                                     self.best.fitness, self.best.value)
+            record = self.timer.record(self.stamps, self.fitness_function.calls_made - calls_before,
+                                       self.best.fitness, self.saved)
+            for hook in self.hooks:
+                hook.generation(self, population, record)
+        return population
+
+    def steady_state(self, initial_population : list, in_flight : int = None,
+                     insertion = replacement.replace_worst, **kwargs):
+        """
+        Asynchronous steady-state evolutionary algorithm. A fixed number of
+        offspring is evaluated at a time through evaluate_async of the evaluator
+        (serial, asyncio or process pool), every finished evaluation is inserted
+        by the insertion policy and a new offspring is dispatched at once, so
+        workers do not wait for the slowest evaluation of a generation.
+        The terminal condition is tested for each dispatched offspring, offspring
+        in flight when it fails are still inserted. Timer, recorder and hooks
+        see a generation every len(population) insertions. With more than one
+        evaluation in flight the order of insertions depends on evaluation
+        times, seeded runs are reproducible with the serial evaluator only.
+
+        Args:
+            initial_population (list): genomes of the initial population
+            in_flight (int): evaluations in flight, workers of the evaluator by default
+            insertion: replacement.replace_worst or replacement.replace_tournament
+            kwargs: parameters of the insertion policy, e.g. tourn_size
+        """
+        population = self.start_ea(initial_population)
+        for hook in self.hooks:
+            hook.start(self, population)
+        in_flight = in_flight or getattr(self.evaluator, "workers", 1)
+        asyncio.run(self._steady_state(population, in_flight, insertion, kwargs))
+        self.recorder.flush()
+        self.evaluator.close()
+        for hook in self.hooks:
+            hook.finish(self)
+        return self.best
+
+    async def _steady_state(self, population : Population, in_flight : int, insertion, parameters : dict):
+        # timer phases: select, replace (crossover and insertion), mutate, local search, evaluate (waiting)
+        durations = np.zeros(len(PHASES))
+        pending = {}
+        inserted = 0
+        calls_before = self.fitness_function.calls_made
+
+        def generation():
+            nonlocal calls_before
+            started = perf_counter()
+            self.stamps = [started] + (started + np.cumsum(durations)).tolist()
+            self.recorder.generation(self.condition.calls, self.fitness_function.calls_made,
+                                     self.best.fitness, self.best.value)
+            record = self.timer.record(self.stamps, self.fitness_function.calls_made - calls_before,
+                                       self.best.fitness)
+            for hook in self.hooks:
+                hook.generation(self, population, record)
+            durations[:] = 0
+            calls_before = self.fitness_function.calls_made
+
+        crossover_operator = getattr(self.replacer, "crossover_operator", None)
+        while pending or not self.terminated:
+            while len(pending) < in_flight and not self.terminated:
+                if not self.condition.test(result = self.best.value):
+                    self.terminated = True
+                    break
+                stamps = [perf_counter()]
+                first, second = self.selection(population, 2)
+                stamps.append(perf_counter())
+                if crossover_operator is None:
+                    child = first.copy()
+                else:
+                    child = crossover_operator(first, second, rng = self.rng)
+                    if isinstance(child, tuple):
+                        child = child[0]
+                stamps.append(perf_counter())
+                child = self.mutation.mutate_single(child)
+                stamps.append(perf_counter())
+                if self.local_search is not None:
+                    child = self.local_search.improve_population([child])[0]
+                stamps.append(perf_counter())
+                durations[:4] += np.diff(stamps)
+                pending[asyncio.ensure_future(self.evaluator.evaluate_async(child))] = child
+            if not pending:
+                break
+
+            waiting = perf_counter()
+            done, _ = await asyncio.wait(pending, return_when = asyncio.FIRST_COMPLETED)
+            durations[4] += perf_counter() - waiting
+            for task in done:
+                inserting = perf_counter()
+                child, child_fitness = pending.pop(task), float(task.result())
+                index = insertion(population.fitness, child_fitness, rng = self.rng, **parameters)
+                if index >= 0:
+                    population.genomes[index] = child
+                    population.fitness[index] = child_fitness
+                    if child_fitness < self.best.fitness:
+                        self.best = population.detach(index)
+                        self.recorder.improvement(self.best.value, self.best.fitness, self.condition.calls)
+                durations[1] += perf_counter() - inserting
+                inserted += 1
+                if inserted % len(population) == 0:
+                    generation()
+        if inserted % len(population) != 0:
+            generation()
+
+    def cmaes(self, initial_mean, initial_sigma : float, population_size : int = None,
+              diagonal : bool = False, restarts : int = 0, lower_bound = None, upper_bound = None):
+        """
+        CMA-ES search with IPOP restarts, each restart doubles the population.
+        Strategy restarts on stagnation while the terminal condition (tested
+        every generation) holds, from a random point within the bounds if given.
+        Search ends when the condition fails or the last restart stagnates.
+        Samples outside of the bounds are clipped.
+
+        Args:
+            initial_mean (list[float]): starting point
+            initial_sigma (float): initial step size
+            population_size (int): lambda of the first run, 4 + 3 ln(n) by default
+            diagonal (bool): sep-CMA-ES, linear time and memory for high dimensions
+            restarts (int): maximum number of restarts
+        """
+        mean = np.array(initial_mean, dtype=np.float64)
+        strategy = CMAES(mean, initial_sigma, population_size, diagonal, self.rng)
+        self.best = Individual(mean, self.fitness_function(mean))
+        self.terminated = False
+        self.recorder.improvement(self.best.value, self.best.fitness)
+        restart = 0
+        for hook in self.hooks:
+            hook.start(self, Population(mean[np.newaxis], [self.best.fitness]))
+
+        while self.condition.test(result = self.best.value):
+            if strategy.stop():
+                if restart == restarts:
+                    break
+                restart += 1
+                if lower_bound is not None and upper_bound is not None:
+                    mean = self.rng.uniform(lower_bound, upper_bound, len(mean))
+                strategy = CMAES(mean, initial_sigma, strategy.population_size * 2, diagonal, self.rng)
+
+            calls_before = self.fitness_function.calls_made
+            started = perf_counter()
+            samples = strategy.ask(lower_bound, upper_bound)
+            sampled = perf_counter()
+            fitness = np.asarray(self.evaluator.evaluate_batch(samples), dtype=np.float64)
+            evaluated = perf_counter()
+            strategy.tell(fitness)
+            updated = perf_counter()
+
+            best = int(np.argmin(fitness))
+            if fitness[best] < self.best.fitness:
+                self.best = Individual(samples[best].copy(), float(fitness[best]))
+                self.recorder.improvement(self.best.value, self.best.fitness, self.condition.calls)
+            self.recorder.generation(self.condition.calls, self.fitness_function.calls_made,
+                                     self.best.fitness, self.best.value)
+            # timer phases: select, replace (strategy update), mutate (sampling), local search, evaluate
+            durations = (0.0, updated - evaluated, sampled - started, 0.0, evaluated - sampled)
+            self.stamps = [started] + (started + np.cumsum(durations)).tolist()
+            record = self.timer.record(self.stamps, self.fitness_function.calls_made - calls_before,
+                                       self.best.fitness)
+            for hook in self.hooks:
+                hook.generation(self, Population(samples, fitness), record)
+
+        self.terminated = True
+        self.strategy = strategy
+        self.recorder.flush()
+        self.evaluator.close()
+        for hook in self.hooks:
+            hook.finish(self)
+        return self.best
 
     def local(self, initial_solution):
         """
         Commences local (1+1)ES search
         """
-        self.solutions.append(initial_solution)
-        current_solution = self.solutions[-1]
+        current = Individual(initial_solution)
 
-        self.fitness_function(current_solution)
-        self.fitnesses.append(self.fitness_function.last_fitness)
-        current_fitness = self.fitness_function.last_fitness
+        self.fitness_function.evaluate(current)
+        self.recorder.improvement(initial_solution, current.fitness)
 
-        self.steps.append((current_solution, current_fitness))
+        self.recorder.step(current.value, current.fitness, self.fitness_function.calls_made)
 
-        while self.condition.test(result = current_solution):
-            next_step = self.mutation.mutate_single(current_solution)
-            next_fitness = self.fitness_function(next_step)
-            self.steps.append((next_step, next_fitness))
+        while self.condition.test(result = current.value):
+            next_step = self.mutation.mutate_individual(current)
+            next_fitness = self.fitness_function.evaluate(next_step)
 
-            if current_fitness > next_fitness:
-                self.solutions.append(next_step)
-                self.fitnesses.append(next_fitness)
-                self.time_stamps.append(self.fitness_function.calls_made - 1)
+            if current.fitness > next_fitness:
+                self.recorder.improvement(next_step.value, next_fitness,
+                                          self.fitness_function.calls_made - 1)
 
-                current_solution = next_step
-                current_fitness = next_fitness
-        return current_solution
+                current = next_step
+            self.recorder.step(next_step.value, next_fitness, self.fitness_function.calls_made,
+                               (current.value, current.fitness))
+        self.recorder.flush()
+        return current.value
 
     def local_one_fifth(self, initial_solution, initial_sigma):
         """
@@ -115,26 +413,21 @@ class SearchEngine:
         """
         sigma = initial_sigma
         sigmas = [sigma]
-        self.mutation = lambda x : perturbation.gaussian(x, deviation = sigma)
-        
-        self.solutions.append(initial_solution)
-        current_solution = self.solutions[-1]
+
+        current_solution = initial_solution
 
         self.fitness_function(current_solution)
-        self.fitnesses.append(self.fitness_function.last_fitness)
         current_fitness = self.fitness_function.last_fitness
+        self.recorder.improvement(current_solution, current_fitness)
 
-        self.steps.append((current_solution, current_fitness))
+        self.recorder.step(current_solution, current_fitness, self.fitness_function.calls_made)
 
         while self.condition.test(result = current_solution):
-            next_step = self.mutation(current_solution)
+            next_step = perturbation.gaussian(current_solution, deviation = sigma, rng = self.rng)
             next_fitness = self.fitness_function(next_step)
-            self.steps.append((next_step, next_fitness))
 
             if current_fitness > next_fitness:
-                self.solutions.append(next_step)
-                self.fitnesses.append(next_fitness)
-                self.time_stamps.append(self.fitness_function.calls_made - 1)
+                self.recorder.improvement(next_step, next_fitness, self.fitness_function.calls_made - 1)
 
                 current_solution = next_step
                 current_fitness = next_fitness
@@ -143,6 +436,9 @@ class SearchEngine:
             else:
                 sigma = 1.5**(-1/4)*sigma
                 sigmas.append(sigma)
+            self.recorder.step(next_step, next_fitness, self.fitness_function.calls_made,
+                               (current_solution, current_fitness))
+        self.recorder.flush()
         return current_solution,sigmas
     
     def clear(self):
@@ -151,10 +447,12 @@ class SearchEngine:
         """
         self.fitness_function.clear()
         self.condition.clear()
-        self.steps = []
-        self.solutions = []
-        self.fitnesses = []
-        self.time_stamps = [0]
+        self.recorder.clear()
+        self.best = None
+        self.terminated = False
+        self.timer.clear()
+        if self.surrogate is not None:
+            self.surrogate.clear()
         
     def snapshot(self):
         """_summary_
@@ -162,7 +460,8 @@ class SearchEngine:
         Returns:
             _type_: _description_
         """
-        result = SearchResult(self.steps, self.solutions, self.fitnesses, self.condition.calls, self.time_stamps)
+        result = SearchResult(self.steps, self.solutions, self.fitnesses, self.condition.calls,
+                              self.time_stamps, self.fitness_function.calls_made)
         self.clear()
         return result
 
@@ -0,0 +1,94 @@
+"""
+Packed binary genomes
+
+A binary genome of length bits is stored as ceil(length / 8) uint8 words
+(np.packbits order, first bit is the highest bit of the first word),
+padding bits of the last word are always zero. Populations are matrices
+of packed rows, mutation is XOR with a random mask and counting is popcount.
+Rows padded to multiples of 8 words can be viewed as uint64 words.
+"""
+import numpy as np
+
+from utils import randomness
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def words(length : int) -> int:
+    """
+    Number of uint8 words of a genome of length bits
+    """
+    return (length + 7) // 8
+
+def pack(bits) -> np.ndarray:
+    """
+    0/1 genome (or matrix of genomes) -> packed words
+    """
+    return np.packbits(np.asarray(bits, dtype=np.uint8), axis=-1)
+
+def unpack(packed, length : int) -> np.ndarray:
+    """
+    Packed words -> 0/1 uint8 genome (or matrix of genomes)
+    """
+    return np.unpackbits(np.asarray(packed, dtype=np.uint8), axis=-1, count=length)
+
+def popcount(packed) -> np.ndarray:
+    """
+    Number of set bits in each packed genome (last axis)
+    """
+    packed = np.asarray(packed, dtype=np.uint8)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(packed).sum(axis=-1, dtype=np.int64)
+    return _POPCOUNT[packed].sum(axis=-1, dtype=np.int64)
+
+def tail_mask(length : int) -> int:
+    """
+    Mask of the used bits of the last word
+    """
+    used = length % 8
+    return 0xFF if used == 0 else (0xFF << (8 - used)) & 0xFF
+
+def random_genome(length : int, shape : tuple = (), rng : np.random.Generator = None) -> np.ndarray:
+    """
+    Uniformly random packed genome, or array of them of the given shape
+    """
+    packed = randomness.resolve(rng).integers(0, 256, tuple(shape) + (words(length),), dtype=np.uint8)
+    packed[..., -1] &= tail_mask(length)
+    return packed
+
+def flip_mask(length : int, probability : float, shape : tuple = (), rng : np.random.Generator = None) -> np.ndarray:
+    """
+    Packed mask with each of the length bits set independently with the probability
+    """
+    rng = randomness.resolve(rng)
+    return np.packbits(rng.random(tuple(shape) + (length,)) < probability, axis=-1)
+
+def test_bits():
+    """
+    Test packing, counting and masks
+    """
+    print("Testing packed bits")
+    rng = np.random.default_rng(0)
+    for length in (1, 7, 8, 13, 64, 1000):
+        bits = rng.integers(0, 2, (5, length))
+        packed = pack(bits)
+        assert packed.shape == (5, words(length)) and packed.dtype == np.uint8
+        assert (unpack(packed, length) == bits).all()
+        assert (popcount(packed) == bits.sum(axis=1)).all()
+        assert (_POPCOUNT[packed].sum(axis=-1) == bits.sum(axis=1)).all()
+        genome = random_genome(length, (3,), rng)
+        assert (pack(unpack(genome, length)) == genome).all()
+        assert (popcount(flip_mask(length, 1.0, (2,), rng)) == length).all()
+        assert popcount(flip_mask(length, 0.0, rng = rng)) == 0
+
+def run_tests():
+    """
+    Run tests for packed bits
+    """
+    print("Running tests...")
+    print("================")
+    test_bits()
+    print("================")
+    print("Tests were succesfull")
+
+if __name__ == "__main__":
+    run_tests()
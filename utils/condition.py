@@ -1,6 +1,8 @@
 """
 Search termination conditions
 """
+import numpy as np
+
 
 class TerminalCondition:
     """
@@ -12,6 +14,20 @@ class TerminalCondition:
     def clear(self):
         self.calls = 0
 
+    def state(self) -> dict:
+        """
+        Counters of the condition for checkpoints, attributes of plain types
+        """
+        return {key: value for key, value in vars(self).items()
+                if isinstance(value, (bool, int, float, str, type(None)))}
+
+    def restore(self, state : dict):
+        """
+        Restores counters saved by state
+        """
+        for key, value in state.items():
+            setattr(self, key, value)
+
     def test(self, **kwargs):
         """
         Returns:
@@ -30,10 +46,10 @@ class ResultMatchCondition(TerminalCondition):
 
     def test(self, **kwargs):
         self.calls += 1
-        return not self.expected_result == kwargs["result"]
+        return not np.array_equal(self.expected_result, kwargs["result"])
     
     def __repr__(self) -> str:
-        return "{}, termination on: {}".format(self.__name__,self.expected_result)
+        return "{}, termination on: {}".format(type(self).__name__,self.expected_result)
 
 class NoImporvementCondition(TerminalCondition):
     """
@@ -47,7 +63,7 @@ class NoImporvementCondition(TerminalCondition):
 
     def test(self, **kwargs):
         self.calls += 1
-        if self.current_solution != kwargs["result"]:
+        if self.current_solution is None or not np.array_equal(self.current_solution, kwargs["result"]):
             self.ineffective_results_count = self.max_ineffective_results
             self.current_solution = kwargs["result"]
         self.ineffective_results_count -= 1
@@ -57,7 +73,7 @@ class NoImporvementCondition(TerminalCondition):
         return True
 
     def __repr__(self) -> str:
-        return "{}, termination on: {} ineffective calls".format(self.__name__,self.max_ineffective_results)
+        return "{}, termination on: {} ineffective calls".format(type(self).__name__,self.max_ineffective_results)
 
 class LoopCondition(TerminalCondition):
     """
@@ -75,3 +91,61 @@ class LoopCondition(TerminalCondition):
     
     def __repr__(self) -> str:
         return "{}, termination on: {} calls".format(__name__,self.counter)
+
+def test_conditions():
+    """
+    Test that conditions compare genomes of lists and arrays
+    """
+    print("Testing terminal conditions")
+    condition = ResultMatchCondition([0] * 4)
+    assert condition.test(result = np.array([0, 1, 0, 0])) and condition.test(result = [1] * 4)
+    assert not condition.test(result = np.zeros(4, dtype=np.int64)) and condition.calls == 3
+    condition = NoImporvementCondition(3)
+    assert condition.test(result = np.ones(4)) and condition.test(result = np.ones(4))
+    assert condition.test(result = np.zeros(4)) and condition.test(result = [0] * 4)
+    assert not condition.test(result = np.zeros(4))
+
+def test_simple_ea():
+    """
+    Test that simple_ea terminates with each condition on array genomes
+    """
+    from search.search import SearchEngine
+    from utils import fitness, initialization, perturbation, replacement, selection
+
+    print("Testing conditions in simple_ea")
+    for condition in (ResultMatchCondition([0] * 12), NoImporvementCondition(5), LoopCondition(30)):
+        engine = SearchEngine(fitness.FitnessFunction(fitness.one_max),
+            perturbation.Mutator(perturbation.bitflip_multiple, 0.1), condition,
+            replacement.Replacer(replacement.elite, "uniform", 2),
+            selection.Selector(selection.tournament, 20, tourn_size = 3), rng = 0, hooks = [])
+        best = engine.simple_ea(initialization.populate_array(20, lambda rng: initialization.chromosome(12, rng),
+                                                              rng = np.random.default_rng(1)))
+        assert engine.terminated and 0 < condition.calls <= 500
+        if isinstance(condition, ResultMatchCondition):
+            assert best.fitness == 0 and np.array_equal(best.value, [0] * 12)
+    assert repr(ResultMatchCondition([0])).startswith("ResultMatchCondition")
+
+    engine = SearchEngine(fitness.FitnessFunction(fitness.one_max),
+        perturbation.Mutator(perturbation.bitflip_multiple, 0.1), LoopCondition(5),
+        replacement.Replacer(replacement.elite, "uniform", 2),
+        selection.Selector(selection.tournament, 10, tourn_size = 3), rng = 0, hooks = [])
+    try:
+        engine.simple_ea(initialization.populate_array(20, lambda rng: initialization.chromosome(12, rng),
+                                                       rng = np.random.default_rng(1)))
+        assert False
+    except ValueError as error:
+        assert "Selection count 10" in str(error) and engine.condition.calls == 0
+
+def run_tests():
+    """
+    Run tests for terminal conditions
+    """
+    print("Running tests...")
+    print("================")
+    test_conditions()
+    test_simple_ea()
+    print("================")
+    print("Tests were succesfull")
+
+if __name__ == "__main__":
+    run_tests()
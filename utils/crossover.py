@@ -1,28 +1,31 @@
 """
 Module for crossover operatinos
 """
-import random
+import numpy as np
+
+from utils import randomness
 
 class Crossover:
-    def __init__(self, crossover) -> "Crossover":
+    def __init__(self, crossover, rng : np.random.Generator = None) -> "Crossover":
         self.crossover_operator = crossover
+        self.rng = rng
         self.parents = []
         
         
-    def __call__(self, parent1, parent2):
-        return self.crossover_operator(parent1, parent2)
+    def __call__(self, parent1, parent2, rng : np.random.Generator = None):
+        return self.crossover_operator(parent1, parent2, rng = rng or self.rng)
     
     def __repr__(self) -> str:
         return "{}".format(self.crossover_operator.__name__)
     
 
-def single_point(p1,p2):
+def single_point(p1,p2, rng : np.random.Generator = None):
     """
     creates two children
     :param p1: parent 1
     """
     size = min(len(p1), len(p2))
-    point = random.randint(0,size - 1)
+    point = int(randomness.resolve(rng).integers(0, size))
 
     ch1 = list(p1[:point])
     ch1.extend(p2[point:])
@@ -31,19 +34,210 @@ def single_point(p1,p2):
     ch2.extend(p1[point:])
     return ch1, ch2
 
-def tsp_breed(p1, p2):
-    point1 = random.randint(0, len(p1))
-    point2 = random.randint(point1, len(p1))
+def tsp_breed(p1, p2, rng : np.random.Generator = None):
+    rng = randomness.resolve(rng)
+    point1 = int(rng.integers(0, len(p1) + 1))
+    point2 = int(rng.integers(point1, len(p1) + 1))
     
-    child1 = []
-    for i in range(point1, point2):
-        child1.append(p1[i])
-    child2 = [item for item in p2 if item not in child1]
+    child1 = list(p1[point1:point2])
+    members = set(child1)
+    child2 = [item for item in p2 if item not in members]
     
     return child1 + child2
 
-def uniform(parents):
-    pass
+def permutation_operator(operator):
+    """
+    Lets operators over integer routes work on routes of arbitrary
+    hashable items (City objects), by encoding them as positions in p1
+    """
+    def wrapper(p1, p2, rng : np.random.Generator = None):
+        rng = randomness.resolve(rng)
+        if isinstance(p1, np.ndarray) and p1.dtype.kind in "iu":
+            return operator(p1, np.asarray(p2), rng)
+        if isinstance(p1, list) and isinstance(p1[0], (int, np.integer)):
+            return operator(np.asarray(p1), np.asarray(p2), rng)
+        items = list(p1)
+        index = {item: pos for pos, item in enumerate(items)}
+        child = operator(np.arange(len(items)), np.fromiter((index[item] for item in p2),
+                                                            dtype=np.intp, count=len(items)), rng)
+        return [items[i] for i in child]
+    wrapper.__name__ = operator.__name__
+    wrapper.__doc__ = operator.__doc__
+    return wrapper
+
+def _cut_points(length : int, rng : np.random.Generator):
+    point1 = int(rng.integers(0, length))
+    point2 = int(rng.integers(point1 + 1, length + 1))
+    return point1, point2
+
+@permutation_operator
+def order(p1, p2, rng : np.random.Generator):
+    """
+    Order crossover (OX). Child keeps a segment of p1, the rest
+    is filled with cities of p2 in the order following the segment
+    """
+    length = len(p1)
+    point1, point2 = _cut_points(length, rng)
+    in_segment = np.zeros(length, dtype=bool)
+    in_segment[p1[point1:point2]] = True
+
+    rotated = np.roll(p2, -point2)
+    child = np.empty_like(p1)
+    child[point1:point2] = p1[point1:point2]
+    child[np.roll(np.arange(length), -point2)[:length - point2 + point1]] = rotated[~in_segment[rotated]]
+    return child
+
+@permutation_operator
+def partially_mapped(p1, p2, rng : np.random.Generator):
+    """
+    Partially mapped crossover (PMX). Child keeps a segment of p1,
+    conflicting cities of p2 are resolved through the segment mapping
+    """
+    length = len(p1)
+    point1, point2 = _cut_points(length, rng)
+    in_segment = np.zeros(length, dtype=bool)
+    in_segment[p1[point1:point2]] = True
+    position = np.empty(length, dtype=np.intp)
+    position[p1] = np.arange(length)
+
+    child = p2.copy()
+    child[point1:point2] = p1[point1:point2]
+    outside = np.concatenate((np.arange(point1), np.arange(point2, length)))
+    for i in outside[in_segment[p2[outside]]]:
+        value = p2[i]
+        while in_segment[value]:
+            value = p2[position[value]]
+        child[i] = value
+    return child
+
+@permutation_operator
+def cycle(p1, p2, rng : np.random.Generator):
+    """
+    Cycle crossover (CX). Cities keep their positions, alternating
+    cycles are taken from p1 and p2
+    """
+    length = len(p1)
+    position = np.empty(length, dtype=np.intp)
+    position[p1] = np.arange(length)
+    positions = position[p2].tolist()
+
+    from_first = np.zeros(length, dtype=bool)
+    visited = [False] * length
+    take_first = True
+    for start in range(length):
+        if visited[start]:
+            continue
+        current = start
+        while not visited[current]:
+            visited[current] = True
+            from_first[current] = take_first
+            current = positions[current]
+        take_first = not take_first
+    return np.where(from_first, p1, p2)
+
+@permutation_operator
+def edge_recombination(p1, p2, rng : np.random.Generator):
+    """
+    Edge recombination crossover (ERX). Child is built from edges of
+    both parents, preferring cities with the fewest remaining neighbours
+    """
+    length = len(p1)
+    neighbours = [set() for i in range(length)]
+    for parent in (p1.tolist(), p2.tolist()):
+        for pos, city in enumerate(parent):
+            neighbours[city].add(parent[pos - 1])
+            neighbours[city].add(parent[(pos + 1) % length])
+
+    unvisited = list(range(length))
+    unvisited_position = list(range(length))
+    child = np.empty_like(p1)
+    current = int(p1[0])
+    for pos in range(length):
+        child[pos] = current
+        last = unvisited.pop()
+        if last != current:
+            unvisited[unvisited_position[current]] = last
+            unvisited_position[last] = unvisited_position[current]
+        for neighbour in neighbours[current]:
+            neighbours[neighbour].discard(current)
+        if not unvisited:
+            break
+        if neighbours[current]:
+            fewest = min(len(neighbours[neighbour]) for neighbour in neighbours[current])
+            candidates = [neighbour for neighbour in neighbours[current]
+                          if len(neighbours[neighbour]) == fewest]
+            current = candidates[rng.integers(len(candidates))]
+        else:
+            current = unvisited[rng.integers(len(unvisited))]
+    return child
+
+def uniform(p1, p2, rng : np.random.Generator = None):
+    """
+    Uniform crossover, each gene is taken from a random parent.
+    For binary and real valued genomes, not for permutations
+    """
+    mask = randomness.resolve(rng).random(len(p1)) < 0.5
+    return np.where(mask, np.asarray(p1), np.asarray(p2))
+
+def uniform_packed(p1, p2, rng : np.random.Generator = None):
+    """
+    Uniform crossover of genomes packed by utils.bits, bits taken
+    from p1 where a random mask is set and from p2 elsewhere
+    """
+    p1, p2 = np.asarray(p1, dtype=np.uint8), np.asarray(p2, dtype=np.uint8)
+    mask = randomness.resolve(rng).integers(0, 256, p1.shape, dtype=np.uint8)
+    return (p1 & mask) | (p2 & ~mask)
+
+operators = {
+    "ox": order,
+    "pmx": partially_mapped,
+    "cx": cycle,
+    "erx": edge_recombination,
+    "tsp_breed": tsp_breed,
+    "uniform": uniform,
+    "uniform_packed": uniform_packed,
+}
+
+def get(name : str) -> Crossover:
+    """
+    Returns crossover operator registered under the name
+    """
+    return Crossover(operators[name])
+
+def test_permutation_operators():
+    """
+    Test that permutation crossovers produce permutations
+    """
+    print("Testing permutation crossovers")
+    for operator in [operator for operator in operators.values() if operator not in (uniform, uniform_packed)]:
+        for length in (2, 3, 10, 101):
+            p1 = np.random.permutation(length)
+            p2 = np.random.permutation(length)
+            assert sorted(operator(p1, p2)) == list(range(length))
+            assert sorted(operator(list(p1), list(p2))) == list(range(length))
+            cities = ["city" + str(i) for i in range(length)]
+            child = operator([cities[i] for i in p1], [cities[i] for i in p2])
+            assert sorted(child) == sorted(cities)
+
+def test_cycle():
+    """
+    Test cycle crossover keeps positions of the parents
+    """
+    print("Testing cycle crossover")
+    p1 = np.array([0, 1, 2, 3, 4, 5, 6, 7])
+    p2 = np.array([1, 2, 0, 4, 3, 6, 7, 5])
+    assert list(cycle(p1, p2)) == [0, 1, 2, 4, 3, 5, 6, 7]
+
+def run_tests():
+    """
+    Run tests for crossover operators
+    """
+    print("Running tests...")
+    print("================")
+    test_permutation_operators()
+    test_cycle()
+    print("================")
+    print("Tests were succesfull")
 
 if __name__ == "__main__":
-    print(single_point([1,1,1,1,1,1,1],[0,0,0,0,0,0,0,0]))
\ No newline at end of file
+    run_tests()
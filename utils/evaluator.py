@@ -0,0 +1,321 @@
+"""
+Population evaluation backends
+
+evaluate_batch evaluates a population matrix, the coroutine evaluate_async
+evaluates one genome so that a steady-state search can keep a number of
+evaluations in flight. Both merge call counts into the fitness function.
+"""
+import asyncio
+import inspect
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from utils.fitness import FitnessFunction, genome_key
+
+_worker_function = None
+
+def _init_worker(fitness_function : FitnessFunction):
+    """
+    Stores the fitness function (with its problem data) in the worker process,
+    the cache stays with the parent process
+    """
+    global _worker_function
+    _worker_function = fitness_function
+    _worker_function.cache = None
+
+def _evaluate_chunk(chunk):
+    """
+    Evaluates chunk of genomes in the worker process
+
+    Returns:
+        tuple: (fitness vector, number of calls made)
+    """
+    calls_before = _worker_function.calls_made
+    fitnesses = _worker_function.evaluate_batch(chunk)
+    return fitnesses, _worker_function.calls_made - calls_before
+
+def _evaluate_genome(genome):
+    """
+    Evaluates single genome in the worker process
+
+    Returns:
+        tuple: (fitness, number of calls made)
+    """
+    calls_before = _worker_function.calls_made
+    fitness = _worker_function(genome)
+    return fitness, _worker_function.calls_made - calls_before
+
+class SerialEvaluator:
+    """
+    Evaluates population in the calling process
+    """
+    def __init__(self, fitness_function : FitnessFunction) -> "SerialEvaluator":
+        self.fitness_function = fitness_function
+        self.workers = 1
+
+    def evaluate_batch(self, genomes):
+        return self.fitness_function.evaluate_batch(genomes)
+
+    async def evaluate_async(self, genome):
+        """
+        Evaluates genome in the calling thread, evaluations never overlap
+        """
+        return self.fitness_function(genome)
+
+    def close(self):
+        pass
+
+    def __repr__(self) -> str:
+        return "serial"
+
+class ProcessPoolEvaluator:
+    """
+    Evaluates population in a pool of worker processes.
+
+    The fitness function, including its problem data, is sent to each
+    worker once when the pool starts, tasks only carry chunks of genomes.
+    Fitness function and its mapping have to be picklable, so module level
+    functions or bound methods rather than lambdas. The cache of the fitness
+    function is looked up and filled in the parent process, only genomes
+    missing from it are sent to the workers.
+
+    Workers start on the first evaluation. SearchEngine shuts them down when
+    a search ends, a pool used on its own is closed by close or a with block.
+    """
+    def __init__(self, fitness_function : FitnessFunction, workers : int = None,
+                 chunks_per_worker : int = 2) -> "ProcessPoolEvaluator":
+        self.fitness_function = fitness_function
+        self.workers = workers or os.cpu_count()
+        self.chunks_per_worker = chunks_per_worker
+        self.executor = None
+
+    def start(self):
+        """
+        Starts worker processes, called on first evaluation
+        """
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                initializer=_init_worker, initargs=(self.fitness_function,))
+        return self
+
+    def evaluate_batch(self, genomes):
+        """
+        Evaluates 2-D array of genomes in worker processes,
+        worker call counts are merged into the fitness function
+        """
+        matrix = np.asarray(genomes)
+        if len(matrix) == 0:
+            return np.empty(0, dtype=np.float64)
+        cache = self.fitness_function.cache
+        if cache is None:
+            fitnesses = self._evaluate_rows(matrix)
+        else:
+            fitnesses, missing = self.fitness_function.lookup_batch(matrix)
+            if missing:
+                first_rows = [rows[0] for rows in missing.values()]
+                self.fitness_function.store_batch(fitnesses, missing, self._evaluate_rows(matrix[first_rows]))
+        self.fitness_function.last_fitness = fitnesses[-1]
+        return fitnesses
+
+    def _evaluate_rows(self, matrix):
+        """
+        Evaluates rows of the matrix in chunks in the worker processes
+        """
+        self.start()
+        chunks = np.array_split(matrix, min(len(matrix), self.workers * self.chunks_per_worker))
+        fitnesses = []
+        for chunk_fitnesses, calls in self.executor.map(_evaluate_chunk, chunks):
+            fitnesses.append(chunk_fitnesses)
+            self.fitness_function.calls_made += calls
+        return np.concatenate(fitnesses)
+
+    async def evaluate_async(self, genome):
+        """
+        Evaluates genome in a worker process without blocking the event loop,
+        cached genomes are answered without evaluation
+        """
+        cache = self.fitness_function.cache
+        if cache is not None:
+            key = genome_key(genome)
+            fitness = cache.get(key)
+            if fitness is not None:
+                return fitness
+        self.start()
+        fitness, calls = await asyncio.get_running_loop().run_in_executor(self.executor,
+            _evaluate_genome, genome)
+        self.fitness_function.calls_made += calls
+        self.fitness_function.last_fitness = fitness
+        if cache is not None:
+            cache.put(key, fitness)
+        return fitness
+
+    def close(self):
+        """
+        Shuts down worker processes
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self) -> "ProcessPoolEvaluator":
+        return self.start()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self) -> str:
+        return "process pool, workers: {}".format(self.workers)
+
+class AsyncioEvaluator:
+    """
+    Evaluates genomes as asyncio tasks.
+
+    Objective functions defined with async def are awaited in the event
+    loop, e.g. when an evaluation waits for a simulator process or a remote
+    service, any number of them can be in flight. Plain objective functions
+    run in a pool of worker threads, which pays off for kernels releasing
+    the GIL. Counters and cache of the fitness function are only touched
+    from the event loop thread.
+    """
+    def __init__(self, fitness_function : FitnessFunction, workers : int = None) -> "AsyncioEvaluator":
+        self.fitness_function = fitness_function
+        self.workers = workers or os.cpu_count()
+        self.executor = None
+
+    def _objective(self, genome):
+        function = self.fitness_function
+        return function.function(data = function.mapping(genome), bias = function.bias,
+                                 coefficients = function.coefficients)
+
+    async def evaluate_async(self, genome):
+        """
+        Evaluates genome, cached genomes are answered without evaluation
+        """
+        function = self.fitness_function
+        if function.cache is not None:
+            key = genome_key(genome)
+            fitness = function.cache.get(key)
+            if fitness is not None:
+                return fitness
+        function.calls_made += 1
+        if inspect.iscoroutinefunction(function.function):
+            fitness = await function.function(data = function.mapping(genome), bias = function.bias,
+                                              coefficients = function.coefficients)
+        else:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers)
+            fitness = await asyncio.get_running_loop().run_in_executor(self.executor, self._objective, genome)
+        function.last_fitness = fitness
+        if function.cache is not None:
+            function.cache.put(key, fitness)
+        return fitness
+
+    async def _gather(self, genomes):
+        return await asyncio.gather(*[self.evaluate_async(genome) for genome in genomes])
+
+    def evaluate_batch(self, genomes):
+        """
+        Evaluates 2-D array of genomes concurrently, must not be called
+        from a running event loop
+        """
+        return np.array(asyncio.run(self._gather(genomes)), dtype=np.float64)
+
+    def close(self):
+        """
+        Shuts down worker threads
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __repr__(self) -> str:
+        return "asyncio, workers: {}".format(self.workers)
+
+async def _sleepy_one_max(data, **kwargs):
+    """
+    one_max with uneven evaluation time, for tests
+    """
+    await asyncio.sleep(0.002 * (1 + int(data[0]) + int(data[-1])))
+    return int(np.sum(data))
+
+def test_evaluators():
+    """
+    Test that all backends agree and merge their call counts
+    """
+    from utils.fitness import one_max
+
+    print("Testing evaluators")
+    genomes = np.random.default_rng(0).integers(0, 2, (12, 16))
+    expected = genomes.sum(axis=1)
+    for make in (SerialEvaluator, lambda function: ProcessPoolEvaluator(function, 2),
+                 lambda function: AsyncioEvaluator(function, 2)):
+        evaluator = make(FitnessFunction(one_max))
+        try:
+            assert (evaluator.evaluate_batch(genomes) == expected).all()
+            async def evaluate():
+                return await asyncio.gather(*[evaluator.evaluate_async(genome) for genome in genomes])
+            assert asyncio.run(evaluate()) == expected.tolist()
+            assert evaluator.fitness_function.calls_made == 2 * len(genomes)
+        finally:
+            evaluator.close()
+
+def test_cache():
+    """
+    Test that the process pool answers cached genomes in the parent process
+    """
+    from utils.fitness import one_max
+
+    print("Testing evaluator cache")
+    genomes = np.random.default_rng(3).integers(0, 2, (10, 16))
+    batch = np.concatenate([genomes, genomes[:4]])
+    function = FitnessFunction(one_max, cache = 100)
+    with ProcessPoolEvaluator(function, 2) as evaluator:
+        assert (evaluator.evaluate_batch(batch) == batch.sum(axis=1)).all()
+        assert function.calls_made == 10 and function.cache.hits == 4 and function.cache.misses == 10
+        assert (evaluator.evaluate_batch(genomes[::-1]) == genomes[::-1].sum(axis=1)).all()
+        assert asyncio.run(evaluator.evaluate_async(genomes[0])) == genomes[0].sum()
+        assert function.calls_made == 10 and function.cache.hits == 15 and len(function.cache) == 10
+        assert evaluator.evaluate_batch(genomes[:0]).shape == (0,)
+
+def test_steady_state():
+    """
+    Test steady-state search with serial and asynchronous evaluation
+    """
+    from search.search import SearchEngine
+    from utils import initialization, perturbation, replacement, selection
+    from utils.condition import LoopCondition
+    from utils.fitness import one_max
+
+    print("Testing steady-state search")
+    for evaluator, objective, insertion in ((SerialEvaluator, one_max, replacement.replace_worst),
+            (AsyncioEvaluator, _sleepy_one_max, replacement.replace_tournament)):
+        function = FitnessFunction(objective)
+        engine = SearchEngine(function, perturbation.Mutator(perturbation.bitflip_multiple, 1 / 16),
+            LoopCondition(200), replacement.Replacer(replacement.elite, "uniform"),
+            selection.Selector(selection.tournament, tourn_size = 3), evaluator = evaluator(function),
+            rng = 1, hooks = [])
+        initial = initialization.populate_array(20, lambda rng: initialization.chromosome(16, rng),
+                                                 rng = np.random.default_rng(2))
+        initial_best = min(sum(genome) for genome in initial)
+        best = engine.steady_state(initial, in_flight = 8, insertion = insertion, tourn_size = 3)
+        assert function.calls_made == 220 and engine.terminated
+        assert best.fitness <= initial_best and engine.timer.totals()["evaluations"] == 200
+        assert engine.fitnesses[-1] == best.fitness == np.sum(best.value)
+        engine.evaluator.close()
+
+def run_tests():
+    """
+    Run tests for evaluators
+    """
+    print("Running tests...")
+    print("================")
+    test_evaluators()
+    test_cache()
+    test_steady_state()
+    print("================")
+    print("Tests were succesfull")
+
+if __name__ == "__main__":
+    run_tests()
@@ -3,28 +3,118 @@ Fitness (Objective) function utilities
 """
 
 from audioop import bias
+from collections import OrderedDict
 import math
 
+import numpy as np
+
+from utils import bits
+
+def identity(data):
+    """
+    Default mapping, genome is evaluated as is
+    """
+    return data
+
+def genome_key(data) -> bytes:
+    """
+    Compact hashable key of a genome. Binary genomes are packed to bits,
+    byte genomes use their bytes tagged with the dtype, other integer
+    (index) and real genomes bytes of their 64 bit array, genomes of
+    objects (City routes) use identities of the objects.
+    """
+    array = np.asarray(data)
+    if array.dtype == object:
+        return b"o" + np.fromiter(map(id, data), dtype=np.int64, count=len(array)).tobytes()
+    if array.dtype.kind in "biu":
+        if array.size == 0 or (array.min() >= 0 and array.max() <= 1):
+            return b"b" + len(array).to_bytes(8, "little") + np.packbits(array.astype(bool)).tobytes()
+        if array.dtype.itemsize == 1:
+            return b"c" + array.dtype.str[1:].encode() + array.tobytes()
+        return b"i" + array.astype(np.int64).tobytes()
+    return b"f" + array.astype(np.float64).tobytes()
+
+class FitnessCache:
+    """
+    Bounded cache of fitness values keyed by genome_key,
+    least recently used entries are evicted first
+    """
+    def __init__(self, max_size : int = 100000) -> "FitnessCache":
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key : bytes):
+        """
+        Returns cached fitness or None
+        """
+        fitness = self.entries.get(key)
+        if fitness is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return fitness
+
+    def put(self, key : bytes, fitness):
+        self.entries[key] = fitness
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __repr__(self) -> str:
+        return "size: {}/{}, hits: {}, misses: {}, evictions: {}".format(len(self), self.max_size,
+            self.hits, self.misses, self.evictions)
+
 class FitnessFunction:
     """
     Wrapper object used for storing statistics
+
+    Optional delta function (data, moves, fitness, state) -> (fitness, state)
+    updates fitness of a mutated individual from its parent's fitness.
+    Batch function evaluates a whole population matrix at once. Vectorized
+    and delta kernels of the functions in this module are looked up automatically.
+    Mappings marked vectorized are applied to the whole matrix.
+    Optional cache (FitnessCache or its size) skips genomes seen before,
+    calls_made then counts only real objective evaluations.
     """
     def __init__(self, function,
         bias = None,
         coefficients = None,
-        mapping = lambda x : x,
+        mapping = identity,
+        delta = None,
+        batch_function = None,
+        cache = None,
         **kwargs):
 
         self.last_fitness = None
         self.bias = bias
         self.coefficients = coefficients
         self.calls_made = 0
+        self.delta_calls = 0
         self.mapping = mapping
         self.function = function
+        self.delta = delta or delta_kernels.get(function)
+        self.batch_function = batch_function or batch_kernels.get(function)
+        self.cache = FitnessCache(cache) if isinstance(cache, int) else cache
         
     def clear(self):
         self.last_fitness = None
         self.calls_made = 0
+        self.delta_calls = 0
+        if self.cache is not None:
+            self.cache.clear()
     
     def set_bias(self, bias):
         """
@@ -44,14 +134,112 @@ class FitnessFunction:
         """
         return self.calls_made
 
+    def get_number_of_cache_hits(self):
+        """
+        Returns number of evaluations answered by the cache
+        """
+        return 0 if self.cache is None else self.cache.hits
+
     def __call__(self, data : list):
+        if self.cache is not None:
+            key = genome_key(data)
+            fitness = self.cache.get(key)
+            if fitness is not None:
+                self.last_fitness = fitness
+                return fitness
         self.calls_made += 1
         self.last_fitness = self.function(data = self.mapping(data), bias = self.bias, coefficients = self.coefficients)
+        if self.cache is not None:
+            self.cache.put(key, self.last_fitness)
         return self.last_fitness
+
+    def evaluate_batch(self, population_matrix):
+        """
+        Evaluates 2-D array of genomes, one genome per row
+
+        Returns:
+            np.ndarray: fitness vector
+        """
+        matrix = np.asarray(population_matrix)
+        if self.cache is None:
+            fitnesses = self._evaluate_rows(matrix)
+        else:
+            fitnesses, missing = self.lookup_batch(matrix)
+            if missing:
+                first_rows = [rows[0] for rows in missing.values()]
+                self.store_batch(fitnesses, missing, self._evaluate_rows(matrix[first_rows]))
+        if len(fitnesses):
+            self.last_fitness = fitnesses[-1]
+        return fitnesses
+
+    def lookup_batch(self, matrix):
+        """
+        Fills fitness of the rows found in the cache, rows repeating
+        a genome of the batch count as cache hits
+
+        Returns:
+            tuple: (fitness vector, {key: rows} of the genomes to evaluate)
+        """
+        fitnesses = np.empty(len(matrix), dtype=np.float64)
+        missing = {}
+        for row, genome in enumerate(matrix):
+            key = genome_key(genome)
+            if key in missing:
+                missing[key].append(row)
+                self.cache.hits += 1
+                continue
+            fitness = self.cache.get(key)
+            if fitness is None:
+                missing[key] = [row]
+            else:
+                fitnesses[row] = fitness
+        return fitnesses, missing
+
+    def store_batch(self, fitnesses, missing : dict, values):
+        """
+        Writes fitness values of the missing genomes (in the order of
+        lookup_batch) to their rows and to the cache
+        """
+        for (key, rows), fitness in zip(missing.items(), np.asarray(values).tolist()):
+            fitnesses[rows] = fitness
+            self.cache.put(key, fitness)
+
+    def _evaluate_rows(self, matrix):
+        """
+        Evaluates rows of the matrix with the objective, counting the calls
+        """
+        self.calls_made += len(matrix)
+        if self.batch_function is not None and (self.mapping is identity or getattr(self.mapping, "vectorized", False)):
+            fitnesses = self.batch_function(data = self.mapping(matrix), bias = self.bias, coefficients = self.coefficients)
+            return np.asarray(fitnesses, dtype=np.float64)
+        return np.array([self.function(data = self.mapping(row), bias = self.bias,
+            coefficients = self.coefficients) for row in matrix], dtype=np.float64)
+
+    def evaluate(self, individual : "Individual"):
+        """
+        Evaluates individual in place. Unchanged children keep the inherited
+        fitness, children with reported moves are updated by the delta function
+        when there is one and the genome is evaluated unmapped.
+        """
+        if individual.fitness is not None and not individual.moves:
+            individual.moves = None
+            return individual.fitness
+
+        if individual.fitness is not None and self.delta is not None and self.mapping is identity:
+            self.calls_made += 1
+            self.delta_calls += 1
+            self.last_fitness, individual.state = self.delta(data = individual.value,
+                moves = individual.moves, fitness = individual.fitness, state = individual.state)
+        else:
+            self(individual.value)
+            individual.state = None
+        individual.fitness = self.last_fitness
+        individual.moves = None
+        return individual.fitness
     
     def __repr__(self):
-        return "{}, mapping: {}, calls_made: {}, bias: {}, coefficients: {}".format(self.function.__name__,
-            self.mapping.__name__, self.calls_made, self.bias, self.coefficients)
+        return "{}, mapping: {}, calls_made: {}, bias: {}, coefficients: {}, cache: {}".format(self.function.__name__,
+            self.mapping.__name__, self.calls_made, self.bias, self.coefficients, self.cache)
 
 def tsp_route_distance(data : list, **kwargs):
     """
@@ -69,22 +257,52 @@ def one_max(data : list = 0, **kwargs):
     """
     return sum(data)
 
-def labs(data : "list[int]", **kwargs):
+def one_max_packed(data, **kwargs):
     """
-    LABS (Low-Autocorrelation binary sequence) fitness function
+    one_max of a genome packed by utils.bits
     """
-    assert all([(item==0 or item==1) for item in data])
+    return int(bits.popcount(data))
 
-    chromosome = [-1 if x==0 else x for x in data ]
-    energy = 0
-    chromoseome_length = len(chromosome)
+def labs_correlations(data) -> np.ndarray:
+    """
+    Aperiodic autocorrelations C_1 .. C_{n-1} of the +-1 sequence of a binary
+    genome (or of each row of a matrix), computed with FFT in O(n log n)
+    """
+    chromosome = 2 * np.asarray(data, dtype=np.float64) - 1
+    length = chromosome.shape[-1]
+    spectrum = np.fft.rfft(chromosome, 2 * length, axis=-1)
+    correlations = np.fft.irfft(spectrum * spectrum.conj(), 2 * length, axis=-1)[..., 1:length]
+    return np.rint(correlations).astype(np.int64)
 
-    for k in range(1,chromoseome_length):
-        corr = 0
-        for i in range(0, chromoseome_length - k):
-            corr += chromosome[i] * chromosome[i+ k]
-        energy += corr*corr
-    return energy
+def labs(data : "list[int]", **kwargs):
+    """
+    LABS (Low-Autocorrelation binary sequence) fitness function,
+    sum of squared autocorrelations
+    """
+    correlations = labs_correlations(data)
+    return int((correlations * correlations).sum())
+
+def labs_delta(data, moves : list, fitness : float, state = None, **kwargs):
+    """
+    Updates labs of a child from its parent by the reported bit flips,
+    each flip changes one term of every autocorrelation, O(n) per flip.
+    State is the autocorrelation table of the genome, it is computed
+    for the parent when missing.
+    """
+    chromosome = 2 * np.asarray(data, dtype=np.int64) - 1
+    flipped = [move[1] for move in moves]
+    if any(move[0] != "flip" for move in moves):
+        raise ValueError("labs_delta supports only flip moves")
+    for index in flipped:
+        chromosome[index] = -chromosome[index]
+    correlations = labs_correlations((chromosome + 1) // 2) if state is None else state.copy()
+    length = len(chromosome)
+    for index in flipped:
+        value = 2 * chromosome[index]
+        correlations[:length - 1 - index] -= value * chromosome[index + 1:]
+        correlations[:index] -= value * chromosome[:index][::-1]
+        chromosome[index] = -chromosome[index]
+    return int((correlations * correlations).sum()), correlations
 
 def sphere(data : "list[int | float]", coefficients : "list[float | int]", **kwargs):
     """
@@ -171,6 +389,100 @@ def schwefel(data : "list[int | float]", **kwargs):
 
     return -result
 
+def tsp_route_distance_batch(data, **kwargs):
+    """
+    Vectorized tsp_route_distance over a matrix of City routes
+    """
+    x = np.array([[city.x for city in route] for route in data], dtype=np.float64)
+    y = np.array([[city.y for city in route] for route in data], dtype=np.float64)
+    return np.hypot(x - np.roll(x, -1, axis=1), y - np.roll(y, -1, axis=1)).sum(axis=1)
+
+def one_max_batch(data, **kwargs):
+    """
+    Vectorized one_max
+    """
+    return np.asarray(data).sum(axis=1)
+
+def one_max_packed_batch(data, **kwargs):
+    """
+    Vectorized one_max_packed, popcount of the rows
+    """
+    return bits.popcount(data)
+
+def labs_batch(data, **kwargs):
+    """
+    Vectorized labs, FFT autocorrelations of all rows at once
+    """
+    correlations = labs_correlations(data)
+    return (correlations * correlations).sum(axis=-1)
+
+def sphere_batch(data, coefficients, **kwargs):
+    """
+    Vectorized sphere
+    """
+    difference = np.asarray(data, dtype=np.float64) - np.asarray(coefficients)
+    return (difference * difference).sum(axis=1)
+
+def rosenbrock_batch(data, **kwargs):
+    """
+    Vectorized rosenbrock
+    """
+    data = np.asarray(data, dtype=np.float64)
+    head, tail = data[:, :-1], data[:, 1:]
+    return (100 * (tail - head * head) ** 2 + (1 - head) * (1 - head)).sum(axis=1)
+
+def linear_batch(data, bias, coefficients, **kwargs):
+    """
+    Vectorized linear
+    """
+    return bias + np.asarray(data, dtype=np.float64) @ np.asarray(coefficients, dtype=np.float64)
+
+def step_batch(data, bias, coefficients, **kwargs):
+    """
+    Vectorized step
+    """
+    return bias + np.floor(np.asarray(data, dtype=np.float64) * np.asarray(coefficients)).sum(axis=1)
+
+def rastrigin_batch(data, **kwargs):
+    """
+    Vectorized rastrigin
+    """
+    data = np.asarray(data, dtype=np.float64)
+    return 10 * data.shape[1] + (data * data - 10 * np.cos(2 * math.pi * data)).sum(axis=1)
+
+def griewank_batch(data, **kwargs):
+    """
+    Vectorized griewank
+    """
+    data = np.asarray(data, dtype=np.float64)
+    product = np.cos(data / np.sqrt(np.arange(1, data.shape[1] + 1))).prod(axis=1)
+    return (data * data).sum(axis=1) / 4000 + 1 - product
+
+def schwefel_batch(data, **kwargs):
+    """
+    Vectorized schwefel
+    """
+    data = np.asarray(data, dtype=np.float64)
+    return -(data * np.sin(np.sqrt(np.abs(data)))).sum(axis=1)
+
+batch_kernels = {
+    tsp_route_distance: tsp_route_distance_batch,
+    one_max: one_max_batch,
+    one_max_packed: one_max_packed_batch,
+    labs: labs_batch,
+    sphere: sphere_batch,
+    rosenbrock: rosenbrock_batch,
+    linear: linear_batch,
+    step: step_batch,
+    rastrigin: rastrigin_batch,
+    griewank: griewank_batch,
+    schwefel: schwefel_batch,
+}
+
+delta_kernels = {
+    labs: labs_delta,
+}
+
 def test_schwefel():
     """
     Test schwefel function
@@ -292,6 +604,25 @@ def test_labs():
     assert labs([0,1,0,1,0,1,0,1,0,1]) == 285
     assert labs([0,0,0,0,0,1,1,1,1,1]) == 125
 
+def test_labs_delta():
+    """
+    Test incremental labs against full evaluation after random flips
+    """
+    print("Testing labs delta")
+    rng = np.random.default_rng(2)
+    for length in (1, 2, 7, 64, 301):
+        parent = rng.integers(0, 2, length)
+        fitness, state = labs(parent), None
+        for _ in range(20):
+            moves = [("flip", int(index)) for index in rng.integers(0, length, rng.integers(1, 4))]
+            child = parent.copy()
+            for _, index in moves:
+                child[index] = 1 - child[index]
+            fitness, state = labs_delta(child, moves, fitness, state)
+            assert fitness == labs(child) and (state == labs_correlations(child)).all()
+            parent = child
+    assert FitnessFunction(labs).delta is labs_delta
+
 def test_one_max():
     """
     Run tests for one_max fitness function
@@ -307,6 +638,46 @@ def test_one_max():
     assert one_max([0,1,0,1,0,1,0,1,0,1]) == 5
     assert one_max([0,0,0,0,0,1,1,1,1,1]) == 5
 
+def test_batch():
+    """
+    Test vectorized kernels against the scalar functions
+    """
+    print("Testing batch evaluation")
+    matrix = np.random.default_rng(0).uniform(-5, 5, (7, 10))
+    binary = np.random.default_rng(1).integers(0, 2, (7, 10))
+    for function, data, kwargs in ((sphere, matrix, {"coefficients" : [1] * 10}),
+                                   (rosenbrock, matrix, {}),
+                                   (rastrigin, matrix, {}),
+                                   (griewank, matrix, {}),
+                                   (schwefel, matrix, {}),
+                                   (linear, matrix, {"bias" : 1, "coefficients" : range(10)}),
+                                   (step, matrix, {"bias" : 1, "coefficients" : range(10)}),
+                                   (one_max, binary, {}),
+                                   (labs, binary, {})):
+        func = FitnessFunction(function, **kwargs)
+        fitnesses = func.evaluate_batch(data)
+        assert func.calls_made == len(data)
+        for row, value in zip(data, fitnesses):
+            assert abs(function(list(row), **kwargs) - value) < 1e-9
+
+def test_cache():
+    """
+    Test that cached evaluations are counted separately
+    """
+    print("Testing fitness cache")
+    func = FitnessFunction(labs, cache = 2)
+    assert func([0,0,1]) == 1 and func([0,0,1]) == 1
+    assert func.calls_made == 1 and func.get_number_of_cache_hits() == 1
+    fitnesses = func.evaluate_batch([[0,0,1], [1,1,1], [1,1,1], [0,1,1]])
+    assert list(fitnesses) == [1, 5, 5, 1]
+    assert func.calls_made == 3 and func.get_number_of_cache_hits() == 3 and func.cache.misses == 3
+    assert len(func.cache) == 2 and func.cache.evictions == 1
+    assert genome_key([1,0,1]) == genome_key(np.array([True,False,True])) != genome_key([1,0,1,0])
+    assert genome_key([3,1,2]) == genome_key(np.array([3,1,2], dtype=np.int32))
+    packed = np.array([3,1,2,0,7], dtype=np.uint8)
+    assert genome_key(packed) == b"cu1" + packed.tobytes() and len(genome_key(packed)) == 8
+    assert genome_key(packed) != genome_key(packed.astype(np.int8)) != genome_key(packed.astype(np.int64))
+
 def run_tests():
     """
     Run tests for fitness functions
@@ -315,6 +686,7 @@ def run_tests():
     print("================")
     test_one_max()
     test_labs()
+    test_labs_delta()
     test_sphere()
     test_rosenbrock()
     test_linear()
@@ -322,6 +694,8 @@ def run_tests():
     test_rastrigin()
     test_griewank()
     test_schwefel()
+    test_batch()
+    test_cache()
     print("================")
     print("Tests were succesfull")
 
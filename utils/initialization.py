@@ -1,23 +1,35 @@
-import random
+import numpy as np
 
+from utils import bits
+from utils import randomness
 
-def populate_array(size : int, init_function):
-    """_summary_
+
+def populate_array(size : int, init_function, rng : np.random.Generator = None):
+    """
+    Creates population of size individuals, each made by its own init_function call
 
     Args:
-        size (int): _description_
-        initFucntion (_type_): _description_
+        size (int): population size
+        init_function (callable): returns new individual, gets rng when one is given
 
     Returns:
-        _type_: _description_
+        list: population
     """
-    return [init_function()]*size
+    if rng is None:
+        return [init_function() for i in range(size)]
+    return [init_function(rng = rng) for i in range(size)]
+
+def tsp_route(cities, rng : np.random.Generator = None):
+    return [cities[i] for i in randomness.resolve(rng).permutation(len(cities))]
+
+def chromosome(length : int, rng : np.random.Generator = None):
+    return randomness.resolve(rng).integers(0, 2, length).tolist()
 
-def tsp_route(cities):
-    return random.sample(cities, len(cities))
+def packed_chromosome(length : int, rng : np.random.Generator = None):
+    return bits.random_genome(length, rng = rng)
 
-def chromosome(length : int):
-    return [random.randint(0,1) for i in range(length)]
+def real_vector(length : int, lower_bound : float, upper_bound : float, rng : np.random.Generator = None):
+    return randomness.resolve(rng).uniform(lower_bound, upper_bound, length).tolist()
 
 def populate_matrix():
     """_summary_
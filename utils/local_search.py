@@ -0,0 +1,207 @@
+"""
+Local improvement of TSP routes, 2-opt and Or-opt moves
+driven by nearest neighbour candidate lists and don't-look bits
+"""
+from collections import deque
+from time import perf_counter
+
+import numpy as np
+
+from utils.tsp import TSPProblem
+
+class LocalSearch:
+    """
+    Improves routes of index arrays until no improving 2-opt or Or-opt move
+    is found among the candidate neighbours, or the budget runs out.
+
+    Budget is per route, number of evaluated moves and/or time in seconds.
+    """
+    def __init__(self, problem : TSPProblem, neighbours : int = 8, or_opt : bool = True,
+                 max_evaluations : int = None, time_limit : float = None,
+                 epsilon : float = 1e-9) -> "LocalSearch":
+        self.problem = problem
+        self.neighbour_count = neighbours
+        self.neighbours = problem.nearest_neighbours(neighbours).tolist()
+        self.or_opt = or_opt
+        self.max_evaluations = max_evaluations
+        self.time_limit = time_limit
+        self.epsilon = epsilon
+        if problem.edges.matrix is not None:
+            self.distance = problem.edges.matrix.item
+        else:
+            self.distance = lambda start, finish: float(problem.edges.distance(start, finish))
+
+        self.evaluations = 0
+        self.improvements = 0
+
+    def __repr__(self) -> str:
+        return "2-opt{}, neighbours: {}, evaluations budget: {}, time limit: {}".format(
+            " + Or-opt" if self.or_opt else "", self.neighbour_count,
+            self.max_evaluations, self.time_limit)
+
+    def __call__(self, route):
+        return self.improve(route)
+
+    def improve_population(self, population : list) -> list:
+        """
+        Improves each route of the population
+        """
+        return [self.improve(route) for route in population]
+
+    def improve(self, route):
+        """
+        Returns improved copy of the route, routes of City objects
+        are encoded to indices and decoded back
+        """
+        encoded = not isinstance(route[0], (int, np.integer))
+        tour = self.problem.encode(route).tolist() if encoded else [int(city) for city in route]
+        self.improve_tour(tour)
+        if encoded:
+            return self.problem.decode(tour)
+        return np.array(tour, dtype=np.intp)
+
+    def improve_tour(self, tour : "list[int]"):
+        """
+        Improves tour list in place, returns the total gain
+        """
+        size = len(tour)
+        if size < 5:
+            return 0.0
+        distance = self.distance
+        position = [0] * size
+        for pos, city in enumerate(tour):
+            position[city] = pos
+
+        evaluations = 0
+        started = perf_counter()
+        total_gain = 0.0
+        look = [True] * size
+        queue = deque(tour)
+
+        def wake(*cities):
+            for city in cities:
+                if not look[city]:
+                    look[city] = True
+                    queue.append(city)
+
+        def reverse(first, last):
+            # reverses the forward path first..last, or its complement if shorter
+            i, j = position[first], position[last]
+            length = (j - i) % size + 1
+            if 2 * length > size:
+                i, j = (j + 1) % size, (i - 1) % size
+                length = size - length
+            for _ in range(length // 2):
+                city_i, city_j = tour[i], tour[j]
+                tour[i], tour[j] = city_j, city_i
+                position[city_j], position[city_i] = i, j
+                i = (i + 1) % size
+                j = (j - 1) % size
+
+        while queue:
+            if self.max_evaluations is not None and evaluations >= self.max_evaluations:
+                break
+            if self.time_limit is not None and perf_counter() - started >= self.time_limit:
+                break
+            a = queue.popleft()
+            look[a] = False
+            improved = False
+
+            # 2-opt, replace edges (a, b), (c, d) with (a, c), (b, d)
+            for forward in (True, False):
+                b = tour[(position[a] + 1) % size] if forward else tour[position[a] - 1]
+                d_ab = distance(a, b)
+                for c in self.neighbours[a]:
+                    g1 = d_ab - distance(a, c)
+                    if g1 <= self.epsilon:
+                        break
+                    d = tour[(position[c] + 1) % size] if forward else tour[position[c] - 1]
+                    if d == a or c == b:
+                        continue
+                    evaluations += 1
+                    gain = g1 + distance(c, d) - distance(b, d)
+                    if gain > self.epsilon:
+                        if forward:
+                            reverse(b, c)
+                        else:
+                            reverse(a, d)
+                        total_gain += gain
+                        self.improvements += 1
+                        wake(a, b, c, d)
+                        improved = True
+                        break
+                if improved:
+                    break
+
+            # Or-opt, move segment of 1-3 cities starting at a next to its neighbour
+            if not improved and self.or_opt:
+                for length in (1, 2, 3):
+                    if length > size - 3:
+                        break
+                    start = position[a]
+                    e = tour[(start + length - 1) % size]
+                    p = tour[start - 1]
+                    f = tour[(start + length) % size]
+                    removal = distance(p, a) + distance(e, f) - distance(p, f)
+                    for c in self.neighbours[a]:
+                        g1 = removal - distance(a, c)
+                        if g1 <= self.epsilon:
+                            break
+                        offset = (position[c] - start) % size
+                        if offset < length:
+                            continue
+                        evaluations += 2
+                        d = tour[(position[c] + 1) % size]
+                        q = tour[position[c] - 1]
+                        after = g1 - distance(e, d) + distance(c, d) if c != p else 0.0
+                        before = g1 - distance(q, e) + distance(q, c) if c != f else 0.0
+                        if max(after, before) > self.epsilon:
+                            rotated = tour[start:] + tour[:start]
+                            segment, rest = rotated[:length], rotated[length:]
+                            insert = offset - length
+                            if after >= before:
+                                rotated = rest[:insert + 1] + segment + rest[insert + 1:]
+                            else:
+                                rotated = rest[:insert] + segment[::-1] + rest[insert:]
+                            tour[:] = rotated
+                            for pos, city in enumerate(tour):
+                                position[city] = pos
+                            total_gain += max(after, before)
+                            self.improvements += 1
+                            wake(a, e, p, f, c, d, q)
+                            improved = True
+                            break
+                    if improved:
+                        break
+
+        self.evaluations += evaluations
+        return total_gain
+
+def test_local_search():
+    """
+    Test reported gains and that routes stay permutations
+    """
+    print("Testing local search")
+    rng = np.random.default_rng(4)
+    for mode in ("full", "lazy"):
+        problem = TSPProblem(coordinates=rng.random((120, 2)), mode=mode)
+        search = LocalSearch(problem, neighbours=6)
+        route = rng.permutation(120).tolist()
+        before = problem.route_distance(route)
+        gain = search.improve_tour(route)
+        assert sorted(route) == list(range(120))
+        assert abs(before - gain - problem.route_distance(route)) < 1e-3
+        assert problem.route_distance(route) < 0.3 * before
+
+def run_tests():
+    """
+    Run tests for local search
+    """
+    print("Running tests...")
+    print("================")
+    test_local_search()
+    print("================")
+    print("Tests were succesfull")
+
+if __name__ == "__main__":
+    run_tests()
@@ -1,35 +1,125 @@
 """
 Mapping functions
+
+Parametrized mappings for FitnessFunction are small callable objects rather
+than closures, so that engines using them can be pickled for process pools
+with a spawning start method.
 """
 import math
+from functools import lru_cache
+
+import numpy as np
+
+from utils import bits
 
 def binary_to_interval(data : "list[int]", lower_bound : list, upper_bound : list):
     """
-    Binary -> <lower_bound, upper_bound> real number mapping
+    Binary -> <lower_bound, upper_bound> real number mapping,
+    a matrix of genomes is mapped row by row to a matrix
     """
-    assert all([((item==0 or item==1)) for item in data])
+    array = np.asarray(data)
+    assert ((array == 0) | (array == 1)).all()
     assert len(lower_bound) == len(upper_bound)
-    assert len(data) % len(lower_bound) == 0
+    assert array.shape[-1] % len(lower_bound) == 0
 
-    cell_size = len(data)//len(lower_bound)
+    cell_size = array.shape[-1]//len(lower_bound)
     denominator = math.pow(2, cell_size) - 1
-    result = [0] * len(lower_bound)
-    for pos, value in enumerate(lower_bound):
-        numerator = binary_to_decimal(data[pos*cell_size : (pos+1)*cell_size])
-        numerator *= abs(upper_bound[pos] - value)
-        result[pos] = numerator / denominator + value
-    return result
+    numerator = binary_to_decimal(array.reshape(array.shape[:-1] + (len(lower_bound), cell_size)))
+    lower_bound = np.asarray(lower_bound)
+    result = numerator * np.abs(np.asarray(upper_bound) - lower_bound) / denominator + lower_bound
+    return result.tolist() if array.ndim == 1 else result
+
+class VectorizedMapping:
+    """
+    Base of parametrized mappings applied to whole population matrices
+    """
+    vectorized = True
+
+    def __init__(self, name : str) -> "VectorizedMapping":
+        self.__name__ = name
+
+    def __repr__(self) -> str:
+        return self.__name__
+
+class ObjectiveVariables(VectorizedMapping):
+    """
+    Genomes with appended strategy parameters -> their first dimension values
+    """
+    def __init__(self, dimension : int) -> "ObjectiveVariables":
+        VectorizedMapping.__init__(self, "objective")
+        self.dimension = dimension
+
+    def __call__(self, data):
+        return np.asarray(data)[..., :self.dimension]
+
+class Unpacked(VectorizedMapping):
+    """
+    Genomes packed by utils.bits -> 0/1 genomes
+    """
+    def __init__(self, length : int) -> "Unpacked":
+        VectorizedMapping.__init__(self, "unpack")
+        self.length = length
+
+    def __call__(self, data):
+        return bits.unpack(data, self.length).astype(np.int64)
+
+class Interval(VectorizedMapping):
+    """
+    binary_to_interval with fixed bounds, of packed genomes when length is given
+    """
+    def __init__(self, lower_bound : list, upper_bound : list, length : int = None) -> "Interval":
+        VectorizedMapping.__init__(self, "binary_interval")
+        self.lower_bound = lower_bound
+        self.upper_bound = upper_bound
+        self.length = length
+
+    def __call__(self, data):
+        if self.length is not None:
+            data = bits.unpack(data, self.length)
+        return binary_to_interval(data, self.lower_bound, self.upper_bound)
+
+def objective_variables(dimension : int) -> ObjectiveVariables:
+    """
+    Mapping of genomes with appended strategy parameters (self-adaptive sigmas)
+    to their first dimension values, works on single genomes and population matrices
+    """
+    return ObjectiveVariables(dimension)
+
+@lru_cache(maxsize=64)
+def _powers(length : int) -> np.ndarray:
+    """
+    Weights 2**(length-1) .. 1 of the bits, Python ints beyond int64
+    """
+    if length > 62:
+        return np.array([2**(length-1-position) for position in range(length)], dtype=object)
+    powers = 2 ** np.arange(length - 1, -1, -1, dtype=np.int64)
+    powers.flags.writeable = False
+    return powers
 
 def binary_to_decimal(binary : "list[int]"):
     """
-    Maps binary chromosome to decimal number
+    Maps binary chromosome to decimal number, rows of a matrix to a vector
+    """
+    array = np.asarray(binary)
+    assert ((array == 0) | (array == 1)).all()
+
+    powers = _powers(array.shape[-1])
+    decimal = array.astype(powers.dtype) @ powers
+    return int(decimal) if array.ndim == 1 else decimal
+
+def unpacked(length : int):
+    """
+    Vectorized mapping of genomes packed by utils.bits to 0/1 genomes,
+    e.g. for labs
     """
-    assert all([((item==0 or item==1)) for item in binary])
+    return Unpacked(length)
 
-    decimal = 0
-    for position, value in enumerate(binary):
-        decimal += value * 2**(len(binary)-1-position)
-    return decimal
+def interval(lower_bound : list, upper_bound : list, length : int = None):
+    """
+    Vectorized binary_to_interval mapping for FitnessFunction,
+    genomes packed by utils.bits when their length is given
+    """
+    return Interval(lower_bound, upper_bound, length)
 
 def test_binary_to_interval():
     """
@@ -66,6 +156,26 @@ def test_binary_to_decimal():
     assert binary_to_decimal([0,1,0,1,0,1,0,1,0,1]) == 341
     assert binary_to_decimal([0,0,0,0,0,1,1,1,1,1]) == 31
 
+def test_vectorized():
+    """
+    Test mapping of population matrices and packed genomes
+    """
+    import pickle
+
+    print("Testing vectorized mapping")
+    rng = np.random.default_rng(0)
+    population = rng.integers(0, 2, (20, 12))
+    expected = [binary_to_interval(list(row), [0,-4,-4,-8], [7,3,4,0]) for row in population.tolist()]
+    assert binary_to_interval(population, [0,-4,-4,-8], [7,3,4,0]).tolist() == expected
+    assert interval([0,-4,-4,-8], [7,3,4,0], 12)(bits.pack(population)).tolist() == expected
+    assert (unpacked(12)(bits.pack(population)) == population).all()
+    assert binary_to_decimal([1] * 70) == 2**70 - 1
+    assert binary_to_interval([1] * 140, [0, 0], [1, 2]) == [1.0, 2.0]
+    for mapping in (interval([0,-4,-4,-8], [7,3,4,0], 12), unpacked(12), objective_variables(2)):
+        copied = pickle.loads(pickle.dumps(mapping))
+        assert copied.vectorized and copied.__name__ == mapping.__name__
+        assert (copied(bits.pack(population)) == mapping(bits.pack(population))).all()
+
 def run_tests():
     """
     Run tests for mapping
@@ -74,6 +184,7 @@ def run_tests():
     print("================")
     test_binary_to_decimal()
     test_binary_to_interval()
+    test_vectorized()
     print("================")
     print("Tests were succesfull")
 
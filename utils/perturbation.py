@@ -1,95 +1,381 @@
 """
 Perturbation operators
 """
-import random
 import copy
+import inspect
+import math
+
 import numpy as np
 
+from utils import bits
+from utils import randomness
 from utils.population import Individual
 
 class Mutator:
-    def __init__(self, perturbation, probabilty : float) -> None:
+    """
+    Mutator of single genomes, keyword parameters (deviation, bounds, ...)
+    are passed to the perturbation with the probability. Perturbations
+    with a batch form (gaussian, cauchy, bitflip_multiple) mutate numeric
+    populations in one call with one draw of random numbers.
+    """
+    def __init__(self, perturbation, probabilty : float, rng : np.random.Generator = None,
+                 **parameters) -> None:
         self.perturbation_function = perturbation
         self.probability = probabilty
+        self.parameters = parameters
+        self.rng = rng
         self.before_mutation = None
         self.after_mutation = None
+        self.changed = np.empty(0, dtype=bool)
+        self.reports_moves = "moves" in inspect.signature(perturbation).parameters
     
     def mutate_single(self, genome):
         self.before_mutation = genome
-        self.after_mutation = self.perturbation_function(data = genome, probability = self.probability)
+        self.after_mutation = self.perturbation_function(data = genome, probability = self.probability,
+            rng = self.rng, **self.parameters)
         return self.after_mutation
+
+    def mutate_individual(self, individual : Individual) -> Individual:
+        """
+        Mutates an evaluated individual. If the perturbation reports its moves,
+        the child inherits parent's fitness and state together with the moves,
+        otherwise it is returned unevaluated.
+        """
+        if not self.reports_moves:
+            return Individual(self.mutate_single(individual.value))
+
+        moves = []
+        self.before_mutation = individual.value
+        self.after_mutation = self.perturbation_function(data = individual.value,
+            probability = self.probability, moves = moves, rng = self.rng, **self.parameters)
+        return Individual(self.after_mutation, individual.fitness, moves, individual.state)
     
     def mutate_population(self, population):
+        """
+        Mutates every genome, changed flags which genomes differ from
+        their originals, by the reported moves when the perturbation
+        reports them and by comparison otherwise. Matrices of numbers are
+        mutated by the batch form of the perturbation when it has one.
+        """
         self.before_mutation = population
+        batch = getattr(self.perturbation_function, "batch", None)
+        if batch is not None and len(population):
+            matrix = np.asarray(population)
+            if matrix.ndim == 2 and matrix.dtype != object:
+                self.after_mutation = batch(matrix, probability = self.probability, rng = self.rng, **self.parameters)
+                self.changed = (matrix != self.after_mutation).any(axis=1)
+                return self.after_mutation
         self.after_mutation = []
-        for individual in population:
-            self.after_mutation.append(self.perturbation_function(data = individual, probability = self.probability))
+        self.changed = np.zeros(len(population), dtype=bool)
+        for position, individual in enumerate(population):
+            if self.reports_moves:
+                moves = []
+                mutated = self.perturbation_function(data = individual, probability = self.probability,
+                    moves = moves, rng = self.rng, **self.parameters)
+                self.changed[position] = len(moves) > 0
+            else:
+                mutated = self.perturbation_function(data = individual, probability = self.probability,
+                    rng = self.rng, **self.parameters)
+                self.changed[position] = not np.array_equal(mutated, individual)
+            self.after_mutation.append(mutated)
         return self.after_mutation
     
     def __repr__(self) -> str:
-        return "{}, mutation rate: {}".format(self.perturbation_function.__name__, self.probability)
+        return "{}, mutation rate: {}".format(self.perturbation_function.__name__, self.probability) + "".join(
+            ", {}: {}".format(key, value) for key, value in self.parameters.items())
     
-def tsp_swap(data : list, probability : float = 0.0, **kwargs):
-    mutated = data[:]
-    for swapped in range(len(mutated)):
-        if random.random() < probability:
-            swap_with = random.randint(0, len(mutated) -1)
-            
-            city1 = mutated[swapped]
-            city2 = mutated[swap_with]
-            
-            mutated[swapped] = city2
-            mutated[swap_with] = city1
+def apply_move(data, move : tuple):
+    """
+    Applies a reported move to the genome in place.
+    Every move is its own inverse.
+    """
+    kind = move[0]
+    if kind == "swap":
+        _, first, second = move
+        data[first], data[second] = data[second], data[first]
+    elif kind == "reverse":
+        _, start, end = move
+        data[start:end + 1] = data[start:end + 1][::-1]
+    elif kind == "flip":
+        data[move[1]] = 1 - data[move[1]]
+    return data
+
+def tsp_swap(data : list, probability : float = 0.0, moves : list = None,
+             rng : np.random.Generator = None, **kwargs):
+    """
+    Swaps each city with probability with a random city.
+    Swaps are appended to moves as ("swap", i, j)
+    """
+    rng = randomness.resolve(rng)
+    mutated = copy.copy(data)
+    swapped_positions = np.flatnonzero(rng.random(len(mutated)) < probability).tolist()
+    targets = rng.integers(0, len(mutated), len(swapped_positions)).tolist()
+    for swapped, swap_with in zip(swapped_positions, targets):
+        if swap_with == swapped:
+            continue
+        
+        city1 = mutated[swapped]
+        city2 = mutated[swap_with]
+        
+        mutated[swapped] = city2
+        mutated[swap_with] = city1
+        if moves is not None:
+            moves.append(("swap", swapped, swap_with))
+    return mutated
+
+def tsp_reverse(data : list, moves : list = None, rng : np.random.Generator = None, **kwargs):
+    """
+    2-opt move, reverses a random segment of the route.
+    The reversal is appended to moves as ("reverse", start, end)
+    """
+    rng = randomness.resolve(rng)
+    start = int(rng.integers(0, len(data) - 1))
+    end = int(rng.integers(start + 1, len(data)))
+    mutated = apply_move(copy.copy(data), ("reverse", start, end))
+    if moves is not None:
+        moves.append(("reverse", start, end))
     return mutated
     
-def bitflip_multiple(data : "list[int]" = [], probability : float = 0.0, **kwargs):
+def bitflip_multiple(data : "list[int]" = [], probability : float = 0.0, moves : list = None,
+                     rng : np.random.Generator = None, **kwargs):
     """
     Decides independently for each bit, whether it will be inverted or not.
     returns flipped copy
     """
-    perturbed = []
-    for i in data:
-        if random.random() < probability:
-            if i==1:
-                perturbed.append(0)
-            else:
-                perturbed.append(1)
-        else:
-            perturbed.append(copy.deepcopy(i))
-    return perturbed
+    flips = randomness.resolve(rng).random(len(data)) < probability
+    if moves is not None:
+        moves.extend(("flip", int(pos)) for pos in np.flatnonzero(flips))
+    array = np.asarray(data)
+    return np.where(flips, 1 - array, array).tolist()
 
-def gaussian(data : "list[float]", deviation = 1, **kwargs):
+def bitflip_batch(data, probability : float = 0.0, rng : np.random.Generator = None, **kwargs) -> np.ndarray:
+    """
+    Inverts each bit of every row of the population matrix independently with the probability
+    """
+    matrix = np.asarray(data)
+    flips = randomness.resolve(rng).random(matrix.shape) < probability
+    return np.where(flips, 1 - matrix, matrix)
+
+def gaussian(data : "list[float]", deviation = 1, rng : np.random.Generator = None,
+             lower_bound = None, upper_bound = None, bounds : str = "clip", **kwargs):
     """
     Mutates a vector of real numbers by adding vector of normal values
     returns perturbed copy
     """
-    perturbed =[]
-    for pos, value in enumerate(data):
-        normal = random.normalvariate(0.0, deviation)
-        perturbed.append(value + normal)
-    return perturbed
+    return gaussian_batch(np.asarray(data)[np.newaxis], deviation, lower_bound, upper_bound, bounds,
+                          rng = rng)[0].tolist()
 
-def cauchy(data : "list[float]", **kwargs):
+def cauchy(data : "list[float]", deviation = 1.0, rng : np.random.Generator = None,
+           lower_bound = None, upper_bound = None, bounds : str = "clip", **kwargs):
     """
     Mutates a vector of real numbers by adding vector of values
     from Cauchy distribution, returns perturbed copy
     """
-    perturbed = []
-    cauch = np.random.default_rng().standard_cauchy(len(data))
-    for pos, value in enumerate(data):
-        perturbed.append(value + cauch[pos])
-    return perturbed
+    return cauchy_batch(np.asarray(data)[np.newaxis], deviation, lower_bound, upper_bound, bounds,
+                        rng = rng)[0].tolist()
 
-def bitflip_single(data : "list[int]", **kwargs):
+def apply_bounds(matrix : np.ndarray, lower_bound = None, upper_bound = None, bounds : str = "clip"):
+    """
+    Returns matrix with values outside of the bounds clipped to them
+    or reflected back into the interval ("reflect"), coordinates with
+    equal bounds are clipped
+    """
+    if lower_bound is None or upper_bound is None or bounds is None:
+        return matrix
+    if bounds == "clip":
+        return np.clip(matrix, lower_bound, upper_bound)
+    if bounds == "reflect":
+        width = np.asarray(upper_bound, dtype=np.float64) - lower_bound
+        period = np.where(width > 0, 2 * width, 1.0)
+        folded = np.mod(matrix - lower_bound, period)
+        reflected = lower_bound + np.where(folded > width, period - folded, folded)
+        return np.where(width > 0, reflected, np.clip(matrix, lower_bound, upper_bound))
+    raise ValueError("Unknown bound handling: " + str(bounds))
+
+def gaussian_batch(data, deviation = 1.0, lower_bound = None, upper_bound = None, bounds : str = "clip",
+                   rng : np.random.Generator = None, **kwargs) -> np.ndarray:
+    """
+    Adds normal values to every row of the population matrix,
+    deviation can be scalar, per individual column (n, 1) or per coordinate
+    """
+    matrix = np.asarray(data, dtype=np.float64)
+    normal = randomness.resolve(rng).standard_normal(matrix.shape)
+    return apply_bounds(matrix + deviation * normal, lower_bound, upper_bound, bounds)
+
+def cauchy_batch(data, deviation = 1.0, lower_bound = None, upper_bound = None, bounds : str = "clip",
+                 rng : np.random.Generator = None, **kwargs) -> np.ndarray:
+    """
+    Adds values from Cauchy distribution to every row of the population matrix
+    """
+    matrix = np.asarray(data, dtype=np.float64)
+    cauch = randomness.resolve(rng).standard_cauchy(matrix.shape)
+    return apply_bounds(matrix + deviation * cauch, lower_bound, upper_bound, bounds)
+
+gaussian.batch = gaussian_batch
+cauchy.batch = cauchy_batch
+bitflip_multiple.batch = bitflip_batch
+
+def polynomial_batch(data, lower_bound, upper_bound, probability : float = None, eta : float = 20.0,
+                     rng : np.random.Generator = None, **kwargs) -> np.ndarray:
+    """
+    Polynomial mutation (Deb), each coordinate is mutated with the probability
+    (1 / length by default), eta is the distribution index, results stay in bounds
+    """
+    rng = randomness.resolve(rng)
+    matrix = np.asarray(data, dtype=np.float64)
+    if not probability:
+        probability = 1.0 / matrix.shape[-1]
+    width = np.asarray(upper_bound, dtype=np.float64) - lower_bound
+    mutated = rng.random(matrix.shape) < probability
+    draws = rng.random(matrix.shape)
+    power = 1.0 / (eta + 1.0)
+    lower = (matrix - lower_bound) / width
+    upper = (upper_bound - matrix) / width
+    left = draws < 0.5
+    with np.errstate(invalid="ignore"):
+        delta = np.where(left,
+            (2 * draws + (1 - 2 * draws) * (1 - lower) ** (eta + 1)) ** power - 1,
+            1 - (2 * (1 - draws) + 2 * (draws - 0.5) * (1 - upper) ** (eta + 1)) ** power)
+    return np.clip(np.where(mutated, matrix + delta * width, matrix), lower_bound, upper_bound)
+
+def self_adaptive_batch(data, dimension : int, lower_bound = None, upper_bound = None, bounds : str = "clip",
+                        minimum_deviation : float = 1e-10, distribution : str = "gaussian",
+                        rng : np.random.Generator = None, **kwargs) -> np.ndarray:
+    """
+    Self-adaptive mutation of genomes [x_1..x_dimension, sigma_1..sigma_k],
+    one sigma per individual (k = 1) or per coordinate (k = dimension).
+    Sigmas are mutated log-normally first, then used as deviations of x.
+    """
+    rng = randomness.resolve(rng)
+    matrix = np.asarray(data, dtype=np.float64)
+    values, deviations = matrix[:, :dimension], matrix[:, dimension:]
+    if deviations.shape[1] == 1:
+        deviations = deviations * np.exp(rng.standard_normal(deviations.shape) / math.sqrt(dimension))
+    else:
+        common = rng.standard_normal((len(matrix), 1)) / math.sqrt(2 * dimension)
+        own = rng.standard_normal(deviations.shape) / math.sqrt(2 * math.sqrt(dimension))
+        deviations = deviations * np.exp(common + own)
+    deviations = np.maximum(deviations, minimum_deviation)
+    if distribution == "cauchy":
+        steps = rng.standard_cauchy(values.shape)
+    else:
+        steps = rng.standard_normal(values.shape)
+    values = apply_bounds(values + deviations * steps, lower_bound, upper_bound, bounds)
+    return np.concatenate((values, deviations), axis=1)
+
+class BatchMutator:
+    """
+    Mutator for perturbations of the whole population matrix in one call,
+    keyword parameters (deviation, bounds, ...) are passed to the perturbation
+    """
+    def __init__(self, perturbation, rng : np.random.Generator = None, **parameters) -> "BatchMutator":
+        self.perturbation_function = perturbation
+        self.parameters = parameters
+        self.rng = rng
+        self.before_mutation = None
+        self.after_mutation = None
+        self.changed = np.empty(0, dtype=bool)
+
+    def mutate_single(self, genome):
+        self.before_mutation = genome
+        self.after_mutation = self.perturbation_function(np.asarray(genome)[np.newaxis],
+            rng = self.rng, **self.parameters)[0]
+        return self.after_mutation
+
+    def mutate_individual(self, individual : Individual) -> Individual:
+        return Individual(self.mutate_single(individual.value))
+
+    def mutate_population(self, population):
+        """
+        Mutates the population matrix, changed flags rows that differ from the originals
+        """
+        self.before_mutation = population
+        self.after_mutation = self.perturbation_function(population, rng = self.rng, **self.parameters)
+        before, after = np.asarray(population), np.asarray(self.after_mutation)
+        self.changed = (before != after).reshape(len(after), -1).any(axis=1) if len(after) else np.zeros(0, dtype=bool)
+        return self.after_mutation
+
+    def __repr__(self) -> str:
+        return "{}, {}".format(self.perturbation_function.__name__,
+            ", ".join("{}: {}".format(key, value) for key, value in self.parameters.items()))
+
+def bitflip_packed_batch(data, length : int, probability : float = 0.0,
+                         rng : np.random.Generator = None, **kwargs) -> np.ndarray:
+    """
+    Flips each bit of genomes packed by utils.bits independently with the probability,
+    by XOR of the packed words with a random mask. Works on single genomes and matrices
+    """
+    packed = np.asarray(data, dtype=np.uint8)
+    return packed ^ bits.flip_mask(length, probability, packed.shape[:-1], rng)
+
+def bitflip_single(data : "list[int]", moves : list = None, rng : np.random.Generator = None, **kwargs):
     """
     For each bit decide randomly whether it should be mutated or not
     """
-    perturbed = []
-    rnd_num = random.randrange(0,len(data))
-    perturbed = copy.deepcopy(data)
+    rnd_num = int(randomness.resolve(rng).integers(0, len(data)))
+    perturbed = list(data)
     perturbed[rnd_num] = 1 if perturbed[rnd_num] == 0 else 0
+    if moves is not None:
+        moves.append(("flip", rnd_num))
     return perturbed
 
+def test_real_mutation():
+    """
+    Test shapes, bounds and sigma adaptation of real valued mutations
+    and packed bit flips
+    """
+    print("Testing real valued mutation")
+    rng = np.random.default_rng(1)
+    population = rng.uniform(-1, 1, (50, 4))
+    for mutation in (gaussian_batch, cauchy_batch):
+        for bounds in ("clip", "reflect"):
+            mutated = mutation(population, 2.0, -1, 1, bounds, rng = rng)
+            assert mutated.shape == (50, 4) and mutated.min() >= -1 and mutated.max() <= 1
+    assert (apply_bounds(np.array([1.5, -1.25, 3.5]), -1, 1, "reflect") == [0.5, -0.75, -0.5]).all()
+    assert (apply_bounds(np.array([[1.5, 3.0], [-2.0, 2.0]]), [-1, 2], [1, 2], "reflect") == [[0.5, 2], [0, 2]]).all()
+    mutated = polynomial_batch(population, -1, 1, probability = 1.0, rng = rng)
+    assert mutated.min() >= -1 and mutated.max() <= 1 and (mutated != population).all()
+    assert (polynomial_batch(population, -1, 1, probability = 1e-12, rng = rng) == population).all()
+
+    for sigmas in (1, 4):
+        genomes = np.concatenate((population, np.full((50, sigmas), 0.1)), axis=1)
+        mutated = self_adaptive_batch(genomes, 4, rng = rng)
+        assert mutated.shape == genomes.shape and (mutated[:, 4:] != 0.1).all()
+        assert abs(np.log(mutated[:, 4:] / 0.1)).mean() < 1.0
+        assert abs(mutated[:, :4] - population).mean() < 0.3
+
+    packed = bits.random_genome(13, (50,), rng)
+    assert (bitflip_packed_batch(packed, 13, 0.0, rng = rng) == packed).all()
+    flipped = bitflip_packed_batch(packed, 13, 1.0, rng = rng)
+    assert (bits.unpack(flipped, 13) == 1 - bits.unpack(packed, 13)).all()
+    assert (flipped[:, -1] & ~np.uint8(bits.tail_mask(13)) == 0).all()
+
+    mutator = BatchMutator(gaussian_batch, rng = rng, deviation = 0.0)
+    assert (mutator.mutate_population(population) == population).all()
+    assert len(gaussian([0.0] * 3, rng = rng)) == 3
+    assert Mutator(gaussian, 0.0, rng = rng, deviation = 0.0).mutate_single([0.5, 1.0]) == [0.5, 1.0]
+    assert bitflip_multiple([0.0, 1.0, 1.0], 1.0, rng = rng) == [1.0, 0.0, 0.0]
+    assert bitflip_multiple([0, 1, 1], 0.0, rng = rng) == [0, 1, 1]
+
+    for perturbation, probability, genomes in ((gaussian, 0.0, population), (bitflip_multiple, 0.3, packed > 127)):
+        runs = [Mutator(perturbation, probability, np.random.default_rng(4), deviation = 0.5).mutate_population(genomes)
+                for _ in range(2)]
+        assert np.array_equal(runs[0], runs[1]) and runs[0].shape == genomes.shape
+    mutator = Mutator(gaussian, 0.0, np.random.default_rng(4), deviation = 0.5)
+    assert np.array_equal(mutator.mutate_population(population), gaussian_batch(population, 0.5, rng = np.random.default_rng(4)))
+    assert mutator.changed.all() and len(mutator.changed) == 50
+    mutator = Mutator(bitflip_multiple, 0.0, np.random.default_rng(4))
+    assert not mutator.mutate_population(np.zeros((5, 8), dtype=int)).any() and not mutator.changed.any()
+
+def run_tests():
+    """
+    Run tests for perturbations
+    """
+    print("Running tests...")
+    print("================")
+    test_real_mutation()
+    print("================")
+    print("Tests were succesfull")
 
 if __name__ == "__main__":
-    print(cauchy([1,0,1,1,1,1,1]))
+    run_tests()
@@ -2,21 +2,203 @@
 Evolution population implementations
 """
 import math
+from collections import OrderedDict
+
+import numpy as np
 
 class Individual:
-    def __init__(self, value, fitness) -> "Individual":
+    """
+    Genome with its fitness.
+
+    A mutated child can carry its parent's fitness and state together
+    with the list of moves that produced it, so the fitness function
+    can update the value incrementally instead of evaluating from scratch.
+    """
+    def __init__(self, value, fitness = None, moves = None, state = None) -> "Individual":
         self.value = value
         self.fitness = fitness
+        self.moves = moves
+        self.state = state
 
     def __repr__(self) -> str:
+        if self.fitness is None:
+            return "Individual: "+ str(self.value) + " - unevaluated"
         return "Individual: "+ str(self.value) + " - " + "{:.2f}".format(self.fitness)
 
+class Population:
+    """
+    Population stored as one contiguous genome matrix and a fitness vector.
+
+    The next generation is written into a second pair of buffers which
+    are then swapped in, so a run allocates its matrices only once.
+    Indexing returns lightweight Individual views into the genome matrix,
+    their values are overwritten two generations later unless detached.
+    """
+    def __init__(self, genomes, fitness = None) -> "Population":
+        self.genomes = np.array(genomes)
+        if fitness is None:
+            self.fitness = np.full(len(self.genomes), np.nan)
+        else:
+            self.fitness = np.array(fitness, dtype=np.float64)
+        self.next_genomes = np.empty_like(self.genomes)
+        self.next_fitness = np.empty_like(self.fitness)
+
+    def __len__(self) -> int:
+        return len(self.genomes)
+
+    def __getitem__(self, index) -> Individual:
+        return Individual(self.genomes[index], self.fitness[index].item())
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __repr__(self) -> str:
+        return "Population: {} x {}, best: {}".format(len(self), self.genomes.shape[1:], np.nanmin(self.fitness))
+
+    def detach(self, index : int) -> Individual:
+        """
+        Returns individual with its own copy of the genome
+        """
+        return Individual(self.genomes[index].copy(), self.fitness[index].item())
+
+    def evaluate(self, fitness_function):
+        """
+        Evaluates all genomes with batch evaluation of fitness function or evaluator
+        """
+        self.fitness[:] = fitness_function.evaluate_batch(self.genomes)
+        return self.fitness
+
+    def ranking(self):
+        """
+        Returns indices of individuals from best to worst
+        """
+        return np.argsort(self.fitness, kind="stable")
+
+    def elite(self, count : int) -> np.ndarray:
+        """
+        Returns indices of the count best individuals from best to worst,
+        only the top count are sorted (argpartition)
+        """
+        if count <= 0:
+            return np.empty(0, dtype=np.intp)
+        if count >= len(self):
+            return self.ranking()
+        top = np.argpartition(self.fitness, count - 1)[:count]
+        return top[np.argsort(self.fitness[top], kind="stable")]
+
+    def best_index(self) -> int:
+        """
+        Returns index of the best individual
+        """
+        return int(np.argmin(self.fitness))
+
+    def select(self, indices):
+        """
+        Returns genome matrix of the individuals at given indices
+        """
+        return self.genomes[indices]
+
+    def write(self, genomes, fitness = None):
+        """
+        Writes genomes (and fitness) of the next generation into the back buffer
+        """
+        self.next_genomes[:] = genomes
+        if fitness is not None:
+            self.next_fitness[:] = fitness
+        return self.next_genomes
+
+    def swap(self):
+        """
+        Makes the back buffer the current generation
+        """
+        self.genomes, self.next_genomes = self.next_genomes, self.genomes
+        self.fitness, self.next_fitness = self.next_fitness, self.fitness
+
+def euclidean(start, finish):
+    """
+    Vectorized euclidean distance between coordinate arrays
+
+    Args:
+        start (np.ndarray): coordinates of shape (..., 2)
+        finish (np.ndarray): coordinates of shape (..., 2)
+
+    Returns:
+        np.ndarray: distances of the broadcast shape
+    """
+    difference = start - finish
+    return np.sqrt(np.einsum("...i,...i->...", difference, difference))
+
 class EdgeMatrix:
     """
     Wrapper class for edge weight matrix for tsp problems
+
+    Either holds a full precomputed matrix ("full" mode) or computes
+    rows from city coordinates on demand and caches the most recently
+    used ones ("lazy" mode) for instances too big for a dense matrix.
     """
-    def __init__(self, matrix) -> "EdgeMatrix":
-        self.matrix = matrix
+    def __init__(self, matrix = None, coordinates = None, metric = euclidean,
+                 mode : str = "full", dtype = np.float32, cache_rows : int = 1024) -> "EdgeMatrix":
+        assert matrix is not None or coordinates is not None
+        assert mode in ("full", "lazy")
+
+        self.coordinates = None if coordinates is None else np.asarray(coordinates, dtype=np.float64)
+        self.metric = metric
+        self.dtype = dtype
+        self.cache_rows = cache_rows
+        self.rows = OrderedDict()
+
+        if matrix is not None:
+            self.mode = "full"
+            # memory mapped matrices (tsplib sidecars) are used read-only in their stored dtype
+            self.matrix = matrix if isinstance(matrix, np.memmap) else np.asarray(matrix, dtype=dtype)
+        elif mode == "full":
+            self.mode = "full"
+            self.matrix = self.compute_matrix()
+        else:
+            self.mode = "lazy"
+            self.matrix = None
+
+    def __len__(self) -> int:
+        if self.matrix is not None:
+            return len(self.matrix)
+        return len(self.coordinates)
+
+    def compute_matrix(self, block : int = 256):
+        """
+        Computes the full distance matrix from coordinates,
+        a block of rows at a time to bound temporary memory
+        """
+        size = len(self.coordinates)
+        matrix = np.empty((size, size), dtype=self.dtype)
+        for start in range(0, size, block):
+            stop = min(start + block, size)
+            matrix[start:stop] = self.metric(self.coordinates[start:stop, None, :],
+                                             self.coordinates[None, :, :])
+        return matrix
+
+    def row(self, start):
+        """
+        Returns distances from the given city to all cities
+
+        Args:
+            start (city_index): index of starting city
+
+        Returns:
+            np.ndarray: row of the edge matrix
+        """
+        if self.matrix is not None:
+            return self.matrix[start]
+
+        row = self.rows.get(start)
+        if row is None:
+            row = self.metric(self.coordinates[start], self.coordinates).astype(self.dtype)
+            self.rows[start] = row
+            if len(self.rows) > self.cache_rows:
+                self.rows.popitem(last=False)
+        else:
+            self.rows.move_to_end(start)
+        return row
 
     def distance(self, start, finish):
         """
@@ -29,7 +211,33 @@ class EdgeMatrix:
         Returns:
             float: distance of the two cities
         """
-        return self.matrix[start][finish]
+        if self.matrix is not None:
+            return self.matrix[start][finish]
+        if start in self.rows:
+            return self.row(start)[finish]
+        return self.dtype(self.metric(self.coordinates[start], self.coordinates[finish]))
+
+    def route_length(self, route):
+        """
+        Returns length of a closed route given as an array of city indices
+        """
+        route = np.asarray(route)
+        following = np.roll(route, -1)
+        if self.matrix is not None:
+            return float(self.matrix[route, following].sum(dtype=np.float64))
+        edges = self.metric(self.coordinates[route], self.coordinates[following])
+        return float(edges.astype(self.dtype).sum(dtype=np.float64))
+
+    def route_lengths(self, routes):
+        """
+        Returns lengths of closed routes given as a matrix, one route per row
+        """
+        routes = np.asarray(routes)
+        following = np.roll(routes, -1, axis=1)
+        if self.matrix is not None:
+            return self.matrix[routes, following].sum(axis=1, dtype=np.float64)
+        edges = self.metric(self.coordinates[routes], self.coordinates[following])
+        return edges.astype(self.dtype).sum(axis=1, dtype=np.float64)
 
 
 class City:
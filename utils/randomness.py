@@ -0,0 +1,37 @@
+"""
+Random number generation shared by search operators.
+
+Operators take an optional rng (numpy.random.Generator), SearchEngine
+creates one from a seed and hands it to all of its operators, so a
+seeded run is reproducible. Operators called without rng fall back
+to the module default generator.
+"""
+import numpy as np
+
+default = np.random.default_rng()
+
+def generator(seed = None) -> np.random.Generator:
+    """
+    Returns generator for a seed (int, SeedSequence or None),
+    generators are returned unchanged
+    """
+    return np.random.default_rng(seed)
+
+def resolve(rng : np.random.Generator = None) -> np.random.Generator:
+    """
+    Returns rng or the module default generator
+    """
+    return default if rng is None else rng
+
+def seed_default(seed = None):
+    """
+    Reseeds the default generator used by operators called without rng
+    """
+    global default
+    default = np.random.default_rng(seed)
+
+def spawn(rng : np.random.Generator, count : int) -> "list[np.random.Generator]":
+    """
+    Returns independent child generators, e.g. for parallel workers
+    """
+    return resolve(rng).spawn(count)
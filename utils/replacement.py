@@ -1,24 +1,52 @@
 """
 Replacement strategy for EA population control
 """
+import inspect
 from multiprocessing import parent_process
-import random
+import numpy as np
+from utils import crossover
+from utils import randomness
 from utils.population import Individual
 
 class Replacer:
     """
     Wrapper class for replacement strategy.
+    Crossover operator can be given by its name in crossover.operators
+
+    Strategies reporting origins of the children let the replacer find
+    children that are copies of a parent, sources holds for every child
+    the position of that parent among the parents or -1 for new genomes,
+    so their fitness can be inherited instead of evaluated.
     """
-    def __init__(self, strategy, crossover_operator = None, elite_count = 0, **kwargs) -> "Replacer":
+    def __init__(self, strategy, crossover_operator = None, elite_count = 0,
+                 rng : np.random.Generator = None, **kwargs) -> "Replacer":
         self.strategy = strategy
+        self.rng = rng
+        if isinstance(crossover_operator, str):
+            crossover_operator = crossover.get(crossover_operator)
         self.crossover_operator = crossover_operator
         self.elite_count = elite_count
         self.new_population = []
+        self.sources = np.empty(0, dtype=np.intp)
+        self.reports_origins = "origins" in inspect.signature(strategy).parameters
     
-    def replace(self, parents : "list[Individual]"):
+    def replace(self, parents : "list[Individual]", elites = None):
+        """
+        Breeds the next generation from the selected parents, elites are
+        genomes of the best individuals of the population ranked by the caller
+        """
         self.parents = parents
-        self.new_population = self.strategy(self.parents, self.elite_count, self.crossover_operator)
-        return self.new_population 
+        origins = [] if self.reports_origins else None
+        arguments = {"origins": origins} if self.reports_origins else {}
+        self.new_population = self.strategy(self.parents, self.elite_count, self.crossover_operator,
+                                            rng = self.rng, elites = elites, **arguments)
+        self.sources = np.full(len(self.new_population), -1, dtype=np.intp)
+        for position, candidates in origins or ():
+            for parent in candidates:
+                if np.array_equal(self.new_population[position], self.parents[parent]):
+                    self.sources[position] = parent
+                    break
+        return self.new_population
 
     def __repr__(self) -> str:
         return "{}, crossover: {}, elite count: {}".format(self.strategy.__name__, self.crossover_operator, self.elite_count)
@@ -32,33 +60,67 @@ def general_replacement(parents : "list[Individual]", crossover, **kwargs):
     """
     pass
 
-def elite(parents : list, elite_count : int, crossover_operator, **kwargs):
+def elite(parents : list, elite_count : int, crossover_operator, rng : np.random.Generator = None,
+          elites = None, origins : list = None, **kwargs):
     """
     Elite replacement strategy. Preserves the best individuals from
-    previous generation.
+    previous generation, the rest are children of the parents.
 
     Args:
-        parents (_type_): _description_
-        elite_count (_type_): _description_
-        crossover (_type_): _description_
+        parents (list): genomes of the selected parents
+        elite_count (int): number of preserved individuals
+        crossover_operator (Crossover): breeds a child of two parents
+        elites (list): genomes of the best individuals from best, ranked
+            by the caller (Population.elite), no elitism when not given
+        origins (list): (child position, parent positions) of the children
+            are appended to it when given
 
     Returns:
-        _type_: _description_
+        list: elites followed by children, len(parents) genomes
     """
-    children = []
-    length = len(parents) - elite_count
-    pool = random.sample(parents, len(parents))
+    rng = randomness.resolve(rng)
+    children = [] if elites is None else list(elites[:elite_count])
+    length = len(parents) - len(children)
+
+    order = rng.permutation(len(parents))
+    pool = [parents[i] for i in order]
 
-    for i in range(0, min(len(parents), elite_count)):
-        children.append(parents[i])
-    
     for i in range(0, length):
-        child = crossover_operator(pool[i], pool[len(parents)-i-1])
+        child = crossover_operator(pool[i], pool[len(parents)-i-1], rng = rng)
+        if isinstance(child, tuple):
+            child = child[0]
+        if origins is not None:
+            origins.append((len(children), (order[i], order[len(parents)-i-1])))
         children.append(child)
     return children
     
+def replace_worst(fitness : np.ndarray, child_fitness : float, rng : np.random.Generator = None,
+                  **kwargs) -> int:
+    """
+    Steady-state insertion, the child replaces the worst individual
+    unless it is worse than it
+
+    Returns:
+        int: index of the replaced individual, -1 if the child is discarded
+    """
+    worst = int(np.argmax(fitness))
+    return worst if child_fitness <= fitness[worst] else -1
+
+def replace_tournament(fitness : np.ndarray, child_fitness : float, tourn_size : int = 2,
+                       rng : np.random.Generator = None, **kwargs) -> int:
+    """
+    Steady-state insertion by inverse tournament, the child replaces
+    the worst of tourn_size random individuals unless it is worse than it
 
-def random_replacement(old_pop : "list[Individual]", new_pop : "list[Individual]", **kwargs):
+    Returns:
+        int: index of the replaced individual, -1 if the child is discarded
+    """
+    contestants = randomness.resolve(rng).integers(0, len(fitness), max(1, tourn_size))
+    worst = int(contestants[np.argmax(fitness[contestants])])
+    return worst if child_fitness <= fitness[worst] else -1
+
+def random_replacement(old_pop : "list[Individual]", new_pop : "list[Individual]",
+                       rng : np.random.Generator = None, **kwargs):
     #TODO
     """ 
     Args:
@@ -68,7 +130,86 @@ def random_replacement(old_pop : "list[Individual]", new_pop : "list[Individual]
     Returns:
         _type_: _description_
     """
-    return [random.choice(old_pop[0].extend(new_pop[0])) for i in range(len(old_pop[0]))]
+    rng = randomness.resolve(rng)
+    return [rng.choice(old_pop[0].extend(new_pop[0])) for i in range(len(old_pop[0]))]
     
+def test_elitism():
+    """
+    Test that ranked elites survive with their fitness and are not evaluated again
+    """
+    from search.search import SearchEngine
+    from utils import fitness, initialization, perturbation, selection
+    from utils.condition import LoopCondition
+    from utils.population import Population
+
+    print("Testing elitism")
+    rng = np.random.default_rng(0)
+    population = Population(rng.random((30, 2)), rng.random(30))
+    for count in (0, 1, 5, 30):
+        assert (population.elite(count) == population.ranking()[:count]).all()
+
+    function = fitness.FitnessFunction(fitness.rastrigin)
+    engine = SearchEngine(function, perturbation.Mutator(perturbation.gaussian, 0.0, deviation = 1.0), LoopCondition(40),
+        Replacer(elite, "uniform", 3), selection.Selector(selection.tournament, 20, tourn_size = 2),
+        rng = 1, hooks = [])
+    population = engine.start_ea(initialization.populate_array(20,
+        lambda rng: initialization.real_vector(4, -5, 5, rng), rng = rng))
+    assert engine.best.fitness == population.fitness.min()
+    for _ in range(40):
+        elites = population.elite(3)
+        genomes, values = population.genomes[elites].copy(), population.fitness[elites].copy()
+        calls = function.calls_made
+        population = engine.evolve(population, 1)
+        assert function.calls_made - calls == 17
+        assert (population.genomes[:3] == genomes).all() and (population.fitness[:3] == values).all()
+        assert engine.best.fitness == population.fitness.min()
+
+    engine.condition.clear()
+    population.genomes[5], population.fitness[5] = np.zeros(4), 0.0
+    population = engine.evolve(population, 1)
+    assert engine.best.fitness == population.fitness[0] == 0.0 and (engine.best.value == 0).all()
+
+def test_inheritance():
+    """
+    Test that unchanged children inherit true fitness and are not evaluated
+    """
+    from search.search import SearchEngine
+    from utils import fitness, initialization, perturbation, selection
+    from utils.condition import LoopCondition
+
+    print("Testing inherited fitness")
+    rng = np.random.default_rng(2)
+    replacer = Replacer(elite, lambda first, second, rng: list(first), 0)
+    parents = rng.integers(0, 2, (6, 8))
+    assert (np.asarray(replacer.replace(parents)) == parents[replacer.sources]).all()
+
+    for mutation in (perturbation.Mutator(perturbation.bitflip_multiple, 0.02),
+                     perturbation.BatchMutator(perturbation.bitflip_packed_batch, length = 20, probability = 0.02)):
+        packed = isinstance(mutation, perturbation.BatchMutator)
+        function = fitness.FitnessFunction(fitness.one_max_packed if packed else fitness.one_max)
+        engine = SearchEngine(function, mutation, LoopCondition(40),
+            Replacer(elite, "uniform_packed" if packed else "uniform", 2),
+            selection.Selector(selection.tournament, 30, tourn_size = 3), rng = 3, hooks = [])
+        init = initialization.packed_chromosome if packed else initialization.chromosome
+        population = engine.start_ea(initialization.populate_array(30, lambda rng: init(20, rng), rng = rng))
+        for _ in range(40):
+            calls = function.calls_made
+            population = engine.evolve(population, 1)
+            assert engine.saved == 30 - (function.calls_made - calls) >= 2
+            assert (population.fitness == function.batch_function(population.genomes)).all()
+        assert engine.timer.totals()["saved"] > 2 * 40
+        assert engine.time_stamps == sorted(set(engine.time_stamps)) and engine.time_stamps[-1] <= 40
+
+def run_tests():
+    """
+    Run tests for replacement strategies
+    """
+    print("Running tests...")
+    print("================")
+    test_elitism()
+    test_inheritance()
+    print("================")
+    print("Tests were succesfull")
+
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+    run_tests()
\ No newline at end of file
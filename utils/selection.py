@@ -1,77 +1,213 @@
+"""
+Parent selection operators
 
-import random
+Selection kernels work on the fitness vector of the population
+(lower fitness is better) and return indices of the selected individuals,
+Selector turns the indices into genomes of the population.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+from utils import randomness
+from .population import Individual, Population
 
-from .population import Individual
 class Selector:
     """
     wrapper
     """
-    def __init__(self, function, selection_count = 0, tourn_size = 0 ) -> "Selector":
+    def __init__(self, function, selection_count = 0, tourn_size = 0,
+                 rng : np.random.Generator = None, **kwargs) -> "Selector":
         self.function = function
         self.selection_count = selection_count
         self.pool = []
         self.selected = []
+        self.indices = None
         self.tourn_size = tourn_size
+        self.parameters = kwargs
+        self.rng = rng
 
-    def __call__(self, population : "list[Individual]") -> "list[Individual]":
+    def __call__(self, population : "Population | list[Individual]", count : int = None):
         self.pool = population
-        self.selected = self.function(population, count = self.selection_count, tourn_size = self.tourn_size)
+        if isinstance(population, Population):
+            fitness = population.fitness
+        else:
+            fitness = np.array([individual.fitness for individual in population], dtype=np.float64)
+        count = count or self.selection_count or len(fitness)
+        self.indices = self.function(fitness, count = count, tourn_size = self.tourn_size,
+                                     rng = self.rng, **self.parameters)
+        if isinstance(population, Population):
+            self.selected = population.select(self.indices)
+        else:
+            self.selected = [population[i].value for i in self.indices]
         return self.selected
-    
+
     def __repr__(self) -> str:
         return "{}, selection size: {}, tournament size: {}".format(self.function.__name__, self.selection_count, self.tourn_size)
 
-def tournament():
-    pass
+def minimization_weights(fitness : np.ndarray) -> np.ndarray:
+    """
+    Non-negative selection weights for minimized fitness,
+    distance from the worst individual. Equal fitness gives equal weights.
+    """
+    weights = np.max(fitness) - fitness
+    if not weights.any():
+        return np.ones(len(fitness))
+    return weights
+
+def _sample(cumulative : np.ndarray, points : np.ndarray) -> np.ndarray:
+    """
+    Indices of the cumulative weights intervals containing the points
+    """
+    indices = np.searchsorted(cumulative, points, side="right")
+    return np.minimum(indices, len(cumulative) - 1)
+
+@lru_cache(maxsize=32)
+def _rank_cumulative(size : int, pressure : float) -> np.ndarray:
+    """
+    Cumulative linear ranking weights from best to worst, shared between generations
+    """
+    if size == 1:
+        cumulative = np.ones(1)
+    else:
+        ranks = np.arange(size - 1, -1, -1)
+        weights = (2.0 - pressure) / size + 2.0 * ranks * (pressure - 1.0) / (size * (size - 1))
+        cumulative = np.cumsum(weights)
+    cumulative.flags.writeable = False
+    return cumulative
 
-def randomSelect(population : "list[Individual]", count : int):
+def randomSelect(fitness : np.ndarray, count : int, rng : np.random.Generator = None, **kwargs) -> np.ndarray:
     """
     Random selection implementation
 
     Args:
-        population (_type_): _description_
-        next_gen_count (_type_): _description_
+        fitness (np.ndarray): fitness of the population
+        count (int): number of selected individuals
+
+    Returns:
+        np.ndarray: indices of the selected individuals
+    """
+    return randomness.resolve(rng).integers(0, len(fitness), count)
+
+def proportionate(fitness : np.ndarray, count : int, rng : np.random.Generator = None,
+                  **kwargs) -> np.ndarray:
+    """
+    Proportionate (roulette wheel) selection of individuals,
+    weights are given by minimization_weights
+
+    Args:
+        fitness (np.ndarray): fitness of the population
+        count (int): number of selected individuals
+
+    Returns:
+        np.ndarray: indices of the selected individuals
+    """
+    cumulative = np.cumsum(minimization_weights(fitness))
+    draws = randomness.resolve(rng).random(count) * cumulative[-1]
+    return _sample(cumulative, draws)
+
+def stochastic_universal(fitness : np.ndarray, count : int, rng : np.random.Generator = None,
+                         **kwargs) -> np.ndarray:
+    """
+    Stochastic universal sampling, proportionate selection with
+    evenly spaced pointers and a single random offset
+
+    Args:
+        fitness (np.ndarray): fitness of the population
+        count (int): number of selected individuals
+
+    Returns:
+        np.ndarray: indices of the selected individuals
+    """
+    cumulative = np.cumsum(minimization_weights(fitness))
+    step = cumulative[-1] / count
+    pointers = (randomness.resolve(rng).random() + np.arange(count)) * step
+    return _sample(cumulative, pointers)
+
+def rank(fitness : np.ndarray, count : int, rng : np.random.Generator = None,
+         pressure : float = 1.5, **kwargs) -> np.ndarray:
+    """
+    Linear ranking selection, best individual is selected with
+    probability pressure / n, worst with (2 - pressure) / n
+
+    Args:
+        fitness (np.ndarray): fitness of the population
+        count (int): number of selected individuals
+        pressure (float): selection pressure between 1 and 2
+
+    Returns:
+        np.ndarray: indices of the selected individuals
+    """
+    ranking = np.argsort(fitness, kind="stable")
+    cumulative = _rank_cumulative(len(fitness), float(pressure))
+    draws = randomness.resolve(rng).random(count) * cumulative[-1]
+    return ranking[_sample(cumulative, draws)]
+
+def truncation(fitness : np.ndarray, count : int, rng : np.random.Generator = None,
+               ratio : float = 0.5, **kwargs) -> np.ndarray:
+    """
+    Truncation selection, uniform selection from the best ratio of the population
+
+    Args:
+        fitness (np.ndarray): fitness of the population
+        count (int): number of selected individuals
+        ratio (float): selected part of the population
 
     Returns:
-        _type_: _description_
+        np.ndarray: indices of the selected individuals
     """
-    return [random.choice(population) for i in range(count)]
+    size = len(fitness)
+    kept = min(size, max(1, int(size * ratio)))
+    best = np.argpartition(fitness, kept - 1)[:kept] if kept < size else np.arange(size)
+    return best[randomness.resolve(rng).integers(0, kept, count)]
 
-def proportionate(evaluated_pop : "list[Individual]", count : int) -> list:
+def tournament(fitness : np.ndarray, count : int, tourn_size : int,
+               rng : np.random.Generator = None, **kwargs) -> np.ndarray:
     """
-    Proportionate selection of individuals
+    Tournament selection, all tournaments are drawn at once
 
     Args:
-        evaluated_pop (list[Individual]): _description_
-        count (int): _description_
+        fitness (np.ndarray): fitness of the population
+        count (int): number of selected individuals
+        tourn_size (int): number of aspirants in a tournament
 
     Returns:
-        _type_: _description_
-    """
-    chosen = []
-    sorted_pop = sorted(evaluated_pop, key=lambda individual: individual.fitness)
-    sum_fits = sum([i.fitness for i in evaluated_pop])
-    print("Pop: ")
-    for i in sorted_pop:
-        print(i)
-    for i in range(count):
-        rnd = random.random() * sum_fits
-        sum_ind = 0
-        for individual in sorted_pop:
-            sum_ind += individual.fitness
-            if sum_ind > rnd:
-                chosen.append(individual.value)
-                break
-    print("chosen: ")
-    for i in chosen:
-        print(i)
-    return chosen
-    
-def tournament(evaluated_pop : "list[Individual]", count : int, tourn_size : int) -> list:
-    chosen = []
-    for i in range(count):
-        aspirants = [random.choice(evaluated_pop) for i in range(tourn_size)]
-        chosen.append(min(aspirants, key= lambda x : x.fitness).value)
-    return chosen
+        np.ndarray: indices of the selected individuals
+    """
+    aspirants = randomness.resolve(rng).integers(0, len(fitness), (count, max(1, tourn_size)))
+    winners = np.argmin(fitness[aspirants], axis=1)
+    return aspirants[np.arange(count), winners]
+
+def test_selection():
+    """
+    Test selected indices and selection bias towards low fitness
+    """
+    print("Testing selection")
+    rng = np.random.default_rng(0)
+    fitness = np.arange(10, dtype=np.float64)
+    for function in (randomSelect, proportionate, stochastic_universal, rank, truncation, tournament):
+        indices = function(fitness, count = 2000, tourn_size = 3, rng = rng)
+        assert indices.shape == (2000,) and indices.min() >= 0 and indices.max() < 10
+        if function is not randomSelect:
+            assert fitness[indices].mean() < 4.5, function.__name__
+    assert set(truncation(fitness, 100, rng = rng, ratio = 0.3).tolist()) == {0, 1, 2}
+    assert (np.bincount(stochastic_universal(np.zeros(4), 8, rng = rng), minlength = 4) == 2).all()
+    assert (tournament(fitness, 5, tourn_size = 10 ** 3, rng = rng) == 0).all()
+
+    population = Population(np.arange(20).reshape(10, 2), fitness)
+    selector = Selector(tournament, 4, tourn_size = 2, rng = rng)
+    assert selector(population).shape == (4, 2)
+    assert (selector.selected == population.genomes[selector.indices]).all()
+
+def run_tests():
+    """
+    Run tests for selection
+    """
+    print("Running tests...")
+    print("================")
+    test_selection()
+    print("================")
+    print("Tests were succesfull")
+
 if __name__ == "__main__":
-    print(proportionate([Individual(2,4),Individual(1,1),Individual(1,2)], 2))
\ No newline at end of file
+    run_tests()
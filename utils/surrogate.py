@@ -0,0 +1,305 @@
+"""
+Surrogate models for pre-screening of offspring
+
+A surrogate model learns fitness from an archive of truly evaluated
+individuals and predicts fitness of new candidates. Model kernels are
+(features, fitness, candidates, **parameters) -> predicted fitness on
+NumPy feature matrices, Surrogate keeps the archive and screens
+the offspring so that only the most promising fraction is evaluated.
+"""
+import math
+
+import numpy as np
+
+def numeric_features(genomes) -> np.ndarray:
+    """
+    Default features, genome matrix as floats
+    """
+    return np.asarray(genomes, dtype=np.float64).reshape(len(genomes), -1)
+
+def _squared_distances(first : np.ndarray, second : np.ndarray) -> np.ndarray:
+    distances = (first * first).sum(axis=1)[:, np.newaxis] + (second * second).sum(axis=1) - 2 * first @ second.T
+    return np.maximum(distances, 0.0)
+
+def knn(features : np.ndarray, fitness : np.ndarray, candidates : np.ndarray, k : int = 5,
+        **kwargs) -> np.ndarray:
+    """
+    k nearest neighbours, inverse distance weighted mean of their fitness
+    """
+    k = min(k, len(features))
+    distances = _squared_distances(candidates, features)
+    nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    weights = 1.0 / (np.sqrt(np.take_along_axis(distances, nearest, axis=1)) + 1e-12)
+    return (weights * fitness[nearest]).sum(axis=1) / weights.sum(axis=1)
+
+def ridge(features : np.ndarray, fitness : np.ndarray, candidates : np.ndarray, alpha : float = 1e-3,
+          quadratic : bool = True, **kwargs) -> np.ndarray:
+    """
+    Ridge regression on the features, with their squares if quadratic
+    """
+    def design(matrix):
+        columns = [np.ones((len(matrix), 1)), matrix]
+        if quadratic:
+            columns.append(matrix * matrix)
+        return np.hstack(columns)
+    train = design(features)
+    regularization = alpha * np.eye(train.shape[1])
+    regularization[0, 0] = 0.0
+    weights = np.linalg.solve(train.T @ train + regularization, train.T @ fitness)
+    return design(candidates) @ weights
+
+def rbf(features : np.ndarray, fitness : np.ndarray, candidates : np.ndarray, smoothing : float = 1e-8,
+        **kwargs) -> np.ndarray:
+    """
+    Cubic radial basis function interpolation with a linear tail
+    """
+    count, dimension = features.shape
+    tail = np.hstack([np.ones((count, 1)), features])
+    system = np.zeros((count + dimension + 1, count + dimension + 1))
+    system[:count, :count] = np.sqrt(_squared_distances(features, features)) ** 3 + smoothing * np.eye(count)
+    system[:count, count:] = tail
+    system[count:, :count] = tail.T
+    values = np.concatenate([fitness, np.zeros(dimension + 1)])
+    coefficients = np.linalg.lstsq(system, values, rcond=None)[0]
+    basis = np.sqrt(_squared_distances(candidates, features)) ** 3
+    return basis @ coefficients[:count] + np.hstack([np.ones((len(candidates), 1)), candidates]) @ coefficients[count:]
+
+def rank_correlation(first, second) -> float:
+    """
+    Spearman rank correlation, nan for fewer than two values
+    """
+    first, second = np.asarray(first, dtype=np.float64), np.asarray(second, dtype=np.float64)
+    if len(first) < 2:
+        return math.nan
+    first = np.argsort(np.argsort(first, kind="stable"), kind="stable").astype(np.float64)
+    second = np.argsort(np.argsort(second, kind="stable"), kind="stable").astype(np.float64)
+    first -= first.mean()
+    second -= second.mean()
+    norm = math.sqrt((first * first).sum() * (second * second).sum())
+    return float((first * second).sum() / norm) if norm else math.nan
+
+class Surrogate:
+    """
+    Pre-screening of offspring by a surrogate model.
+
+    Offspring are ranked by the predicted fitness and only the best fraction
+    is truly evaluated. Rejected offspring leave their slots to the
+    individuals of the current population in them, with their true fitness,
+    so the population never holds predicted values and does not lose
+    diversity to copies. Slots whose current individual is an elite already
+    carried over get the best individual that is neither. Until the archive
+    has min_samples individuals every offspring is evaluated.
+
+    Args:
+        model: knn, ridge or rbf
+        fraction (float): fraction of offspring truly evaluated
+        archive_size (int): number of the most recent evaluated individuals the model learns from
+        features: genome matrix -> feature matrix, numeric_features by default
+        min_samples (int): archive size needed for screening, at most archive_size,
+            2 * population by default (clamped to archive_size)
+    """
+    def __init__(self, model = knn, fraction : float = 0.5, archive_size : int = 500,
+                 features = numeric_features, min_samples : int = None, **kwargs) -> "Surrogate":
+        if min_samples is not None and min_samples > archive_size:
+            raise ValueError("min_samples {} can not be reached with archive_size {}".format(
+                min_samples, archive_size))
+        self.model = model
+        self.fraction = fraction
+        self.archive_size = archive_size
+        self.features = features
+        self.min_samples = min_samples
+        self.parameters = kwargs
+        self.clear()
+
+    def clear(self):
+        self.archive = None
+        self.archive_fitness = None
+        self.real_evaluations = 0
+        self.surrogate_evaluations = 0
+        self.correlations = []
+
+    def __len__(self) -> int:
+        return 0 if self.archive is None else len(self.archive)
+
+    def state(self) -> dict:
+        """
+        Archive and counters for checkpoints
+        """
+        return {"archive": self.archive, "archive_fitness": self.archive_fitness,
+                "real_evaluations": self.real_evaluations, "surrogate_evaluations": self.surrogate_evaluations,
+                "correlations": list(self.correlations)}
+
+    def restore(self, state : dict):
+        """
+        Restores state saved by state
+        """
+        self.archive = state["archive"]
+        self.archive_fitness = state["archive_fitness"]
+        self.real_evaluations = state["real_evaluations"]
+        self.surrogate_evaluations = state["surrogate_evaluations"]
+        self.correlations = list(state["correlations"])
+
+    def update(self, genomes, fitness):
+        """
+        Adds truly evaluated individuals to the archive
+        """
+        features = self.features(genomes)
+        fitness = np.asarray(fitness, dtype=np.float64)
+        if self.archive is not None:
+            features = np.concatenate([self.archive, features])
+            fitness = np.concatenate([self.archive_fitness, fitness])
+        self.archive = features[-self.archive_size:]
+        self.archive_fitness = fitness[-self.archive_size:]
+
+    def predict(self, genomes) -> np.ndarray:
+        """
+        Predicted fitness of the genomes
+        """
+        self.surrogate_evaluations += len(genomes)
+        return self.model(self.archive, self.archive_fitness, self.features(genomes), **self.parameters)
+
+    def evaluate(self, population, evaluator, rows = None, elites = None) -> np.ndarray:
+        """
+        Screens offspring written into the rows (all by default) of
+        population.next_genomes and fills their population.next_fitness,
+        the population is swapped by the caller. Rows of rejected offspring
+        keep the current individuals of the population, except elites
+        (indices carried over by the caller) which are not copied twice.
+
+        Returns:
+            np.ndarray: indices of the truly evaluated offspring
+        """
+        rows = np.arange(len(population)) if rows is None else np.asarray(rows)
+        genomes = population.next_genomes[rows]
+        size = len(rows)
+        if size == 0:
+            return rows
+        if len(self) < min(self.min_samples or 2 * len(population), self.archive_size):
+            fitness = np.asarray(evaluator.evaluate_batch(genomes), dtype=np.float64)
+            population.next_fitness[rows] = fitness
+            self.real_evaluations += size
+            self.update(genomes, fitness)
+            return rows
+
+        predicted = self.predict(genomes)
+        count = min(size, max(1, math.ceil(self.fraction * size)))
+        order = np.argsort(predicted, kind="stable")
+        chosen, rejected = order[:count], order[count:]
+        fitness = np.asarray(evaluator.evaluate_batch(genomes[chosen]), dtype=np.float64)
+        self.real_evaluations += count
+        self.correlations.append(rank_correlation(predicted[chosen], fitness))
+        self.update(genomes[chosen], fitness)
+
+        survivors = rows[rejected].copy()
+        if elites is not None and len(elites):
+            copied = np.isin(survivors, elites)
+            if copied.any():
+                available = np.setdiff1d(np.arange(len(population)), np.union1d(elites, survivors))
+                available = available[np.argsort(population.fitness[available], kind="stable")]
+                survivors[copied] = available[:copied.sum()]
+        population.next_genomes[rows[rejected]] = population.genomes[survivors]
+        population.next_fitness[rows[rejected]] = population.fitness[survivors]
+        population.next_fitness[rows[chosen]] = fitness
+        return rows[chosen]
+
+    def rank_correlation(self) -> float:
+        """
+        Mean rank correlation of predicted and true fitness of screened generations
+        """
+        correlations = [value for value in self.correlations if not math.isnan(value)]
+        return float(np.mean(correlations)) if correlations else math.nan
+
+    def report(self) -> dict:
+        """
+        Real against surrogate evaluations and quality of the surrogate
+        """
+        return {
+            "real_evaluations": self.real_evaluations,
+            "surrogate_evaluations": self.surrogate_evaluations,
+            "screened_generations": len(self.correlations),
+            "rank_correlation": self.rank_correlation(),
+        }
+
+    def __repr__(self) -> str:
+        return "{}, evaluated fraction: {}, archive: {}/{}, real evaluations: {}, surrogate evaluations: {}, rank correlation: {:.3f}".format(
+            self.model.__name__, self.fraction, len(self), self.archive_size, self.real_evaluations,
+            self.surrogate_evaluations, self.rank_correlation())
+
+def test_models():
+    """
+    Test that the models rank unseen points of smooth functions
+    """
+    print("Testing surrogate models")
+    rng = np.random.default_rng(0)
+    features = rng.uniform(-5, 5, (200, 5))
+    candidates = rng.uniform(-5, 5, (50, 5))
+    scales = np.arange(1, 6)
+    for function in (lambda x: (x * x * scales).sum(axis=1), lambda x: (x - 1).sum(axis=1)):
+        for model in (knn, ridge, rbf):
+            predicted = model(features, function(features), candidates)
+            assert predicted.shape == (50,)
+            assert rank_correlation(predicted, function(candidates)) > 0.6, model.__name__
+    assert rank_correlation([1, 2, 3], [30, 20, 10]) == -1.0
+    assert math.isnan(rank_correlation([1], [2]))
+
+def test_screening():
+    """
+    Test that screening saves evaluations, keeps true fitness and diversity in the population
+    """
+    from search.search import SearchEngine
+    from utils import fitness, initialization, perturbation, replacement, selection
+    from utils.condition import LoopCondition
+
+    print("Testing surrogate screening")
+    for model in (knn, ridge, rbf):
+        function = fitness.FitnessFunction(fitness.sphere, coefficients = [0.0] * 5)
+        surrogate = Surrogate(model, fraction = 0.25)
+        engine = SearchEngine(function, perturbation.Mutator(perturbation.gaussian, 0.0, deviation = 1.0), LoopCondition(30),
+            replacement.Replacer(replacement.elite, "uniform", 2), selection.Selector(selection.tournament, 20, tourn_size = 3),
+            surrogate = surrogate, rng = 4, hooks = [])
+        initial = initialization.populate_array(20, lambda rng: initialization.real_vector(5, -5, 5, rng),
+                                                rng = np.random.default_rng(5))
+        population = engine.evolve(engine.start_ea(initial))
+        report = surrogate.report()
+        assert function.calls_made == 20 + report["real_evaluations"] < 20 + 18 * 30
+        assert report["surrogate_evaluations"] == 18 * 28 and report["screened_generations"] == 28
+        assert report["rank_correlation"] > 0
+        assert (population.fitness == function.evaluate_batch(population.genomes)).all()
+        assert engine.timer.totals()["saved"] == 20 * 30 - report["real_evaluations"]
+
+    function = fitness.FitnessFunction(fitness.rastrigin)
+    engine = SearchEngine(function, perturbation.BatchMutator(perturbation.gaussian_batch, deviation = 0.3),
+        LoopCondition(40), replacement.Replacer(replacement.elite, "uniform", 2),
+        selection.Selector(selection.tournament, 40, tourn_size = 2),
+        surrogate = Surrogate(knn, fraction = 0.25), rng = 6, hooks = [])
+    population = engine.evolve(engine.start_ea(initialization.populate_array(40,
+        lambda rng: initialization.real_vector(10, -5, 5, rng), rng = np.random.default_rng(7))))
+    assert len(np.unique(population.genomes, axis = 0)) == 40
+
+    surrogate = Surrogate(knn, fraction = 0.25, archive_size = 500)
+    engine = SearchEngine(fitness.FitnessFunction(fitness.sphere, coefficients = [0.0] * 3),
+        perturbation.BatchMutator(perturbation.gaussian_batch, deviation = 0.3), LoopCondition(3),
+        replacement.Replacer(replacement.elite, "uniform", 2), selection.Selector(selection.tournament, 300),
+        surrogate = surrogate, rng = 8, hooks = [])
+    engine.evolve(engine.start_ea(initialization.populate_array(300,
+        lambda rng: initialization.real_vector(3, -5, 5, rng), rng = np.random.default_rng(9))))
+    assert surrogate.report()["screened_generations"] == 2
+    try:
+        Surrogate(min_samples = 600, archive_size = 500)
+        assert False
+    except ValueError:
+        pass
+
+def run_tests():
+    """
+    Run tests for surrogates
+    """
+    print("Running tests...")
+    print("================")
+    test_models()
+    test_screening()
+    print("================")
+    print("Tests were succesfull")
+
+if __name__ == "__main__":
+    run_tests()
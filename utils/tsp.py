@@ -0,0 +1,181 @@
+"""
+Travelling salesman problem representation
+"""
+import numpy as np
+
+from utils import randomness
+from utils.fitness import FitnessFunction
+from utils.perturbation import apply_move
+from utils.population import City, EdgeMatrix, euclidean
+
+class TSPProblem:
+    """
+    TSP instance with a precomputed edge matrix.
+
+    Routes are represented as integer arrays of city indices, so
+    evaluating a route is a single gather over the edge matrix.
+    Routes made of City objects are supported through encode/decode.
+    """
+    def __init__(self, cities : "list[City]" = None, coordinates = None, matrix = None,
+                 metric = euclidean, mode : str = "full", dtype = np.float32,
+                 name : str = "") -> "TSPProblem":
+        if cities is not None and coordinates is None and matrix is None:
+            coordinates = [(city.x, city.y) for city in cities]
+        self.name = name
+        self.cities = cities
+        self.edges = EdgeMatrix(matrix=matrix, coordinates=coordinates,
+                                metric=metric, mode=mode, dtype=dtype)
+        self.indices = {} if cities is None else {id(city): pos for pos, city in enumerate(cities)}
+
+    def __len__(self) -> int:
+        return len(self.edges)
+
+    def __repr__(self) -> str:
+        return "{}, cities: {}, edge matrix: {}".format(self.name or "TSPProblem",
+            len(self), self.edges.mode)
+
+    def encode(self, route : "list[City]"):
+        """
+        City route -> array of city indices
+        """
+        return np.fromiter((self.indices[id(city)] for city in route),
+                           dtype=np.intp, count=len(route))
+
+    def decode(self, route):
+        """
+        Array of city indices -> City route
+        """
+        return [self.cities[i] for i in route]
+
+    def random_route(self, rng : np.random.Generator = None):
+        """
+        Returns random permutation of city indices
+        """
+        return randomness.resolve(rng).permutation(len(self)).astype(np.intp)
+
+    def route_distance(self, data, **kwargs):
+        """
+        Returns distance of given route of city indices,
+        same signature as fitness functions
+        """
+        return self.edges.route_length(data)
+
+    def route_distance_batch(self, data, **kwargs):
+        """
+        Returns distances of a matrix of routes, one route per row
+        """
+        return self.edges.route_lengths(data)
+
+    def nearest_neighbours(self, count : int):
+        """
+        Returns matrix of the count nearest cities of each city, closest first
+        """
+        size = len(self)
+        count = min(count, size - 1)
+        neighbours = np.empty((size, count), dtype=np.intp)
+        for city in range(size):
+            row = np.array(self.edges.row(city), dtype=np.float64)
+            row[city] = np.inf
+            nearest = np.argpartition(row, count - 1)[:count]
+            neighbours[city] = nearest[np.argsort(row[nearest], kind="stable")]
+        return neighbours
+
+    def fitness_function(self, **kwargs) -> FitnessFunction:
+        """
+        Returns fitness function over index routes with batch
+        and incremental evaluation wired in
+        """
+        return FitnessFunction(self.route_distance, delta = self.route_delta,
+                               batch_function = self.route_distance_batch, **kwargs)
+
+    def move_gain(self, route, move : tuple):
+        """
+        Returns change of the route length caused by applying the move,
+        only the edges touched by the move are visited
+        """
+        size = len(route)
+        distance = self.edges.distance if self.edges.matrix is None else self.edges.matrix.item
+        kind = move[0]
+        if kind == "reverse":
+            _, start, end = move
+            if end - start + 1 >= size - 1:
+                return 0.0
+            before, after = route[start - 1], route[(end + 1) % size]
+            return (float(distance(before, route[end])) + float(distance(route[start], after))
+                - float(distance(before, route[start])) - float(distance(route[end], after)))
+
+        assert kind == "swap"
+        _, first, second = move
+        swapped = {first: route[second], second: route[first]}
+        gain = 0.0
+        for pos in {(first - 1) % size, first, (second - 1) % size, second}:
+            following = (pos + 1) % size
+            gain -= float(distance(route[pos], route[following]))
+            gain += float(distance(swapped.get(pos, route[pos]),
+                                   swapped.get(following, route[following])))
+        return gain
+
+    def route_delta(self, data, moves : list, fitness : float, state = None, **kwargs):
+        """
+        Returns length of the route data, given length of the route it was
+        made from by the moves. Moves are undone from data backwards,
+        so only a single copy of the route is needed for multiple moves.
+
+        Returns:
+            tuple: (route length, state)
+        """
+        route = data if len(moves) == 1 else np.array(data, copy=True)
+        for move in reversed(moves):
+            fitness -= self.move_gain(route, move)
+            if len(moves) > 1:
+                apply_move(route, move)
+        return fitness, state
+
+def test_route_distance():
+    """
+    Test matrix route distance against City distances
+    """
+    print("Testing tsp route distance")
+    cities = [City(i, x, y) for i, (x, y) in enumerate([(0, 0), (3, 0), (3, 4), (0, 4), (1, 2)])]
+    route = [cities[i] for i in (0, 4, 2, 1, 3)]
+    expected = sum(route[i].distance(route[(i + 1) % len(route)]) for i in range(len(route)))
+    for mode in ("full", "lazy"):
+        problem = TSPProblem(cities, mode=mode)
+        assert abs(problem.route_distance(problem.encode(route)) - expected) < 1e-4
+        assert problem.decode(problem.encode(route)) == route
+    assert TSPProblem(matrix=[[0, 1, 2], [1, 0, 3], [2, 3, 0]]).route_distance([0, 1, 2]) == 6
+    assert sorted(TSPProblem(cities).random_route()) == [0, 1, 2, 3, 4]
+    routes = np.array([TSPProblem(cities).random_route() for i in range(4)])
+    for mode in ("full", "lazy"):
+        problem = TSPProblem(cities, mode=mode)
+        assert np.allclose(problem.fitness_function().evaluate_batch(routes),
+                           [problem.route_distance(route) for route in routes])
+
+def test_route_delta():
+    """
+    Test incremental route distance against full evaluation
+    """
+    print("Testing tsp route delta")
+    problem = TSPProblem(coordinates=np.random.default_rng(2).random((30, 2)))
+    for moves in ([("swap", 3, 17)], [("swap", 0, 29)], [("swap", 4, 5)], [("reverse", 0, 28)],
+                  [("reverse", 2, 11), ("swap", 11, 12), ("reverse", 25, 29), ("swap", 1, 3)]):
+        parent = problem.random_route()
+        child = parent.copy()
+        for move in moves:
+            apply_move(child, move)
+        fitness, _ = problem.route_delta(child, moves, problem.route_distance(parent))
+        assert abs(fitness - problem.route_distance(child)) < 1e-4
+
+def run_tests():
+    """
+    Run tests for tsp problem
+    """
+    print("Running tests...")
+    print("================")
+    test_route_distance()
+    test_route_delta()
+    print("================")
+    print("Tests were succesfull")
+
+if __name__ == "__main__":
+    run_tests()
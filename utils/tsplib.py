@@ -0,0 +1,280 @@
+"""
+TSPLIB instance loader
+
+Reads NODE_COORD_SECTION and EDGE_WEIGHT_SECTION in the standard formats,
+distances follow the EDGE_WEIGHT_TYPE of the instance. Parsed arrays are
+cached in a .npy sidecar next to the instance and memory mapped on reload.
+"""
+import math
+import os
+
+import numpy as np
+
+from utils.population import City, euclidean
+from utils.tsp import TSPProblem
+
+EARTH_RADIUS = 6378.388
+
+def nint(values):
+    """
+    TSPLIB nearest integer rounding
+    """
+    return np.floor(values + 0.5)
+
+def euc_2d(start, finish):
+    """
+    Euclidean distance rounded to the nearest integer
+    """
+    return nint(euclidean(start, finish))
+
+def ceil_2d(start, finish):
+    """
+    Euclidean distance rounded up
+    """
+    return np.ceil(euclidean(start, finish))
+
+def man_2d(start, finish):
+    """
+    Manhattan distance rounded to the nearest integer
+    """
+    return nint(np.abs(start - finish).sum(axis=-1))
+
+def max_2d(start, finish):
+    """
+    Maximum distance rounded to the nearest integer
+    """
+    return nint(np.abs(start - finish).max(axis=-1))
+
+def att(start, finish):
+    """
+    ATT pseudo-euclidean distance
+    """
+    distance = euclidean(start, finish) / math.sqrt(10)
+    rounded = nint(distance)
+    return np.where(rounded < distance, rounded + 1, rounded)
+
+def geo_radians(coordinates):
+    """
+    Converts TSPLIB GEO coordinates (DDD.MM degrees and minutes) to radians
+    """
+    degrees = np.trunc(coordinates)
+    return math.pi * (degrees + 5.0 * (coordinates - degrees) / 3.0) / 180.0
+
+def geo(start, finish):
+    """
+    Geographical distance in km, coordinates in radians as given by geo_radians
+    """
+    q1 = np.cos(start[..., 1] - finish[..., 1])
+    q2 = np.cos(start[..., 0] - finish[..., 0])
+    q3 = np.cos(start[..., 0] + finish[..., 0])
+    cosine = np.clip(0.5 * ((1.0 + q1) * q2 - (1.0 - q1) * q3), -1.0, 1.0)
+    return np.trunc(EARTH_RADIUS * np.arccos(cosine) + 1.0)
+
+metrics = {
+    "EUC_2D": euc_2d,
+    "CEIL_2D": ceil_2d,
+    "MAN_2D": man_2d,
+    "MAX_2D": max_2d,
+    "ATT": att,
+    "GEO": geo,
+}
+
+SECTIONS = ("NODE_COORD_SECTION", "EDGE_WEIGHT_SECTION", "DISPLAY_DATA_SECTION",
+            "TOUR_SECTION", "FIXED_EDGES_SECTION", "EOF")
+
+def read_header(file) -> dict:
+    """
+    Reads specification part of the file up to the first section,
+    the section name is stored under "SECTION"
+    """
+    header = {}
+    while True:
+        position = file.tell()
+        line = file.readline()
+        if not line:
+            break
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if stripped[:1].isdigit() or stripped[:1] == "-":
+            # file without specification, plain "index x y" lines
+            file.seek(position)
+            header["SECTION"] = "NODE_COORD_SECTION"
+            break
+        keyword = stripped.split(":")[0].strip()
+        if keyword in SECTIONS:
+            header["SECTION"] = keyword
+            break
+        if ":" in stripped:
+            header[keyword] = stripped.split(":", 1)[1].strip()
+    return header
+
+def explicit_matrix(weights, dimension : int, edge_format : str):
+    """
+    Builds full matrix from EDGE_WEIGHT_SECTION values
+    """
+    if edge_format == "FULL_MATRIX":
+        return weights[:dimension * dimension].reshape(dimension, dimension)
+
+    column_wise = {"UPPER_COL": "LOWER_ROW", "LOWER_COL": "UPPER_ROW",
+                   "UPPER_DIAG_COL": "LOWER_DIAG_ROW", "LOWER_DIAG_COL": "UPPER_DIAG_ROW"}
+    edge_format = column_wise.get(edge_format, edge_format)
+    offset = 0 if "DIAG" in edge_format else 1
+    if edge_format.startswith("UPPER"):
+        rows, columns = np.triu_indices(dimension, offset)
+    elif edge_format.startswith("LOWER"):
+        rows, columns = np.tril_indices(dimension, -offset)
+    else:
+        raise ValueError("Unsupported EDGE_WEIGHT_FORMAT: " + edge_format)
+
+    matrix = np.zeros((dimension, dimension))
+    matrix[rows, columns] = weights[:len(rows)]
+    matrix[columns, rows] = weights[:len(rows)]
+    return matrix
+
+def parse(path : str):
+    """
+    Parses TSPLIB file
+
+    Returns:
+        tuple: (header, coordinates or explicit edge matrix)
+    """
+    with open(path, "r") as file:
+        header = read_header(file)
+        values = np.array(file.read().replace("EOF", " ").split(), dtype=object)
+
+    section = header.get("SECTION")
+    if section == "NODE_COORD_SECTION":
+        dimension = int(header.get("DIMENSION", len(values) // 3))
+        table = values[:dimension * 3].astype(np.float64).reshape(dimension, 3)
+        return header, table[:, 1:]
+    if section == "EDGE_WEIGHT_SECTION":
+        dimension = int(header["DIMENSION"])
+        count = np.argmax([not value.lstrip("-").replace(".", "", 1).isdigit() for value in values] + [True])
+        weights = values[:count].astype(np.float64)
+        return header, explicit_matrix(weights, dimension, header.get("EDGE_WEIGHT_FORMAT", "FULL_MATRIX"))
+    raise ValueError("No NODE_COORD_SECTION or EDGE_WEIGHT_SECTION in " + str(path))
+
+def load_arrays(path : str, cache : bool = True, cache_dir : str = None):
+    """
+    Returns header and parsed array of the instance, using
+    a memory mapped .npy sidecar when it is newer than the instance
+    """
+    directory = cache_dir or os.path.dirname(os.path.abspath(path))
+    sidecar = os.path.join(directory, os.path.basename(path) + ".npy")
+    if cache and os.path.exists(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(path):
+        with open(path, "r") as file:
+            header = read_header(file)
+        return header, np.load(sidecar, mmap_mode="r")
+
+    header, array = parse(path)
+    if cache:
+        try:
+            temporary = sidecar + ".tmp.npy"
+            np.save(temporary, array)
+            os.replace(temporary, sidecar)
+        except OSError:
+            pass
+    return header, array
+
+def load(path : str, mode : str = "full", dtype = np.float32, cache : bool = True,
+         cache_dir : str = None) -> TSPProblem:
+    """
+    Loads TSPLIB instance as TSPProblem with the metric of its EDGE_WEIGHT_TYPE,
+    files without specification are treated as plain euclidean coordinates
+    """
+    header, array = load_arrays(path, cache, cache_dir)
+    name = header.get("NAME", os.path.basename(path))
+    weight_type = header.get("EDGE_WEIGHT_TYPE")
+
+    if weight_type == "EXPLICIT" or header.get("SECTION") == "EDGE_WEIGHT_SECTION":
+        return TSPProblem(matrix=array, dtype=dtype, name=name)
+    if weight_type is None:
+        return TSPProblem(coordinates=array, mode=mode, dtype=dtype, name=name)
+    if weight_type not in metrics:
+        raise ValueError("Unsupported EDGE_WEIGHT_TYPE: " + weight_type)
+    coordinates = geo_radians(np.asarray(array)) if weight_type == "GEO" else array
+    return TSPProblem(coordinates=coordinates, metric=metrics[weight_type],
+                      mode=mode, dtype=dtype, name=name)
+
+def load_cities(path : str, cache : bool = True) -> "list[City]":
+    """
+    Loads coordinates of the instance as City list, City routes are measured
+    by plain euclidean distance so only EUC_2D instances (or files without
+    specification) are accepted, use load for the other edge weight types
+    """
+    header, coordinates = load_arrays(path, cache)
+    if header.get("SECTION") != "NODE_COORD_SECTION":
+        raise ValueError("No city coordinates in " + str(path))
+    if header.get("EDGE_WEIGHT_TYPE", "EUC_2D") != "EUC_2D":
+        raise ValueError("City routes do not support EDGE_WEIGHT_TYPE " + header["EDGE_WEIGHT_TYPE"]
+                         + " of " + str(path) + ", use load")
+    return [City(i + 1, x, y) for i, (x, y) in enumerate(np.asarray(coordinates).tolist())]
+
+def _test_path(file_name : str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test_data", file_name)
+
+def test_metrics():
+    """
+    Test distances of the edge weight types
+    """
+    print("Testing tsplib metrics")
+    problem = load(_test_path("att48.tsp"), cache = False)
+    assert problem.edges.distance(0, 1) == 1495
+    problem = load(_test_path("brazil58.tsp"), cache = False)
+    assert problem.edges.distance(0, 1) == problem.edges.distance(1, 0) == 2635
+    assert problem.edges.distance(0, 57) == 739 and problem.edges.distance(57, 56) == 962
+    assert load(_test_path("burma14.tsp"), cache = False).edges.distance(0, 1) == 153
+    assert load(_test_path("eil101.tsp"), cache = False).edges.distance(0, 1) == 33
+
+def test_formats():
+    """
+    Test explicit edge weight formats against each other
+    """
+    print("Testing tsplib formats")
+    matrix = np.array([[0, 1, 2, 3], [1, 0, 4, 5], [2, 4, 0, 6], [3, 5, 6, 0]])
+    rows, columns = np.triu_indices(4, 1)
+    assert (explicit_matrix(matrix[rows, columns], 4, "UPPER_ROW") == matrix).all()
+    assert (explicit_matrix(matrix[rows, columns], 4, "LOWER_COL") == matrix).all()
+    rows, columns = np.tril_indices(4)
+    assert (explicit_matrix(matrix[rows, columns], 4, "LOWER_DIAG_ROW") == matrix).all()
+    assert (explicit_matrix(matrix[rows, columns], 4, "UPPER_DIAG_COL") == matrix).all()
+    assert (explicit_matrix(matrix.ravel(), 4, "FULL_MATRIX") == matrix).all()
+
+def test_cache():
+    """
+    Test that the sidecar is memory mapped read-only on reload
+    and that City lists are refused for non euclidean instances
+    """
+    import shutil
+    import tempfile
+
+    print("Testing tsplib cache")
+    with tempfile.TemporaryDirectory() as directory:
+        path = shutil.copy(_test_path("brazil58.tsp"), directory)
+        first = load(path)
+        assert os.path.exists(path + ".npy") and not isinstance(first.edges.matrix, np.memmap)
+        second = load(path)
+        assert isinstance(second.edges.matrix, np.memmap) and not second.edges.matrix.flags.writeable
+        assert second.route_distance(np.arange(58)) == first.route_distance(np.arange(58))
+    assert len(load_cities(_test_path("eil101.tsp"), cache = False)) == 101
+    try:
+        load_cities(_test_path("att48.tsp"), cache = False)
+        assert False
+    except ValueError:
+        pass
+
+def run_tests():
+    """
+    Run tests for tsplib loader
+    """
+    print("Running tests...")
+    print("================")
+    test_metrics()
+    test_formats()
+    test_cache()
+    print("================")
+    print("Tests were succesfull")
+
+if __name__ == "__main__":
+    run_tests()